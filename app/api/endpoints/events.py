@@ -1,4 +1,5 @@
 import asyncio
+import json
 from typing import Any
 
 from fastapi import APIRouter
@@ -9,14 +10,23 @@ from fastapi.responses import StreamingResponse
 from starlette.background import BackgroundTask
 
 from app.api.sse_eventbus import event_bus
+from app.api.ws_manager import STATE_RESYNC
 from app.api.ws_manager import ws_manager
+from app.api.ws_subscriptions import SessionSubscriptions
+from app.core.config import settings
 from app.core.exceptions import EXC
 from app.core.exceptions import ErrorCode
 from app.core.logging import logger
+from app.core.utils import generate_id
+from app.services.expiry import expiry_engine
 from app.services.redis_service import redis_service
+from app.services.session_sweeper import session_sweeper
+from app.services.status_watcher import status_watcher
 
 router = APIRouter()
 
+STATUS_FIELDS = ['status', 'progress', 'position']
+
 
 @router.get('/sse/{session_id}')
 async def listen_events(request: Request, session_id: str):
@@ -26,12 +36,14 @@ async def listen_events(request: Request, session_id: str):
 
     client_host = request.client.host
     logger.info(f'SSE connection established for session {session_id} from {client_host}')
-    await event_bus.add_connection(session_id, connection_info={'client_host': client_host})
+    connection_id = await event_bus.add_connection(session_id, connection_info={'client_host': client_host})
+
+    last_event_id = request.headers.get('last-event-id')
 
     async def event_generator():
         try:
-            async for event in event_bus.listen(session_id):
-                yield f'data: {event}\n\n'
+            async for frame in event_bus.listen(session_id, last_event_id=last_event_id):
+                yield frame
             # while True:
             #     if await request.is_disconnected():
             #         logger.info(f"Client disconnected for session {session_id} from {client_host}")
@@ -50,7 +62,7 @@ async def listen_events(request: Request, session_id: str):
             yield 'event: error\ndata: An unexpected error occurred\n\n'
             logger.exception(f'Error in SSE stream: {e}')
         finally:
-            await event_bus.remove_connection(session_id)
+            await event_bus.remove_connection(connection_id)
             logger.info(f'SSE connection closed for session {session_id} from {client_host}')
 
     return StreamingResponse(
@@ -64,29 +76,77 @@ async def listen_events(request: Request, session_id: str):
 
 @router.websocket('/ws')
 async def websocket_endpoint(websocket: WebSocket, session_id: str | None = Cookie(None)):
-    await ws_manager.connect(websocket, session_id)
+    # A socket without a session, e.g. of a dashboard, only follows the sessions it subscribes to
+    client_id = session_id or f'anonymous:{generate_id()}'
+    await ws_manager.connect(websocket, client_id)
     if session_id is None:
         await ws_manager.send_personal_message(websocket, {'error': 'Session not found'})
 
-    try:
-        while True:
-            session_data = await redis_service.get_session_data_multiple(
-                session_id,
-                fields=['status', 'progress', 'position'],
-            )
-
-            await ws_manager.send_personal_message(websocket, session_data)
+    subscriptions = SessionSubscriptions(
+        ws_manager,
+        status_watcher,
+        client_id,
+        fields=STATUS_FIELDS,
+        limit=settings.WS_MAX_SUBSCRIPTIONS,
+    )
 
-            await asyncio.sleep(1)
+    async def push_status() -> None:
+        if session_id is None:
+            await asyncio.Future()  # Nothing to push until the client disconnects
+        async for session_data in status_watcher.watch(session_id, fields=STATUS_FIELDS):
+            if not ws_manager.send_state(client_id, session_data):
+                return
+
+    async def receive_messages() -> None:
+        # Client messages are resync requests and subscription changes, receiving also detects the disconnect
+        while (message := await websocket.receive())['type'] != 'websocket.disconnect':
+            try:
+                request = json.loads(message.get('text') or message.get('bytes') or '{}')
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(request, dict):
+                continue
+            if request.get('type') == STATE_RESYNC:
+                ws_manager.resync(client_id, request.get('session_id'))
+            else:
+                subscriptions.handle(request)
+
+    tasks = {asyncio.create_task(push_status()), asyncio.create_task(receive_messages())}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()  # Re-raise errors of the status stream
     finally:
-        ws_manager.disconnect(session_id)
+        for task in tasks:
+            task.cancel()
+        await subscriptions.close()
+        await ws_manager.disconnect(client_id, websocket)
 
 
 @router.get('/active-connections')
-async def get_active_connections() -> dict[str, Any]:
-    """Получить список активных SSE подключений.
-    Возвращает словарь, где ключ - это user_id, а значение - количество активных подключений для этого пользователя.
+async def get_active_connections(cursor: int = 0, count: int = 100) -> dict[str, Any]:
+    """Получить список активных SSE подключений всего кластера.
+    Возвращает счетчики подключений и узлов и одну страницу подключений. Следующая страница запрашивается
+    с возвращенным cursor, cursor=0 в ответе означает, что страниц больше нет.
     """
     # Здесь можно добавить проверку прав доступа, если это необходимо
-    active_connections = await event_bus.get_active_connections()
+    active_connections = await event_bus.get_active_connections(cursor, count)
     return active_connections
+
+
+@router.get('/stats')
+async def get_stats() -> dict[str, Any]:
+    """Event bus internals of the current worker: pub/sub subscriptions, pending message expirations and
+    outbound queues of the SSE and WebSocket connections, WebSocket broadcast fan-out times, the hit ratio
+    of the session cache, the keys reclaimed by the session sweeper and the throttled progress writes.
+    """
+    return {
+        'pubsub': event_bus.backend.stats(),
+        'expiry': expiry_engine.stats(),
+        'sse_queues': event_bus.queue_metrics.stats(),
+        'ws_queues': ws_manager.queue_metrics.stats(),
+        'ws_broadcasts': ws_manager.fanout_metrics.stats(),
+        'session_cache': redis_service.cache.stats(),
+        'progress_writer': redis_service.progress.stats(),
+        'session_sweeper': session_sweeper.stats(),
+    }
@@ -20,6 +20,7 @@ from app.schemas.events import Position
 from app.schemas.session import SessionPublic
 from app.schemas.task import TaskStatus
 from app.services.processing import r_queue
+from app.services.redis_service import TaskAlreadyQueuedError
 from app.services.redis_service import redis_service
 from app.services.s3_async import ClientType
 from app.services.s3_async import s3
@@ -28,6 +29,9 @@ router = APIRouter()
 
 CHUNK_SIZE = 1024 * 1024 * 5  # 64 kB
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'ogg'}
+# Statuses a new upload may start from, a session with a task being uploaded, queued or processed is refused
+UPLOAD_AUDIO_ALLOWED_FROM = set(TaskStatus) - {TaskStatus.IN_PROGRESS, TaskStatus.UPLOADING, TaskStatus.QUEUED}
+UPLOAD_ALLOWED_FROM = set(TaskStatus) - {TaskStatus.IN_PROGRESS, TaskStatus.QUEUED}
 FILE_MAX_SIZE = 100 * 1024 * 1024  # 100 MB
 
 
@@ -75,18 +79,18 @@ async def upload_audio(
     """
     # cur_status = await redis_service.get_session_data(session_id, status=True)
     # cur_status = cur_status.get('status')
-    cur_status = await redis_service.get_session_data_single(session_id, field='status')
-    # todo simplify
-    # if cur_status == TaskStatus.IN_PROGRESS.value \
-    #     or cur_status == TaskStatus.UPLOADING.value \
-    #     or cur_status == TaskStatus.QUEUED.value:
-    #     raise EXC(ErrorCode.TaskAlreadyExists)
-
-    if TaskStatus(cur_status) in [TaskStatus.IN_PROGRESS, TaskStatus.UPLOADING, TaskStatus.QUEUED]:
+    # One atomic check-and-set: of two concurrent uploads of the session only one gets here
+    applied, cur_status = await redis_service.transition(
+        session_id,
+        TaskStatus.UPLOADING,
+        allowed_from=UPLOAD_AUDIO_ALLOWED_FROM,
+        unqueued=True,
+    )
+    if cur_status is None:
+        raise EXC(ErrorCode.SessionNotFound)
+    if not applied:
         raise EXC(ErrorCode.TaskAlreadyExists)
 
-    await redis_service.set_status(session_id, TaskStatus.UPLOADING)
-
     # Check if audio is incorrect
     vocal_extension = vocal.filename.split('.')[-1].lower()
     instrumental_extension = instrumental.filename.split('.')[-1].lower()
@@ -100,14 +104,6 @@ async def upload_audio(
         await redis_service.set_status(session_id, TaskStatus.FAILED)
         raise EXC(ErrorCode.ValidationError, details={'reason': 'Files must have allowed extensions'})
 
-    # position = await redis_service.get_position(session_id)
-    # position = await redis_service.get_session_data(session_id, position=True)
-    # position = position.get('position')
-    position = await redis_service.get_session_data_single(session_id, field='position')
-
-    if position is not None:
-        raise EXC(ErrorCode.TaskAlreadyExists)
-
     track_id = generate_id(datetime_flag=True)
 
     total_size = vocal.size + instrumental.size
@@ -131,14 +127,15 @@ async def upload_audio(
                         notification_type=NotificationType.INFO,
                         position=Position.CENTER),
                 )
-                await event_bus.post(session_id, event)
-                await redis_service.set_progress(session_id, int(chunks_uploaded * 100 / total_chunks))
+                await event_bus.post(session_id, event, coalesce=True)
+                redis_service.progress.update(session_id, int(chunks_uploaded * 100 / total_chunks))
                 chunks_uploaded += 1
 
     await redis_service.set_progress(session_id, 0)
 
     await upload_file(vocal, f'{session_id}/{track_id}/V.mp3', 'svaha-mini-input')
     await upload_file(instrumental, f'{session_id}/{track_id}/M.mp3', 'svaha-mini-input')
+    await redis_service.progress.flush(session_id)
 
     event = Event(
         name='progress',
@@ -156,14 +153,18 @@ async def upload_audio(
     message = {
         'session_id': session_id,
         'task_id': track_id,
+        'input_size': total_size,
     }
-    if not await r_queue.send_to_queue(message):
-        redis_service.set_status(session_id, TaskStatus.FAILED)
+    try:
+        position = await r_queue.send_to_queue(message)
+    except TaskAlreadyQueuedError:
+        # A task of the session was queued while this one was uploaded, the session status follows that task
+        await redis_service.transition(session_id, TaskStatus.QUEUED, allowed_from={TaskStatus.UPLOADING})
+        raise EXC(ErrorCode.TaskAlreadyExists) from None
+    if position is None:
+        await redis_service.set_status(session_id, TaskStatus.FAILED)
         raise EXC(ErrorCode.DbError)
 
-    # position = await redis_service.get_session_data(session_id, position=True)
-    position = await redis_service.get_session_data_single(session_id, field='position')
-
     return SessionPublic(session_id=session_id, position=position)
 
 
@@ -174,13 +175,17 @@ async def upload(
         session_id: str,
         track_id: str,
 ) -> SessionPublic:
-    cur_status = await redis_service.get_session_data_single(session_id, field='status')
-
-    if TaskStatus(cur_status) in [TaskStatus.IN_PROGRESS, TaskStatus.QUEUED]:  # todo: We need TaskStatus.UPLOADING?
+    # todo: We need TaskStatus.UPLOADING?
+    applied, cur_status = await redis_service.transition(
+        session_id,
+        TaskStatus.UPLOADING,
+        allowed_from=UPLOAD_ALLOWED_FROM,
+    )
+    if cur_status is None:
+        raise EXC(ErrorCode.SessionNotFound)
+    if not applied:
         raise EXC(ErrorCode.TaskAlreadyExists)
 
-    await redis_service.set_status(session_id, TaskStatus.UPLOADING)
-
     content_length = int(request.headers.get('content-length', 0))
     content_type = request.headers.get('content-type')
 
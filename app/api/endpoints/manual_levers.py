@@ -11,6 +11,7 @@ from app.api.sse_eventbus import Position
 from app.api.sse_eventbus import broadcast_msg
 from app.api.sse_eventbus import event_bus
 from app.api.sse_eventbus import wg_msg
+from app.api.ws_manager import ws_manager
 from app.core.exceptions import EXC
 from app.core.exceptions import ErrorCode
 
@@ -31,7 +32,7 @@ async def mock_progress(session_id: str):
                 notification_type=NotificationType.INFO,
                 position=Position.CENTER),
         )
-        await event_bus.post(session_id, event)
+        await event_bus.post(session_id, event, coalesce=True)
         await asyncio.sleep(1)
 
     event = Event(
@@ -104,6 +105,18 @@ async def send_wg_message_test(session_id: str | None = Cookie(None)) -> dict[st
     return await send_wg_message(session_id)
 
 
+@router.post('/send-ws-message/{session_id}')
+async def send_ws_message(session_id: str) -> dict[str, Any]:
+    """Send a message to the WebSocket of the session, on whichever node it is connected."""
+    if not session_id:
+        raise EXC(ErrorCode.SessionNotFound)
+
+    delivered = await ws_manager.route(
+        session_id, {'type': 'message', 'message': f'Hello {session_id} from ws message'},
+    )
+    return {'status': delivered}
+
+
 @router.post('/send-msg-to-all/{msg}')
 async def send_msg_to_all(msg: str):
     status = await broadcast_msg(
@@ -1,9 +1,12 @@
+import json
 import time
+from collections.abc import Iterator
 from typing import Any
 
 from fastapi import APIRouter
 from fastapi import Cookie
 from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 
 from app.core.config import settings
 from app.core.exceptions import EXC
@@ -12,26 +15,19 @@ from app.core.logging import logger
 from app.core.utils import generate_id
 from app.schemas.session import Session
 from app.schemas.session import SessionPublic
+from app.schemas.session import SessionRecord
+from app.schemas.session import SessionStatusQuery
+from app.services.eta import EtaSnapshot
+from app.services.eta import eta_model
 from app.services.processing import r_queue
+from app.services.redis_service import TaskAlreadyQueuedError
 from app.services.redis_service import TaskStatus
 from app.services.redis_service import redis_base
 from app.services.redis_service import redis_service
 
 router = APIRouter()
 
-
-class AvgProcTime:
-    def __init__(self):
-        self.avg_time = 0  # Average processing time in seconds
-
-    async def set_avg_processing_time(self, time: int) -> None:
-        self.avg_time = (self.avg_time + time) / 2
-
-    async def get_avg_processing_time(self) -> int:
-        return self.avg_time
-
-
-avg_time_manager = AvgProcTime()
+STATUS_FIELDS = ['status', 'progress', 'position', 'completed_timestamp', 'download_url', 'input_size']
 
 
 # async def get_average_processing_time() -> int:
@@ -45,7 +41,8 @@ async def get_session(session_id: str | None = Cookie(None)) -> JSONResponse:
     """
     logger.info('Hello world!')
     response = JSONResponse(content={})
-    if session_id is None:
+    if session_id is None or not await redis_service.session_exists(session_id):
+        # A cookie of an expired session is replaced too
         session_id = generate_id(datetime_flag=True)
 
         response.set_cookie(
@@ -79,16 +76,17 @@ async def create_task(
 ) -> Any:
     """Create task for current session
     """
-    position = await redis_service.get_position(session_id)
-    if position is not None:
-        raise EXC(ErrorCode.TaskAlreadyExists)
-    await r_queue.send_to_queue(
-        {
-            'session_id': session_id,
-            'task_id': task_id,
-        },
-    )
-    position = await redis_service.get_position(session_id)
+    try:
+        position = await r_queue.send_to_queue(
+            {
+                'session_id': session_id,
+                'task_id': task_id,
+            },
+        )
+    except TaskAlreadyQueuedError:
+        raise EXC(ErrorCode.TaskAlreadyExists) from None
+    if position is None:
+        raise EXC(ErrorCode.DbError)
     return SessionPublic(session_id=session_id, position=position)
 
 
@@ -101,34 +99,66 @@ async def get_status(session_id: str | None = None) -> Session:
     # session_data = await redis_service.get_session_data(
     #     session_id, status=True, position=True, completed_timestamp=True, download_url=True,
     # )
-    session_data = await redis_service.get_session_data_multiple(
-        session_id,
-        fields=['status', 'position', 'completed_timestamp', 'download_url'],
-    )
-    status = session_data.get('status', None)
-    if not status:
+    record = await redis_service.read_session(session_id, fields=STATUS_FIELDS)
+    if not record.status:
         raise EXC(ErrorCode.TaskNotFound)
 
-    estimated_time = None
+    eta = await eta_model.snapshot()
+    return Session(session_id=session_id, timestamp=time.time(), **public_status(record, eta))
+
+
+@router.post('/status')
+async def get_statuses(query: SessionStatusQuery) -> StreamingResponse:
+    """Get status of the tasks of many sessions at once
+
+    The statuses are read in one Redis round trip and streamed as compact JSON, sessions without a task get
+    a null status. Fields that are null for a session are left out.
+    """
+    if len(query.session_ids) > settings.STATUS_BATCH_MAX_SESSIONS:
+        raise EXC(
+            ErrorCode.ValidationError,
+            details={'reason': f'At most {settings.STATUS_BATCH_MAX_SESSIONS} session ids per call'},
+        )
+    records = await redis_service.read_sessions(query.session_ids, STATUS_FIELDS)
+    eta = await eta_model.snapshot()
+    timestamp = time.time()
+
+    def encode() -> Iterator[str]:
+        yield f'{{"timestamp":{json.dumps(timestamp)},"sessions":['
+        for i, (session_id, record) in enumerate(records.items()):
+            item = {'session_id': session_id, 'status': None}
+            if record.status:
+                item.update((key, value) for key, value in public_status(record, eta).items() if value is not None)
+            yield (',' if i else '') + json.dumps(item, separators=(',', ':'))
+        yield ']}'
+
+    return StreamingResponse(encode(), media_type='application/json')
+
+
+@router.get('/eta')
+async def get_eta() -> dict[str, Any]:
+    """Processing time statistics and active consumers the estimated times are computed from
+    """
+    return (await eta_model.snapshot()).stats()
+
+
+def public_status(record: SessionRecord, eta: EtaSnapshot) -> dict[str, Any]:
+    """Status fields of a session shown to the client, the estimated time is only known for queued tasks and
+    tasks in progress.
+    """
     download_url = None
     completed_timestamp = None
-    position = session_data.get('position', 0)
-    if TaskStatus(status) == TaskStatus.COMPLETED:
-        download_url = session_data.get('download_url', None)
-        completed_timestamp = session_data.get('completed_timestamp', None)
-    elif TaskStatus(status) not in [TaskStatus.FAILED, TaskStatus.INIT, TaskStatus.UPLOADING]:
-        avg_time = await avg_time_manager.get_avg_processing_time()
-        estimated_time = position * avg_time
-
-    return Session(
-        session_id=session_id,
-        status=status,
-        download_url=download_url,
-        estimated_time=estimated_time,
-        position=position,
-        completed_timestamp=completed_timestamp,
-        timestamp=time.time(),
-    )
+    if record.status == TaskStatus.COMPLETED:
+        download_url = record.download_url
+        completed_timestamp = record.completed_timestamp
+
+    return {
+        'status': record.status,
+        'download_url': download_url,
+        'estimated_time': eta.estimate(record),
+        'position': record.position,
+        'completed_timestamp': completed_timestamp,
+    }
 
 
 @router.delete('/clear')
@@ -58,6 +58,12 @@ def html(user_id):
                 log("Event: message, data: " + e.data);
               };
 
+              ['progress', 'upload_progress', 'broadcast_message', '__exit__'].forEach(function(name) {
+                eventSource.addEventListener(name, function(e) {
+                  log("Event: " + name + ", data: " + e.data);
+                });
+              });
+
 
             //}
 
@@ -132,8 +138,17 @@ def html_ws(user_id):
                     log("Connection established");
                 };
 
+                let seq = 0;
                 socket.onmessage = function(event) {
                     log("Received data: " + event.data);
+                    const message = JSON.parse(event.data);
+                    if (message.type === 'delta' && message.seq !== seq + 1) {
+                        // A frame was lost, ask for a new snapshot
+                        socket.send(JSON.stringify({type: 'resync'}));
+                    }
+                    if (message.seq) {
+                        seq = message.seq;
+                    }
                 };
 
                 socket.onerror = function(error) {
@@ -1,43 +1,116 @@
 import asyncio
 import json
+import random
 from collections.abc import AsyncGenerator
 from typing import Any
+from typing import NamedTuple
 
-import aioredis
 from aioredis.exceptions import RedisError
 
+from app.core.config import settings
 from app.core.logging import logger
-from app.core.utils import generate_id
+from app.schemas.events import COALESCE_COMMENT
 from app.schemas.events import Event
+from app.schemas.events import EventBackendType
 from app.schemas.events import EventData
+from app.schemas.events import EventEncoding
+from app.schemas.events import EventStorage
 from app.schemas.events import NotificationType
 from app.schemas.events import Position
-from app.services.redis_service import BaseRedis
+from app.services.connection_registry import ConnectionRegistry
+from app.services.connection_registry import LocalConnectionRegistry
+from app.services.connection_registry import sse_registry
+from app.services.event_backend import BROADCAST_CHANNEL
+from app.services.event_backend import EventBackend
+from app.services.event_backend import MemoryEventBackend
+from app.services.event_backend import RedisEventBackend
+from app.services.event_backend import as_frame
+from app.services.event_backend import channel_name
+from app.services.event_backend import parse_stream_id
+from app.services.expiry import expiry_engine
+from app.services.listener_queue import ListenerQueue
+from app.services.listener_queue import QueueMetrics
+from app.services.listener_queue import QueuePolicy
+from app.services.listener_queue import SlowConsumerError
+from app.services.pubsub import pubsub_mux
 from app.services.redis_service import redis_base
 
 
+class SSEFrameHeader(NamedTuple):
+    id: str | None
+    name: str | None
+    coalesce: bool
+
+
+def parse_sse_frame(frame: str) -> SSEFrameHeader:
+    """Read the id, event and comment lines of a frame built by Event.as_sse_frame without decoding the data."""
+    event_id = name = None
+    coalesce = False
+    header = frame.partition('data: ')[0]
+    for line in header.splitlines():
+        if line.startswith('id: '):
+            event_id = line[4:]
+        elif line.startswith('event: '):
+            name = line[7:]
+        elif line == COALESCE_COMMENT:
+            coalesce = True
+    return SSEFrameHeader(event_id, name, coalesce)
+
+
+def frame_data_id(frame: str) -> str | None:
+    """The data id of a frame, the session a broadcast progress event is about. Decodes the data."""
+    try:
+        return json.loads(frame.partition('data: ')[2]).get('id')
+    except (ValueError, AttributeError):
+        return None
+
+
+def coalesce_key(message: tuple[str, str]) -> tuple[str, str | None, str | None] | None:
+    """Queue key of a (channel, frame) message: channel, data id and event name for latest-wins events.
+
+    The data id keeps the progress events of different sessions on the shared broadcast channel apart.
+    """
+    channel, frame = message
+    header = parse_sse_frame(frame)
+    return (channel, frame_data_id(frame), header.name) if header.coalesce else None
+
+
 class SSEEventBus:
     def __init__(
-        self, base_redis: BaseRedis, max_events_per_user: int = 100, message_lifetime: int = 3600,
-    ) -> None:  # redis_url: str = "redis://localhost:6379"
-        self.redis: aioredis.Redis = base_redis.get_redis()
-        self.max_events_per_user = max_events_per_user
-        self.message_lifetime = message_lifetime
-        self.sse_connection_key = 'sse:active_connections'
-        self.broadcast_channel = 'broadcast:all'
-        self.broadcast_key = 'broadcast:messages'
+        self,
+        backend: EventBackend,
+        registry: ConnectionRegistry | LocalConnectionRegistry,
+        coalesce_window: float = 0.5,
+        queue_size: int = 100,
+        queue_policy: QueuePolicy = QueuePolicy.COALESCE,
+        retry_ms: int = 1000,
+        retry_jitter_ms: int = 10000,
+        shutdown_grace: float = 2,
+    ) -> None:
+        self.backend = backend
+        self.registry = registry
+        self.coalesce_window = coalesce_window
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.queue_metrics = QueueMetrics()
+        self.retry_ms = retry_ms
+        self.retry_jitter_ms = retry_jitter_ms
+        self.shutdown_grace = shutdown_grace
+        # Latest-wins buffers: session id (None for broadcast) -> (data id, event name) -> newest event
+        self._coalesced: dict[str | None, dict[tuple[str | None, str], Event]] = {}
+        self._coalesce_tasks: dict[str | None, asyncio.Task] = {}
+        # Set once the last local connection is removed
+        self._local_closed = asyncio.Event()
+        self.broadcast_channel = BROADCAST_CHANNEL
 
     # async def add_connection(self, user_id: str):
     #     try:
     #         await self.redis.hincrby(self.sse_connection_key, user_id, 1)
     #     except RedisError as e:
     #         logger.error(f"Error adding connection for user {user_id}: {e}")
-    async def add_connection(self, user_id: str, connection_info: dict = None):
-        try:
-            connection_info = connection_info or {}
-            await self.redis.hset(self.sse_connection_key, user_id, json.dumps(connection_info))
-        except RedisError as e:
-            logger.error(f'Error adding connection for user {user_id}: {e}')
+    async def add_connection(self, user_id: str, connection_info: dict = None) -> str:
+        """Register the connection in the registry. Returns the connection id to remove it with."""
+        return await self.registry.add(user_id, connection_info)
 
     # async def remove_connection(self, user_id: str):
     #     await self.redis.hincrby(self.sse_connection_key, user_id, -1)
@@ -46,31 +119,37 @@ class SSEEventBus:
     #     if count and int(count) <= 0:
     #         await self.redis.hdel(self.sse_connection_key, user_id)
     #         logger.info(f'Connection for user {user_id} removed')
-    async def remove_connection(self, user_id: str):
-        asyncio.create_task(self._remove_connection(user_id))
-        # await asyncio.sleep(self.message_lifetime)
-        # await self.redis.hdel(self.sse_connection_key, user_id)
-        # try:
-        #     logger.info(f'Connection for user {user_id} will be removed')
-        #     await self.redis.hdel(self.sse_connection_key, user_id)
-        #     logger.info(f'Connection for user {user_id} removed')
-        # except RedisError as e:
-        #     logger.error(f"Error removing connection for user {user_id}: {e}")
-
-    async def _remove_connection(self, user_id: str):
-        try:
-            logger.info(f'Connection for user {user_id} will be removed')
-            await self.redis.hdel(self.sse_connection_key, user_id)
-            logger.info(f'Connection for user {user_id} removed')
-        except RedisError as e:
-            logger.error(f'Error removing connection for user {user_id}: {e}')
+    async def remove_connection(self, connection_id: str):
+        self.registry.remove(connection_id)
+        logger.info(f'Connection {connection_id} will be removed')
+        if not self.registry.local_connections:
+            self._local_closed.set()
+
+    async def close_local_connections(self):
+        """Ask the listeners connected to this worker to reconnect and deregister the worker.
+
+        Connections of the other workers are left alone, so restarting one worker does not disconnect the
+        whole cluster. The exit notices are published in one pipeline and carry a jittered retry hint, so the
+        clients do not reconnect all at once.
+        """
+        logger.info('Closing local connections')
+        for session_id in list(self._coalesced):
+            await self._flush_coalesced(session_id)
+
+        session_ids = {info['session_id'] for info in self.registry.local_connections.values()}
+        await self.backend.publish(
+            (session_id, self._exit_event(session_id).as_sse_frame()) for session_id in session_ids
+        )
+        logger.info(f'Exit notices sent to {len(session_ids)} sessions')
 
-    async def close_all_connections(self):
-        logger.info('Closing all connections')
-        active_connections = await self.get_active_connections()
-        for user_id in active_connections:
-            await self.shutdown(user_id)
-        await self.redis.delete(self.sse_connection_key)
+        # Give the listeners a moment to deliver the notices before the pub/sub connection is closed
+        if self.registry.local_connections:
+            self._local_closed.clear()
+            try:
+                await asyncio.wait_for(self._local_closed.wait(), timeout=self.shutdown_grace)
+            except asyncio.TimeoutError:
+                logger.warning(f'{len(self.registry.local_connections)} local connections still open')
+        await self.registry.close()
 
     # async def get_active_connections(self) -> dict[str, int]:
     #     connections = await self.redis.hgetall(self.sse_connection_key)
@@ -94,27 +173,17 @@ class SSEEventBus:
     #                 'error': str(e),
     #             }
     #         }
-    async def get_active_connections(self) -> dict[str, dict[str, Any]]:
+    async def get_active_connections(self, cursor: int = 0, count: int = 100) -> dict[str, Any]:
+        """Connection counters of the whole cluster and one page of the registered connections."""
         try:
-            connections = await self.redis.hgetall(self.sse_connection_key)
-            result = {}
-            for k, v in connections.items():
-                key = k.decode() if isinstance(k, bytes) else k
-                try:
-                    value = json.loads(v.decode() if isinstance(v, bytes) else v)
-                    if not isinstance(value, dict):
-                        value = {'value': value}
-                except json.JSONDecodeError:
-                    value = {'value': v.decode() if isinstance(v, bytes) else v}
-                result[key] = value
-            return result
+            page = await self.registry.page(cursor, count)
+            return {**await self.registry.count(), **page}
         except RedisError as e:
             logger.error(f'Error getting active connections: {e}')
             return {'error': {'message': str(e)}}
 
-    async def shutdown(self, session_id: str) -> None:
-        # await self.post(user_id, Event(name="__exit__", data=EventData(user_id=user_id, message="Shutdown")))
-        event = Event(
+    def _exit_event(self, session_id: str) -> Event:
+        return Event(
             name='__exit__',
             data=EventData(
                 id=session_id,
@@ -122,116 +191,161 @@ class SSEEventBus:
                 notification_type=NotificationType.WARNING,
                 position=Position.RIGHT_TOP,
             ),
+            retry=self.retry_ms + random.randint(0, self.retry_jitter_ms),
         )
-        await self.post(session_id, event)
 
-    async def broadcast(self, event: Event) -> None:
-        try:
-            event_json = event.model_dump_json()
-            message_id = generate_id()
-
-            async with self.redis.pipeline() as pipe:
-                # Добавляем событие в List для broadcast
-                await pipe.lpush(self.broadcast_key, event_json)
-                # Ограничиваем количество broadcast событий
-                await pipe.ltrim(self.broadcast_key, 0, self.max_events_per_user - 1)
-                # Устанавливаем TTL для всего списка broadcast событий
-                await pipe.expire(self.broadcast_key, self.message_lifetime)
-                await pipe.publish(self.broadcast_channel, event_json)
-
-                await pipe.execute()
-
-            logger.info(f'Broadcast message sent: {event.name}')
-            asyncio.create_task(self._delete_broadcast_message_after_delay(message_id, event_json))
-        except RedisError as e:
-            logger.error(f'Redis error in broadcast: {e}')
-
-    async def _delete_broadcast_message_after_delay(self, message_id: str, event_json: str):
-        await asyncio.sleep(self.message_lifetime)
-        try:
-            await self.redis.lrem(self.broadcast_key, 1, event_json)
-            logger.info(f'Broadcast message {message_id} deleted after {self.message_lifetime} seconds')
-        except RedisError as e:
-            logger.error(f'Redis error in _delete_broadcast_message_after_delay: {e}')
-
-    async def post(self, session_id: str, event: Event) -> None:
-        try:
-            event_key = f'event:{session_id}'
-            event_json = event.model_dump_json()
-            message_id = generate_id()
-
-            async with self.redis.pipeline() as pipe:
-                # Добавляем событие в List
-                await pipe.lpush(event_key, event_json)
-                # Ограничиваем количество событий
-                await pipe.ltrim(event_key, 0, self.max_events_per_user - 1)
-                # Устанавливаем TTL для всего списка событий
-                await pipe.expire(event_key, self.message_lifetime)
-                await pipe.publish(f'user:{session_id}', event_json)
-
-                await pipe.execute()
-
-            asyncio.create_task(self._delete_message_after_delay(session_id, message_id, event_json))
-        except RedisError as e:
-            logger.error(f'Redis error in post: {e}')
-
-    async def _delete_message_after_delay(self, session_id: str, message_id: str, event_json: str):
-        await asyncio.sleep(self.message_lifetime)
-        try:
-            event_key = f'event:{session_id}'
-            await self.redis.lrem(event_key, 1, event_json)
-            logger.info(f'Message {message_id} for user {session_id} deleted after {self.message_lifetime} seconds')
-        except RedisError as e:
-            logger.error(f'Redis error in _delete_message_after_delay: {e}')
-
-    async def listen(self, session_id: str) -> AsyncGenerator[dict[str, str], None]:
-        pubsub = self.redis.pubsub()
+    async def shutdown(self, session_id: str) -> None:
+        # await self.post(user_id, Event(name="__exit__", data=EventData(user_id=user_id, message="Shutdown")))
+        # The notice is only published, a client reconnecting later must not replay it from the history
+        await self.backend.publish([(session_id, self._exit_event(session_id).as_sse_frame())])
+
+    async def broadcast(self, event: Event, coalesce: bool = False) -> None:
+        """Send the event to every listener.
+
+        With coalesce=True the event is buffered for coalesce_window seconds and only the newest event with the
+        name and data id is sent, listeners that fall behind also only get the newest one.
+        """
+        if coalesce:
+            self._coalesce(None, event)
+            return
+        await self._flush_coalesced(None)
+        await self._broadcast(event)
+
+    async def _broadcast(self, event: Event) -> None:
+        event = event.model_copy(deep=True)
+        event.data.info = {**(event.data.info or {}), 'broadcast': True}
+        await self.backend.append(None, event.as_sse_frame())
+        logger.info(f'Broadcast message sent: {event.name}')
+
+    async def post(self, session_id: str, event: Event, coalesce: bool = False) -> None:
+        """Send the event to the session listeners, see broadcast for coalesce."""
+        if coalesce:
+            self._coalesce(session_id, event)
+            return
+        await self._flush_coalesced(session_id)
+        await self._post(session_id, event)
+
+    async def _post(self, session_id: str, event: Event) -> None:
+        await self.backend.append(session_id, event.as_sse_frame())
+
+    def _coalesce(self, session_id: str | None, event: Event) -> None:
+        event = event.model_copy(update={'coalesce': True})
+        self._coalesced.setdefault(session_id, {})[event.data.id or session_id, event.name] = event
+        if session_id not in self._coalesce_tasks:
+            self._coalesce_tasks[session_id] = asyncio.create_task(self._flush_coalesced_later(session_id))
+
+    async def _flush_coalesced_later(self, session_id: str | None) -> None:
+        await asyncio.sleep(self.coalesce_window)
+        self._coalesce_tasks.pop(session_id, None)
+        await self._flush_coalesced(session_id)
+
+    async def _flush_coalesced(self, session_id: str | None) -> None:
+        """Send the buffered events of the session right away, so they are not reordered with a regular event."""
+        task = self._coalesce_tasks.pop(session_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        for event in self._coalesced.pop(session_id, {}).values():
+            if session_id is None:
+                await self._broadcast(event)
+            else:
+                await self._post(session_id, event)
+
+    @staticmethod
+    async def _next_frames(queue: ListenerQueue) -> list[tuple[str, str, SSEFrameHeader]]:
+        """Wait for the next message and take everything else that is already queued.
+
+        Returns (channel, frame, header) tuples. A listener that fell behind only gets the newest of the queued
+        coalesced events with the same name and data id.
+        """
+        messages = [await queue.get()]
+        while not queue.empty():
+            messages.append(queue.get_nowait())
+
+        frames = []
+        for channel, data in messages:
+            frame = as_frame(data, broadcast=channel == BROADCAST_CHANNEL)
+            frames.append((channel, frame, parse_sse_frame(frame)))
+        keys = [(channel, frame_data_id(frame), h.name) if h.coalesce else None for channel, frame, h in frames]
+        newest = {key: i for i, key in enumerate(keys) if key is not None}
+        return [
+            (channel, frame, header)
+            for i, (key, (channel, frame, header)) in enumerate(zip(keys, frames, strict=True))
+            if key is None or newest[key] == i
+        ]
+
+    async def listen(self, session_id: str, last_event_id: str | None = None) -> AsyncGenerator[str, None]:
+        """Yield ready to send SSE frames for the session.
+
+        Frames are encoded once by post/broadcast and forwarded untouched, only their header lines are read and the
+        data id of the latest-wins ones.
+        """
+        queue = ListenerQueue(self.queue_size, self.queue_policy, key=coalesce_key, metrics=self.queue_metrics)
+        channels = (channel_name(session_id), self.broadcast_channel)
         logger.info(f'Listening for user {session_id} events')
         try:
-            await pubsub.subscribe(f'user:{session_id}', self.broadcast_channel)
+            await self.backend.subscribe(queue, *channels)
             # await self.add_connection(user_id)
 
             # Send the most recent events
-            event_key = f'event:{session_id}'
-            events = await self.redis.lrange(event_key, 0, -1)
-
-            for event_json in events:
-                event = Event.model_validate_json(event_json)
-                yield event.as_sse_dict()
-
-            async for message in pubsub.listen():
-                if message['type'] == 'message':
-                    channel = (
-                        message['channel'].decode('utf-8')
-                        if isinstance(message['channel'], bytes)
-                        else message['channel']
-                    )
-                    event = Event.model_validate_json(message['data'])
-
-                    if channel == self.broadcast_channel:
-                        event.data.info = event.data.info or {}
-                        event.data.info['broadcast'] = True
-
-                    if event.name == '__exit__' and channel != self.broadcast_channel:
-                        await pubsub.unsubscribe(f'user:{session_id}', self.broadcast_channel)
-                        await pubsub.close()
-                        await self.remove_connection(session_id)
+            last_id = parse_stream_id(last_event_id)
+            for entry_id, frame in await self.backend.history(session_id, last_event_id):
+                last_id = parse_stream_id(entry_id) or last_id
+                yield frame
+
+            while True:
+                for channel, frame, header in await self._next_frames(queue):
+                    # Skip events that were published between the subscription and the history replay
+                    if last_id and header.id and parse_stream_id(header.id) <= last_id:
+                        continue
+
+                    # The notice carries the retry hint, so it is sent before the stream is closed.
+                    # The connection itself is removed from the registry by the endpoint
+                    if header.name == '__exit__' and channel != self.broadcast_channel:
+                        yield frame
                         return
 
-                    yield event.as_sse_dict()
+                    yield frame
+
+        except SlowConsumerError:
+            logger.warning(f'Listener of user {session_id} is too slow, {self.queue_size} events queued. Disconnecting')
 
         except Exception as e:
             # print(f"Error in listen: {e}")
             logger.error(f'Error listening on pubsub: {e}')
 
         finally:
-            await pubsub.unsubscribe(f'user:{session_id}', 'broadcast:all')
-            await pubsub.close()
-            logger.info('Pubsub closed')
+            queue.close()
+            await self.backend.unsubscribe(queue, *channels)
+            logger.info(f'Stopped listening for user {session_id} events')
             # await self.remove_connection(user_id)
 
 
-event_bus = SSEEventBus(redis_base, max_events_per_user=10, message_lifetime=5)
+if settings.EVENT_BACKEND == EventBackendType.MEMORY:
+    # Single-node deployment: events never leave the process
+    event_backend = MemoryEventBackend(max_events_per_user=10, message_lifetime=5)
+    connection_registry = LocalConnectionRegistry()
+else:
+    event_backend = RedisEventBackend(
+        redis_base,
+        pubsub_mux,
+        expiry_engine,
+        max_events_per_user=10,
+        message_lifetime=5,
+        storage=EventStorage(settings.EVENT_STORAGE),
+        encoding=EventEncoding(settings.EVENT_ENCODING),
+    )
+    connection_registry = sse_registry
+
+event_bus = SSEEventBus(
+    event_backend,
+    connection_registry,
+    coalesce_window=settings.EVENT_COALESCE_WINDOW_SEC,
+    queue_size=settings.SSE_QUEUE_SIZE,
+    queue_policy=QueuePolicy(settings.SSE_QUEUE_POLICY),
+    retry_ms=settings.SSE_RETRY_MS,
+    retry_jitter_ms=settings.SSE_RETRY_JITTER_MS,
+    shutdown_grace=settings.SSE_SHUTDOWN_GRACE_SEC,
+)
 
 
 async def payment_message(
@@ -287,7 +401,7 @@ async def set_upload_progress(
         name='upload_progress',
         data=EventData(id=user_id, message=str(progress), notification_type=notification_type, position=position),
     )
-    await event_bus.broadcast(event)
+    await event_bus.broadcast(event, coalesce=True)
 
 
 async def set_mixing_progress(
@@ -300,4 +414,4 @@ async def set_mixing_progress(
         name='upload_progress',
         data=EventData(id=user_id, message=str(progress), notification_type=notification_type, position=position),
     )
-    await event_bus.broadcast(event)
+    await event_bus.broadcast(event, coalesce=True)
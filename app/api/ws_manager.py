@@ -1,36 +1,404 @@
+import asyncio
+import json
+import time
+from collections import deque
 from typing import Any
 
+from aioredis.exceptions import RedisError
 from fastapi import WebSocket
+from starlette.websockets import WebSocketDisconnect
 
+from app.core.config import settings
 from app.core.logging import logger
+from app.services.connection_registry import ConnectionRegistry
+from app.services.connection_registry import connection_node
+from app.services.connection_registry import ws_registry
+from app.services.listener_queue import ListenerQueue
+from app.services.listener_queue import QueueMetrics
+from app.services.listener_queue import QueuePolicy
+from app.services.listener_queue import SlowConsumerError
+from app.services.pubsub import PubSubMultiplexer
+from app.services.pubsub import pubsub_mux
+
+# Close code for connections dropped by the slow consumer policy: "Try Again Later"
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+# Session state frames: a full snapshot first, then only the changed fields. Every state frame has the next
+# sequence number, a client that sees a gap sends {"type": "resync"} to get a new snapshot
+STATE_SNAPSHOT = 'snapshot'
+STATE_DELTA = 'delta'
+STATE_RESYNC = 'resync'
+
+# Every node listens on its own channel for messages routed to its sockets and on the broadcast channel
+WS_BROADCAST_CHANNEL = 'ws:broadcast'
+
+
+def node_channel(node_id: str) -> str:
+    return f'ws:node:{node_id}'
+
+
+def encode(message: dict[str, Any]) -> str:
+    # The same compact encoding as WebSocket.send_json
+    return json.dumps(message, separators=(',', ':'), ensure_ascii=False)
+
+
+def state_frame(kind: str, seq: int, data: dict[str, Any], session_id: str | None = None) -> dict[str, Any]:
+    frame = {'type': kind, 'seq': seq, 'data': data}
+    if session_id is not None:
+        frame['session_id'] = session_id
+    return frame
+
+
+class FanOutMetrics:
+    """Broadcast fan-out durations: from the broadcast call until the last socket has sent the message, or
+    has lost it to a send timeout, its queue policy or its disconnect.
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self.broadcasts = 0
+        self.send_timeouts = 0
+        # Broadcasts some socket did not get and the sockets that missed one
+        self.partial = 0
+        self.missed = 0
+        self.durations: deque[float] = deque(maxlen=window)
+
+    def stats(self) -> dict[str, Any]:
+        durations = sorted(self.durations)
+
+        def ms(quantile: float) -> float:
+            if not durations:
+                return 0.0
+            return round(durations[min(len(durations) - 1, int(len(durations) * quantile))] * 1000, 3)
+
+        return {
+            'broadcasts': self.broadcasts,
+            'completed': len(durations),
+            'p50_ms': ms(0.5),
+            'p99_ms': ms(0.99),
+            'max_ms': ms(1),
+            'partial': self.partial,
+            'missed': self.missed,
+            'send_timeouts': self.send_timeouts,
+        }
+
+
+class BroadcastFrame:
+    """A broadcast message serialized once and shared by the queues of every socket."""
+
+    __slots__ = ('metrics', 'missed', 'remaining', 'started', 'text')
+
+    def __init__(self, text: str, recipients: int, metrics: FanOutMetrics) -> None:
+        self.text = text
+        self.remaining = recipients
+        self.missed = 0
+        self.started = time.perf_counter()
+        self.metrics = metrics
+
+    def sent(self) -> None:
+        self._done()
+
+    def dropped(self) -> None:
+        """A recipient lost the message."""
+        self.missed += 1
+        self.metrics.missed += 1
+        self._done()
+
+    def _done(self) -> None:
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.metrics.durations.append(time.perf_counter() - self.started)
+            if self.missed:
+                self.metrics.partial += 1
+
+
+def drop_message(message: Any) -> None:  # noqa: ANN401
+    if isinstance(message, BroadcastFrame):
+        message.dropped()
 
 
 class WSConnectionManager:
-    def __init__(self):
+    """WebSocket connections of this node.
+
+    With a registry and a pub/sub multiplexer the manager is cluster-aware: sockets are registered with their
+    node, a message for a session connected to another node is published to that node's channel only, and
+    connecting a session that already has a socket on another node evicts that socket.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 100,
+        queue_policy: QueuePolicy = QueuePolicy.DROP_OLDEST,
+        registry: ConnectionRegistry | None = None,
+        pubsub: PubSubMultiplexer | None = None,
+        send_timeout: float = 5,
+        max_concurrent_sends: int = 1000,
+    ):
         self.active_connections: dict[str, WebSocket] = {}
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.queue_metrics = QueueMetrics()
+        self.fanout_metrics = FanOutMetrics()
+        self.send_timeout = send_timeout
+        # Bounds the sends in flight over all sockets, a socket that does not take a message within
+        # send_timeout is closed
+        self._send_slots = asyncio.Semaphore(max_concurrent_sends)
+        # Every socket gets a bounded outbound queue drained by its own sender task,
+        # so a slow client never delays messages for the other ones
+        self._queues: dict[str, ListenerQueue] = {}
+        self._senders: dict[str, asyncio.Task] = {}
+        # Last state frame sent to the client, per session (None for the session of the socket itself):
+        # sequence number and the full state
+        self._states: dict[str, dict[str | None, tuple[int, dict[str, Any]]]] = {}
+        self.registry = registry
+        self.pubsub = pubsub
+        self._connection_ids: dict[str, str] = {}
+        self._routes: ListenerQueue | None = None
+        self._router: asyncio.Task | None = None
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
         logger.info(f'Websocket accepted: session_id={client_id}')
         exist: WebSocket = self.active_connections.get(client_id)
         if exist:
+            self._stop_sender(client_id)
+            self._unregister(client_id)
             await exist.close()  # you want to disconnect connected client.
             self.active_connections[client_id] = websocket
             # await websocket.close()  # reject new user with the same ID already exist
         else:
             self.active_connections[client_id] = websocket
 
-    def disconnect(self, client_id: str):
-        self.active_connections.pop(client_id)
+        queue = ListenerQueue(self.queue_size, self.queue_policy, metrics=self.queue_metrics, on_drop=drop_message)
+        self._queues[client_id] = queue
+        self._senders[client_id] = asyncio.create_task(self._send_loop(client_id, websocket, queue))
+
+        if self.registry is not None:
+            await self._register(client_id)
+
+    async def _register(self, client_id: str) -> None:
+        await self._start_routing()
+        connection_id = await self.registry.add(client_id, {'transport': 'ws'})
+        self._connection_ids[client_id] = connection_id
+        previous = await self.registry.claim_session(client_id, connection_id)
+        if previous is not None and connection_node(previous) != self.registry.node_id:
+            logger.info(f'Websocket session_id={client_id} moved from node {connection_node(previous)}')
+            await self._publish(
+                node_channel(connection_node(previous)),
+                {'type': 'evict', 'client_id': client_id, 'connection_id': previous},
+            )
+
+    def _unregister(self, client_id: str) -> str | None:
+        connection_id = self._connection_ids.pop(client_id, None)
+        if connection_id is not None:
+            self.registry.remove(connection_id)
+        return connection_id
+
+    async def disconnect(self, client_id: str, websocket: WebSocket | None = None):
+        # A socket replaced by a newer one with the same id must not remove its successor
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
+        self._stop_sender(client_id)
+        self.active_connections.pop(client_id, None)
+        connection_id = self._unregister(client_id)
+        if connection_id is not None:
+            await self.registry.release_session(client_id, connection_id)
         logger.info(f'Websocket closed: session_id={client_id}')
 
+    def _stop_sender(self, client_id: str) -> None:
+        self._states.pop(client_id, None)
+        queue = self._queues.pop(client_id, None)
+        if queue is not None:
+            queue.close()
+        sender = self._senders.pop(client_id, None)
+        if sender is not None and sender is not asyncio.current_task():
+            sender.cancel()
+
+    async def _send_loop(self, client_id: str, websocket: WebSocket, queue: ListenerQueue) -> None:
+        try:
+            while True:
+                message = await queue.get()
+                async with self._send_slots:
+                    if isinstance(message, BroadcastFrame):
+                        try:
+                            await asyncio.wait_for(websocket.send_text(message.text), timeout=self.send_timeout)
+                        except BaseException:
+                            message.dropped()
+                            raise
+                        message.sent()
+                    else:
+                        await asyncio.wait_for(websocket.send_json(message), timeout=self.send_timeout)
+        except SlowConsumerError:
+            logger.warning(f'Websocket session_id={client_id} is too slow, {self.queue_size} messages queued')
+            await self._close(websocket, WS_CLOSE_TRY_AGAIN_LATER)
+            await self.disconnect(client_id, websocket)
+        except asyncio.TimeoutError:
+            logger.warning(f'Websocket session_id={client_id} send timed out after {self.send_timeout}s')
+            self.fanout_metrics.send_timeouts += 1
+            await self._close(websocket, WS_CLOSE_TRY_AGAIN_LATER)
+            await self.disconnect(client_id, websocket)
+        except (WebSocketDisconnect, RuntimeError) as e:
+            logger.info(f'Websocket send failed: session_id={client_id}: {e!r}')
+        finally:
+            queue.close()
+
+    async def _close(self, websocket: WebSocket, code: int) -> None:
+        # Closing sends a frame too, a stalled peer must not keep the sender task forever
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.send_timeout)
+        except (asyncio.TimeoutError, WebSocketDisconnect, RuntimeError) as e:
+            logger.info(f'Websocket close failed: {e!r}')
+
+    def send(self, client_id: str, message: dict[str, Any]) -> bool:
+        """Queue the message for the client. Returns False if the client is not connected anymore."""
+        queue = self._queues.get(client_id)
+        if queue is None or queue.closed:
+            return False
+        queue.put_nowait(message)
+        return True
+
+    def send_state(self, client_id: str, state: dict[str, Any], session_id: str | None = None) -> bool:
+        """Queue the changed fields of the state, the whole state if it is the first one sent to the client.
+        Returns False if the client is not connected anymore.
+
+        The state of a session the client has subscribed to is passed with its session_id, its frames carry
+        the session id and have their own sequence numbers.
+        """
+        previous = self._states.get(client_id, {}).get(session_id)
+        if previous is None:
+            return self._send_snapshot(client_id, 1, state, session_id)
+
+        seq, sent = previous
+        changes = {field: value for field, value in state.items() if field not in sent or sent[field] != value}
+        if not changes:
+            return True
+        self._states[client_id][session_id] = (seq + 1, dict(state))
+        return self.send(client_id, state_frame(STATE_DELTA, seq + 1, changes, session_id))
+
+    def resync(self, client_id: str, session_id: str | None = None) -> bool:
+        """Queue a snapshot of the last sent state, on request of a client that missed a frame."""
+        previous = self._states.get(client_id, {}).get(session_id)
+        if previous is None:
+            return False
+        seq, sent = previous
+        return self._send_snapshot(client_id, seq + 1, sent, session_id)
+
+    def forget_state(self, client_id: str, session_id: str | None = None) -> None:
+        """Drop the last sent state, the next state of the session is sent as a snapshot again."""
+        self._states.get(client_id, {}).pop(session_id, None)
+
+    def _send_snapshot(self, client_id: str, seq: int, state: dict[str, Any], session_id: str | None) -> bool:
+        if client_id not in self._queues:
+            return False
+        self._states.setdefault(client_id, {})[session_id] = (seq, dict(state))
+        return self.send(client_id, state_frame(STATE_SNAPSHOT, seq, state, session_id))
+
     @staticmethod
     async def send_personal_message(websocket: WebSocket, message: dict[str, any]):
         await websocket.send_json(message)
 
+    async def route(self, client_id: str, message: dict[str, Any]) -> bool:
+        """Queue the message for the client wherever it is connected.
+
+        Returns False if the client is not connected to any node. A message for another node is published to
+        that node's channel, so its delivery is not confirmed.
+        """
+        if self.send(client_id, message):
+            return True
+        if self.registry is None:
+            return False
+        try:
+            connection_id = await self.registry.session_connection(client_id)
+        except RedisError as e:
+            logger.error(f'Error routing message for session_id={client_id}: {e}')
+            return False
+        if connection_id is None or connection_node(connection_id) == self.registry.node_id:
+            return False
+        await self._publish(
+            node_channel(connection_node(connection_id)),
+            {'type': 'send', 'client_id': client_id, 'message': message},
+        )
+        return True
+
     async def broadcast(self, message: dict[str, Any]):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
+        if self.pubsub is None:
+            self._broadcast_local(encode(message))
+            return
+        # Every node, including this one, delivers the published message to its own sockets
+        await self._publish(WS_BROADCAST_CHANNEL, message)
+
+    def _broadcast_local(self, text: str) -> None:
+        """Queue the serialized message for every socket, the sender tasks send it concurrently."""
+        queues = [queue for queue in self._queues.values() if not queue.closed]
+        self.fanout_metrics.broadcasts += 1
+        frame = BroadcastFrame(text, len(queues), self.fanout_metrics)
+        for queue in queues:
+            queue.put_nowait(frame)
+
+    async def _publish(self, channel: str, message: dict[str, Any]) -> None:
+        try:
+            await self.pubsub.redis.publish(channel, encode(message))
+        except RedisError as e:
+            logger.error(f'Error publishing to {channel}: {e}')
+
+    async def _start_routing(self) -> None:
+        if self._router is not None and not self._router.done():
+            return
+        if self._routes is not None:
+            self._routes.close()
+            await self.pubsub.unsubscribe(self._routes, node_channel(self.registry.node_id), WS_BROADCAST_CHANNEL)
+        self._routes = ListenerQueue(self.queue_size * 10, QueuePolicy.DROP_OLDEST)
+        await self.pubsub.subscribe(self._routes, node_channel(self.registry.node_id), WS_BROADCAST_CHANNEL)
+        self._router = asyncio.create_task(self._route_loop(self._routes))
+
+    async def _route_loop(self, routes: ListenerQueue) -> None:
+        while True:
+            channel, data = await routes.get()
+            if channel == WS_BROADCAST_CHANNEL:
+                # Forwarded as published, without decoding
+                self._broadcast_local(data)
+                continue
+            try:
+                message = json.loads(data)
+                if message['type'] == 'send':
+                    self.send(message['client_id'], message['message'])
+                elif message['type'] == 'evict':
+                    await self._evict(message['client_id'], message['connection_id'])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f'Invalid message routed on {channel}: {e!r}, {data[:200]!r}')
+
+    async def _evict(self, client_id: str, connection_id: str) -> None:
+        """Close the socket of the session that was connected again on another node."""
+        if self._connection_ids.get(client_id) != connection_id:
+            return
+        websocket = self.active_connections.get(client_id)
+        self._stop_sender(client_id)
+        self._unregister(client_id)
+        self.active_connections.pop(client_id, None)
+        logger.info(f'Websocket evicted: session_id={client_id}')
+        if websocket is not None:
+            try:
+                await websocket.close()
+            except RuntimeError as e:
+                logger.info(f'Websocket session_id={client_id} already closed: {e!r}')
+
+    async def close(self) -> None:
+        """Stop routing and deregister the sockets of this node."""
+        if self._router is not None:
+            self._router.cancel()
+            self._router = None
+        if self._routes is not None:
+            self._routes.close()
+            await self.pubsub.unsubscribe(self._routes, node_channel(self.registry.node_id), WS_BROADCAST_CHANNEL)
+            self._routes = None
+        if self.registry is not None:
+            await self.registry.close()
 
 
-ws_manager = WSConnectionManager()
+ws_manager = WSConnectionManager(
+    settings.WS_QUEUE_SIZE,
+    QueuePolicy(settings.WS_QUEUE_POLICY),
+    registry=ws_registry,
+    pubsub=pubsub_mux,
+    send_timeout=settings.WS_SEND_TIMEOUT_SEC,
+    max_concurrent_sends=settings.WS_MAX_CONCURRENT_SENDS,
+)
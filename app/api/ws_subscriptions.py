@@ -0,0 +1,114 @@
+import asyncio
+from collections.abc import Iterable
+from typing import Any
+
+from app.api.ws_manager import WSConnectionManager
+from app.core.logging import logger
+from app.services.status_watcher import SessionStatusWatcher
+
+# Control messages of a socket following several sessions:
+#   {"type": "subscribe", "session_ids": [...]}   -> {"type": "subscribed", "session_ids": [...]}
+#   {"type": "unsubscribe", "session_ids": [...]} -> {"type": "unsubscribed", "session_ids": [...]}
+# State frames of a subscribed session carry its "session_id" and {"type": "resync", "session_id": ...}
+# requests a new snapshot of that session
+SUBSCRIBE = 'subscribe'
+UNSUBSCRIBE = 'unsubscribe'
+SUBSCRIBED = 'subscribed'
+UNSUBSCRIBED = 'unsubscribed'
+
+
+class SessionSubscriptions:
+    """Sessions a socket follows besides its own one.
+
+    Every subscribed session has its own status watcher, so it is pushed by the same change notifications
+    as the session of the socket and all of them share the pub/sub connection of the worker.
+    """
+
+    def __init__(
+        self,
+        manager: WSConnectionManager,
+        watcher: SessionStatusWatcher,
+        client_id: str,
+        fields: list[str],
+        limit: int = 500,
+    ) -> None:
+        self.manager = manager
+        self.watcher = watcher
+        self.client_id = client_id
+        self.fields = fields
+        self.limit = limit
+        self._watchers: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._watchers)
+
+    def handle(self, request: dict[str, Any]) -> bool:
+        """Handle a subscribe or unsubscribe request. Returns False if it is not one of them."""
+        kind = request.get('type')
+        if kind not in (SUBSCRIBE, UNSUBSCRIBE):
+            return False
+
+        session_ids = request.get('session_ids')
+        if not isinstance(session_ids, list) or not all(isinstance(sid, str) and sid for sid in session_ids):
+            self.manager.send(self.client_id, {'type': 'error', 'error': 'session_ids must be a list of strings'})
+            return True
+
+        if kind == UNSUBSCRIBE:
+            self.manager.send(self.client_id, {'type': UNSUBSCRIBED, 'session_ids': self.unsubscribe(session_ids)})
+            return True
+
+        accepted, rejected = self.subscribe(session_ids)
+        self.manager.send(self.client_id, {'type': SUBSCRIBED, 'session_ids': accepted})
+        if rejected:
+            self.manager.send(
+                self.client_id,
+                {'type': 'error', 'error': f'At most {self.limit} subscriptions', 'session_ids': rejected},
+            )
+        return True
+
+    def subscribe(self, session_ids: Iterable[str]) -> tuple[list[str], list[str]]:
+        """Start following the sessions. Returns the subscribed and the rejected session ids."""
+        accepted, rejected = [], []
+        for session_id in dict.fromkeys(session_ids):
+            if session_id not in self._watchers:
+                if len(self._watchers) >= self.limit:
+                    rejected.append(session_id)
+                    continue
+                self._watchers[session_id] = asyncio.create_task(self._push(session_id))
+            accepted.append(session_id)
+        return accepted, rejected
+
+    def unsubscribe(self, session_ids: Iterable[str]) -> list[str]:
+        """Stop following the sessions. Returns the ones that were subscribed."""
+        removed = []
+        for session_id in dict.fromkeys(session_ids):
+            task = self._watchers.pop(session_id, None)
+            if task is None:
+                continue
+            task.cancel()
+            self.manager.forget_state(self.client_id, session_id)
+            removed.append(session_id)
+        return removed
+
+    async def _push(self, session_id: str) -> None:
+        try:
+            async for state in self.watcher.watch(session_id, self.fields):
+                if not self.manager.send_state(self.client_id, state, session_id=session_id):
+                    return
+        except Exception as e:
+            logger.exception(f'Status stream of session_id={session_id} for {self.client_id} failed: {e}')
+            self.manager.send(
+                self.client_id,
+                {'type': 'error', 'error': 'Status stream failed', 'session_ids': [session_id]},
+            )
+        finally:
+            if self._watchers.get(session_id) is asyncio.current_task():
+                del self._watchers[session_id]
+                self.manager.forget_state(self.client_id, session_id)
+
+    async def close(self) -> None:
+        tasks = list(self._watchers.values())
+        self._watchers.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
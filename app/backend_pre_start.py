@@ -11,6 +11,7 @@ from app.core.config import settings
 from app.core.logging import logger
 from app.services.processing import r_queue
 from app.services.redis_service import redis_base as redis_service
+from app.services.redis_service import redis_service as api_redis
 from app.services.s3_async import s3
 
 max_tries = 60 * 5  # 5 minutes
@@ -47,9 +48,16 @@ async def init_s3() -> None:
     await s3.check_s3_connection(settings.S3_SVAHA_READ_BUCKET)
 
 
+async def migrate_redis() -> None:
+    migrated = await api_redis.migrate_queue()
+    if migrated:
+        logger.info(f'Moved {migrated} queued sessions to the processing queue sorted set')
+
+
 async def main() -> None:
     logger.info('Initializing services')
     await init_redis()
+    await migrate_redis()
     await init_rabbit()
     await init_s3()
     logger.info('Services finished initializing')
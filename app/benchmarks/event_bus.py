@@ -0,0 +1,347 @@
+"""Load benchmark of the SSE event bus.
+
+Drives SSEEventBus directly or the /events/sse/{session_id} endpoint through an in-process ASGI client with a
+number of listeners, per-session post and broadcast rates. Reports publish -> receive latency percentiles,
+delivered events per second of CPU time, Redis commands per published event and memory per idle listener.
+
+    python -m app.benchmarks.event_bus --listeners 1000 --post-rate 2 --broadcast-rate 5
+    python -m app.benchmarks.event_bus --backend redis --redis-url redis://localhost:6379 --storage stream
+    python -m app.benchmarks.event_bus --transport asgi --json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+from collections.abc import Awaitable
+from collections.abc import Callable
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+import aioredis
+import structlog
+from fastapi import FastAPI
+
+from app.api.endpoints import events
+from app.api.sse_eventbus import SSEEventBus
+from app.schemas.events import Event
+from app.schemas.events import EventBackendType
+from app.schemas.events import EventData
+from app.schemas.events import EventStorage
+from app.services.connection_registry import ConnectionRegistry
+from app.services.connection_registry import LocalConnectionRegistry
+from app.services.event_backend import MemoryEventBackend
+from app.services.event_backend import RedisEventBackend
+from app.services.expiry import ExpiryEngine
+from app.services.listener_queue import QueuePolicy
+from app.services.pubsub import PubSubMultiplexer
+from app.services.redis_service import BaseRedis
+
+
+@dataclass
+class BenchmarkConfig:
+    listeners: int = 100
+    sessions: int | None = None  # Listeners are spread over the sessions, one session per listener by default
+    post_rate: float = 1.0  # Events per second posted to every session
+    broadcast_rate: float = 1.0  # Broadcasts per second
+    duration: float = 10.0
+    drain: float = 2.0  # Max time to wait for in-flight events after the load stops
+    backend: EventBackendType = EventBackendType.MEMORY
+    storage: EventStorage = EventStorage.LIST
+    redis_url: str | None = None
+    transport: str = 'bus'  # bus | asgi
+    queue_size: int = 100
+    queue_policy: QueuePolicy = QueuePolicy.COALESCE
+
+
+@dataclass
+class BenchmarkResult:
+    config: dict[str, Any]
+    published: int = 0
+    expected: int = 0
+    received: int = 0
+    duration: float = 0.0
+    cpu_time: float = 0.0
+    latency_ms: dict[str, float] = field(default_factory=dict)
+    events_per_sec: float = 0.0
+    events_per_cpu_sec: float = 0.0
+    redis_commands_per_event: float | None = None
+    memory_per_listener_bytes: float = 0.0
+    queues: dict[str, Any] = field(default_factory=dict)
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+class LatencyRecorder:
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+
+    def record(self, frame: str) -> None:
+        """Take the publish time out of the frame data, frames of other events are ignored."""
+        data = frame.partition('data: ')[2]
+        if not data:
+            return
+        sent_at = (json.loads(data).get('info') or {}).get('sent_at')
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+
+    def summary(self) -> dict[str, float]:
+        values = sorted(self.latencies)
+        return {f'p{p}': round(percentile(values, p) * 1000, 3) for p in (50, 95, 99)} | {
+            'max': round(values[-1] * 1000, 3) if values else 0.0,
+        }
+
+
+def make_event(session_id: str, name: str = 'benchmark') -> Event:
+    return Event(name=name, data=EventData(id=session_id, message=name, info={'sent_at': time.perf_counter()}))
+
+
+def create_event_bus(config: BenchmarkConfig) -> tuple[SSEEventBus, aioredis.Redis | None]:
+    if config.backend == EventBackendType.MEMORY:
+        backend = MemoryEventBackend(max_events_per_user=10, message_lifetime=5)
+        return SSEEventBus(
+            backend,
+            LocalConnectionRegistry(),
+            queue_size=config.queue_size,
+            queue_policy=config.queue_policy,
+        ), None
+
+    base_redis = BaseRedis()
+    if config.redis_url:
+        base_redis.redis = aioredis.from_url(config.redis_url, decode_responses=True)
+    expiry = ExpiryEngine(base_redis)
+    backend = RedisEventBackend(
+        base_redis,
+        PubSubMultiplexer(base_redis),
+        expiry,
+        max_events_per_user=10,
+        message_lifetime=5,
+        storage=config.storage,
+    )
+    bus = SSEEventBus(
+        backend,
+        ConnectionRegistry(base_redis, expiry, prefix='benchmark'),
+        queue_size=config.queue_size,
+        queue_policy=config.queue_policy,
+    )
+    return bus, base_redis.get_redis()
+
+
+async def redis_command_count(redis: aioredis.Redis | None) -> int:
+    if redis is None:
+        return 0
+    stats = await redis.info('commandstats')
+    return sum(stat['calls'] for name, stat in stats.items() if name != 'cmdstat_info')
+
+
+async def listen_bus(bus: SSEEventBus, session_id: str, on_frame: Callable[[str], None]) -> None:
+    connection_id = await bus.add_connection(session_id, {'client_host': 'benchmark'})
+    try:
+        async for frame in bus.listen(session_id):
+            on_frame(frame)
+    finally:
+        await bus.remove_connection(connection_id)
+
+
+def create_app(bus: SSEEventBus) -> FastAPI:
+    # The endpoints module reads the bus from its globals, point it to the benchmarked one
+    events.event_bus = bus
+    app = FastAPI()
+    app.include_router(events.router, prefix='/events')
+    return app
+
+
+async def listen_asgi(app: FastAPI, session_id: str, on_frame: Callable[[str], None], port: int) -> None:
+    """Minimal streaming ASGI client: GET /events/sse/{session_id} and split the body into frames."""
+    disconnected = asyncio.Event()
+    buffer = ''
+    requested = False
+
+    async def receive() -> dict[str, Any]:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal buffer
+        if message['type'] != 'http.response.body':
+            return
+        buffer += message.get('body', b'').decode()
+        *frames, buffer = buffer.split('\n\n')
+        for frame in frames:
+            on_frame(frame)
+
+    path = f'/events/sse/{session_id}'
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'accept', b'text/event-stream')],
+        'client': ('127.0.0.1', port),
+        'server': ('benchmark', 80),
+    }
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+
+
+async def run_at_rate(rate: float, stop: asyncio.Event, action: Callable[[], Awaitable[None]]) -> None:
+    """Call the action rate times per second on a fixed schedule until stopped."""
+    if rate <= 0:
+        return
+    interval = 1 / rate
+    next_tick = time.perf_counter()
+    while not stop.is_set():
+        await action()
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_benchmark(config: BenchmarkConfig) -> BenchmarkResult:
+    bus, redis = create_event_bus(config)
+    sessions = [f'benchmark-{i}' for i in range(config.sessions or config.listeners)]
+    listener_sessions = [sessions[i % len(sessions)] for i in range(config.listeners)]
+    listeners_per_session = {session_id: listener_sessions.count(session_id) for session_id in sessions}
+    recorder = LatencyRecorder()
+    result = BenchmarkResult(config={k: getattr(v, 'value', v) for k, v in asdict(config).items()})
+    endpoint_bus = events.event_bus
+    app = create_app(bus) if config.transport == 'asgi' else None
+
+    # Connect the listeners with tracemalloc running to measure their idle footprint
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    tasks = [
+        asyncio.create_task(
+            listen_asgi(app, session_id, recorder.record, 10000 + i)
+            if app is not None
+            else listen_bus(bus, session_id, recorder.record),
+        )
+        for i, session_id in enumerate(listener_sessions)
+    ]
+    # Wait for the subscriptions, the connections are registered before the listeners subscribe
+    while bus.backend.stats().get('listeners', 0) < config.listeners:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+    result.memory_per_listener_bytes = round((tracemalloc.get_traced_memory()[0] - memory_before) / config.listeners)
+    tracemalloc.stop()
+
+    async def post_all() -> None:
+        await asyncio.gather(*(bus.post(session_id, make_event(session_id)) for session_id in sessions))
+        result.published += len(sessions)
+        result.expected += config.listeners
+
+    async def broadcast() -> None:
+        await bus.broadcast(make_event('all', name='benchmark_broadcast'))
+        result.published += 1
+        result.expected += config.listeners
+
+    commands_before = await redis_command_count(redis)
+    stop = asyncio.Event()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    producers = [
+        asyncio.create_task(run_at_rate(config.post_rate, stop, post_all)),
+        asyncio.create_task(run_at_rate(config.broadcast_rate, stop, broadcast)),
+    ]
+    await asyncio.sleep(config.duration)
+    stop.set()
+    await asyncio.gather(*producers)
+
+    drain_deadline = time.perf_counter() + config.drain
+    while len(recorder.latencies) < result.expected and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.01)
+    result.duration = round(time.perf_counter() - started, 3)
+    result.cpu_time = round(time.process_time() - cpu_started, 3)
+    commands = await redis_command_count(redis) - commands_before
+
+    result.received = len(recorder.latencies)
+    result.latency_ms = recorder.summary()
+    result.events_per_sec = round(result.received / result.duration, 1)
+    result.events_per_cpu_sec = round(result.received / result.cpu_time, 1) if result.cpu_time else 0.0
+    if redis is not None and result.published:
+        result.redis_commands_per_event = round(commands / result.published, 2)
+    result.queues = bus.queue_metrics.stats()
+    result.config['listeners_per_session'] = max(listeners_per_session.values())
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bus.registry.close()
+    await bus.backend.close()
+    events.event_bus = endpoint_bus
+    return result
+
+
+def format_result(result: BenchmarkResult) -> str:
+    config = result.config
+    lines = [
+        f'backend={config["backend"]} storage={config["storage"]} transport={config["transport"]} '
+        f'listeners={config["listeners"]} post_rate={config["post_rate"]} broadcast_rate={config["broadcast_rate"]}',
+        f'published: {result.published}, delivered: {result.received}/{result.expected} in {result.duration}s',
+        'latency, ms: ' + ', '.join(f'{k}={v}' for k, v in result.latency_ms.items()),
+        f'events/s: {result.events_per_sec}, events/s per core: {result.events_per_cpu_sec}',
+        f'memory per listener: {result.memory_per_listener_bytes / 1024:.1f} KiB',
+        'queues: ' + ', '.join(f'{k}={v}' for k, v in result.queues.items()),
+    ]
+    if result.redis_commands_per_event is not None:
+        lines.append(f'redis commands per published event: {result.redis_commands_per_event}')
+    return '\n'.join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> tuple[BenchmarkConfig, argparse.Namespace]:
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__.partition('\n')[0])
+    parser.add_argument('--listeners', type=int, default=defaults.listeners)
+    parser.add_argument('--sessions', type=int, default=None, help='default: one session per listener')
+    parser.add_argument('--post-rate', type=float, default=defaults.post_rate, help='events/s to every session')
+    parser.add_argument('--broadcast-rate', type=float, default=defaults.broadcast_rate, help='broadcasts/s')
+    parser.add_argument('--duration', type=float, default=defaults.duration, help='seconds')
+    parser.add_argument('--drain', type=float, default=defaults.drain, help='seconds')
+    parser.add_argument('--backend', type=EventBackendType, default=defaults.backend, choices=list(EventBackendType))
+    parser.add_argument('--storage', type=EventStorage, default=defaults.storage, choices=list(EventStorage))
+    parser.add_argument('--redis-url', default=None, help='default: the REDIS_* settings')
+    parser.add_argument('--transport', default=defaults.transport, choices=['bus', 'asgi'])
+    parser.add_argument('--queue-size', type=int, default=defaults.queue_size)
+    parser.add_argument('--queue-policy', type=QueuePolicy, default=defaults.queue_policy, choices=list(QueuePolicy))
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+    config = BenchmarkConfig(**{
+        name: getattr(args, name) for name in BenchmarkConfig.__dataclass_fields__ if hasattr(args, name)
+    })
+    return config, args
+
+
+def main(argv: list[str] | None = None) -> None:
+    config, args = parse_args(argv)
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.getLevelName(args.log_level)))
+    result = asyncio.run(run_benchmark(config))
+    print(json.dumps(asdict(result), indent=2) if args.json else format_result(result))  # noqa: T201
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Redis memory of the session hashes and event history in the plain and the compact encodings.
+
+Writes sample sessions in every state and sample event histories in both encodings under a scratch key prefix,
+reports the payload bytes and the MEMORY USAGE per session and per stored event, then deletes the keys.
+
+    python -m app.benchmarks.redis_encoding --sessions 1000
+    python -m app.benchmarks.redis_encoding --redis-url redis://localhost:6379 --json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+import aioredis
+
+from app.schemas.events import Event
+from app.schemas.events import EventData
+from app.schemas.events import NotificationType
+from app.schemas.task import TaskStatus
+from app.services.event_backend import encode_event
+from app.services.redis_service import BaseRedis
+from app.services.redis_service import encode_session
+
+
+@dataclass
+class EncodingSize:
+    payload_bytes: float = 0.0  # Field names and values, or list items, as stored
+    memory_bytes: float = 0.0  # MEMORY USAGE, with the overhead of the key and its data structure
+
+
+@dataclass
+class ReportResult:
+    config: dict[str, Any]
+    # Per session, by state and for the mix of all states
+    sessions: dict[str, dict[str, EncodingSize]] = field(default_factory=dict)
+    # Per stored event
+    events: dict[str, EncodingSize] = field(default_factory=dict)
+
+
+def sample_session(status: TaskStatus) -> dict[str, Any]:
+    """The values of a session hash once the session has reached the status, as the API and consumers write them."""
+    now = time.time()
+    mapping: dict[str, Any] = {'status': TaskStatus.WAITING.value, 'progress': 0, 'download_url': ''}
+    if status == TaskStatus.WAITING:
+        return mapping
+    mapping.update({
+        'track_id': str(uuid.uuid4()),
+        'status': TaskStatus.QUEUED.value,
+        'timestamp': now,
+        'input_size': 7_340_032,
+    })
+    if status == TaskStatus.IN_PROGRESS:
+        mapping.update({'status': status.value, 'progress': 40})
+    elif status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+        mapping.update({
+            'status': status.value,
+            'progress': 100 if status == TaskStatus.COMPLETED else 40,
+            'completed_timestamp': now + 95.25,
+            'download_url': f'https://storage.example.com/results/{uuid.uuid4()}.wav'
+            if status == TaskStatus.COMPLETED
+            else '',
+        })
+    return mapping
+
+
+def sample_frames(session_id: str) -> list[str]:
+    """An event history of a session: progress updates and a notification."""
+    events = [
+        Event(
+            name='upload_progress',
+            data=EventData(id=session_id, message=str(progress), notification_type=NotificationType.INFO),
+            coalesce=True,
+        )
+        for progress in (25, 50, 75, 100)
+    ]
+    events.append(Event(name='message', data=EventData(id=session_id, message='Your track is ready')))
+    return [event.as_sse_frame() for event in events]
+
+
+SAMPLE_STATES = [TaskStatus.WAITING, TaskStatus.QUEUED, TaskStatus.IN_PROGRESS, TaskStatus.COMPLETED, TaskStatus.FAILED]
+ENCODINGS = {'plain': 0, 'compact': 1}
+
+
+async def run_report(redis: aioredis.Redis, sessions: int, prefix: str) -> ReportResult:
+    result = ReportResult(config={'sessions': sessions, 'prefix': prefix})
+    keys: list[str] = []
+    try:
+        for name, version in ENCODINGS.items():
+            totals: dict[str, EncodingSize] = {}
+            async with redis.pipeline(transaction=False) as pipe:
+                for i in range(sessions):
+                    status = SAMPLE_STATES[i % len(SAMPLE_STATES)]
+                    fields = encode_session(sample_session(status), version)
+                    mapping = {key: value for key, value in fields.items() if value is not None}
+                    key = f'{prefix}:{name}:session:{i}'
+                    keys.append(key)
+                    await pipe.hset(key, mapping=mapping)
+                    size = totals.setdefault(status.value, EncodingSize())
+                    size.payload_bytes += sum(len(key) + len(value) for key, value in mapping.items())
+                await pipe.execute()
+            memory = await memory_usage(redis, keys[-sessions:])
+            for i, used in enumerate(memory):
+                totals[SAMPLE_STATES[i % len(SAMPLE_STATES)].value].memory_bytes += used
+
+            counts = {
+                status.value: len(range(i, sessions, len(SAMPLE_STATES))) for i, status in enumerate(SAMPLE_STATES)
+            }
+            for state, size in totals.items():
+                state_sizes = result.sessions.setdefault(state, {})
+                state_sizes[name] = EncodingSize(size.payload_bytes / counts[state], size.memory_bytes / counts[state])
+            result.sessions.setdefault('all', {})[name] = EncodingSize(
+                sum(size.payload_bytes for size in totals.values()) / sessions,
+                sum(memory) / sessions,
+            )
+
+        stored_events = {'plain': 0, 'compact': 0}
+        for name in ENCODINGS:
+            payload = 0
+            async with redis.pipeline(transaction=False) as pipe:
+                for i in range(sessions):
+                    session_id = str(uuid.uuid4())
+                    frames = sample_frames(session_id)
+                    if name == 'compact':
+                        frames = [encode_event(frame, session_id) for frame in frames]
+                    key = f'{prefix}:{name}:event:{i}'
+                    keys.append(key)
+                    await pipe.lpush(key, *frames)
+                    payload += sum(len(frame) for frame in frames)
+                    stored_events[name] += len(frames)
+                await pipe.execute()
+            memory = await memory_usage(redis, keys[-sessions:])
+            result.events[name] = EncodingSize(payload / stored_events[name], sum(memory) / stored_events[name])
+    finally:
+        for start in range(0, len(keys), 1000):
+            await redis.delete(*keys[start : start + 1000])
+    return result
+
+
+async def memory_usage(redis: aioredis.Redis, keys: list[str]) -> list[int]:
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            await pipe.memory_usage(key, samples=0)
+        return [used or 0 for used in await pipe.execute()]
+
+
+def saving(before: float, after: float) -> str:
+    return f'{(1 - after / before) * 100:.0f}%' if before else '-'
+
+
+def format_result(result: ReportResult) -> str:
+    lines = [f'{"bytes":<24}{"plain (payload)":>18}{"compact (payload)":>20}{"saved":>8}']
+    rows = [(f'session {state}', sizes) for state, sizes in result.sessions.items()]
+    rows.append(('event', result.events))
+    for label, sizes in rows:
+        plain, compact = sizes['plain'], sizes['compact']
+        lines.append(
+            f'{label:<24}'
+            f'{plain.memory_bytes:>11.0f} ({plain.payload_bytes:>4.0f})'
+            f'{compact.memory_bytes:>13.0f} ({compact.payload_bytes:>4.0f})'
+            f'{saving(plain.memory_bytes, compact.memory_bytes):>8}'
+        )
+    return '\n'.join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.partition('\n')[0])
+    parser.add_argument('--sessions', type=int, default=1000, help='sample sessions per encoding')
+    parser.add_argument('--prefix', default='encoding_report', help='key prefix of the sample keys')
+    parser.add_argument('--redis-url', default=None, help='default: the REDIS_* settings')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    return parser.parse_args(argv)
+
+
+async def report(args: argparse.Namespace) -> ReportResult:
+    base_redis = BaseRedis()
+    if args.redis_url:
+        base_redis.redis = aioredis.from_url(args.redis_url, decode_responses=True)
+    try:
+        return await run_report(base_redis.redis, args.sessions, args.prefix)
+    finally:
+        await base_redis.redis.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    result = asyncio.run(report(args))
+    print(json.dumps(asdict(result), indent=2) if args.json else format_result(result))  # noqa: T201
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import time
 
 # import logging
 import aio_pika
@@ -12,6 +13,8 @@ from app.core.config import settings
 from app.core.logging import bind_contextvars
 from app.core.logging import logger
 from app.schemas.task import TaskStatus
+from app.services.connection_registry import NODE_ID
+from app.services.eta import eta_model
 from app.services.redis_service import redis_service
 from app.services.s3_async import s3
 
@@ -55,8 +58,18 @@ async def main() -> None:
                         # print(f'Received message: {message.body}')
                         logger.info(json.dumps(json.loads(message.body), indent=2))
                         message = json.loads(message.body)
+                        # A redelivered message of a task that is already completed or deleted is skipped,
+                        # one of a task interrupted while in progress is processed again
+                        applied, status = await redis_service.transition(
+                            message['session_id'],
+                            TaskStatus.IN_PROGRESS,
+                            allowed_from={TaskStatus.QUEUED, TaskStatus.IN_PROGRESS},
+                        )
+                        if not applied:
+                            logger.warning(f'Skipping task of session {message["session_id"]} with status {status}')
+                            continue
+                        started = time.monotonic()
                         try:
-                            await redis_service.set_status(message['session_id'], TaskStatus.IN_PROGRESS)
                             await s3.upload_file(
                                 './result.mp3',
                                 f'{message["session_id"]}/{message["task_id"]}/R.mp3',
@@ -67,16 +80,27 @@ async def main() -> None:
                             )
                             for i in range(6):
                                 await set_mixing_progress(message['session_id'], int(i * 100 / 5), position=Position.CENTER)
+                                redis_service.progress.update(message['session_id'], int(i * 100 / 5))
                                 await asyncio.sleep(1)
 
+                            await redis_service.progress.flush(message['session_id'])
                             await redis_service.complete_task(message['session_id'], track_url)
+                            await eta_model.record(time.monotonic() - started, message.get('input_size'))
                         except:
                             logger.error('Error uploading file from core')
+                            redis_service.progress.discard(message['session_id'])
                             await redis_service.delete_task(message['session_id'])
 
-    async with connection_pool, channel_pool:
-        task = asyncio.create_task(consume())
-        await task
+    # Active consumers share the processing queue, the ETAs of queued sessions depend on their number
+    heartbeat = asyncio.create_task(eta_model.heartbeat_loop(NODE_ID))
+    try:
+        async with connection_pool, channel_pool:
+            task = asyncio.create_task(consume())
+            await task
+    finally:
+        heartbeat.cancel()
+        await redis_service.progress.close()
+        await eta_model.remove_worker(NODE_ID)
 
 
 if __name__ == '__main__':
@@ -60,8 +60,73 @@ class Settings(BaseSettings):
 
     QUEUE_EXPIRE_SEC: int = 24 * 60 * 60
 
+    # Session hashes expire, every write of a session refreshes the TTL of its state: SESSION_IDLE_EXPIRE_SEC
+    # without a task, QUEUE_EXPIRE_SEC while the task is uploaded, queued or processed and SESSION_EXPIRE_MINUTES
+    # once it is finished
+    SESSION_IDLE_EXPIRE_SEC: int = os.getenv('SESSION_IDLE_EXPIRE_SEC', 24 * 60 * 60)
+    # Incremental sweep of processing queue entries of expired sessions and of session hashes without a TTL
+    SESSION_SWEEP_INTERVAL_SEC: float = os.getenv('SESSION_SWEEP_INTERVAL_SEC', 300)
+    SESSION_SWEEP_BATCH_SIZE: int = os.getenv('SESSION_SWEEP_BATCH_SIZE', 100)
+    # Encoding of the session hashes: 1 - compact, 0 - plain values. Every version is read, keep 0 during a rolling
+    # upgrade until no worker older than version 1 is left
+    SESSION_ENCODING_VERSION: int = os.getenv('SESSION_ENCODING_VERSION', 1)
+    # Most sessions one call of the batch status endpoint may ask for
+    STATUS_BATCH_MAX_SESSIONS: int = os.getenv('STATUS_BATCH_MAX_SESSIONS', 5000)
+
+    # Queue ETAs from the processing times recorded by the consumers: an EWMA with weight ETA_EWMA_ALPHA for the
+    # newest task, ETA_DEFAULT_TASK_SEC until the first task is done. Consumers without a heartbeat for
+    # ETA_WORKER_TTL_SEC are not counted, API workers reread the statistics every ETA_REFRESH_SEC
+    ETA_EWMA_ALPHA: float = os.getenv('ETA_EWMA_ALPHA', 0.2)
+    ETA_DEFAULT_TASK_SEC: float = os.getenv('ETA_DEFAULT_TASK_SEC', 60)
+    ETA_WORKER_TTL_SEC: float = os.getenv('ETA_WORKER_TTL_SEC', 60)
+    ETA_REFRESH_SEC: float = os.getenv('ETA_REFRESH_SEC', 5)
+
+    # Progress reports are written when they changed by PROGRESS_MIN_DELTA percent or were last written
+    # PROGRESS_MIN_INTERVAL_SEC ago, every PROGRESS_TICK_SEC in one pipeline for all sessions of the process
+    PROGRESS_MIN_DELTA: int = os.getenv('PROGRESS_MIN_DELTA', 5)
+    PROGRESS_MIN_INTERVAL_SEC: float = os.getenv('PROGRESS_MIN_INTERVAL_SEC', 1)
+    PROGRESS_TICK_SEC: float = os.getenv('PROGRESS_TICK_SEC', 0.2)
+
+    # Per-process cache of session records, kept coherent by the change notifications of the writes
+    SESSION_CACHE_SIZE: int = os.getenv('SESSION_CACHE_SIZE', 10000)
+    SESSION_CACHE_TTL_SEC: float = os.getenv('SESSION_CACHE_TTL_SEC', 5)
+
+    # SSE event bus
+    EVENT_BACKEND: str = os.getenv('EVENT_BACKEND', 'redis')  # redis | memory (single-node deployments)
+    EVENT_STORAGE: str = os.getenv('EVENT_STORAGE', 'list')  # list | stream
+    # Stored event history: compact | frame (as sent, readable by workers older than the compact encoding)
+    EVENT_ENCODING: str = os.getenv('EVENT_ENCODING', 'compact')
+    EVENT_COALESCE_WINDOW_SEC: float = os.getenv('EVENT_COALESCE_WINDOW_SEC', 0.5)
+    # Outbound queue per connection: drop_oldest | coalesce | disconnect
+    SSE_QUEUE_SIZE: int = os.getenv('SSE_QUEUE_SIZE', 100)
+    SSE_QUEUE_POLICY: str = os.getenv('SSE_QUEUE_POLICY', 'coalesce')
+    WS_QUEUE_SIZE: int = os.getenv('WS_QUEUE_SIZE', 100)
+    # drop_oldest | disconnect, WebSocket state frames are deltas that can not replace each other
+    WS_QUEUE_POLICY: str = os.getenv('WS_QUEUE_POLICY', 'drop_oldest')
+    # Sockets that do not take a message within WS_SEND_TIMEOUT_SEC are closed
+    WS_SEND_TIMEOUT_SEC: float = os.getenv('WS_SEND_TIMEOUT_SEC', 5)
+    WS_MAX_CONCURRENT_SENDS: int = os.getenv('WS_MAX_CONCURRENT_SENDS', 1000)
+    # Session status is pushed on change, this is only the safety net for missed notifications
+    WS_STATUS_RESYNC_SEC: float = os.getenv('WS_STATUS_RESYNC_SEC', 30)
+    # Sessions one socket may follow with {"type": "subscribe"} besides its own one
+    WS_MAX_SUBSCRIPTIONS: int = os.getenv('WS_MAX_SUBSCRIPTIONS', 500)
+    # Connection registry: connections of nodes that missed heartbeats for CONNECTION_TTL_SEC are swept
+    CONNECTION_HEARTBEAT_SEC: float = os.getenv('CONNECTION_HEARTBEAT_SEC', 15)
+    CONNECTION_TTL_SEC: float = os.getenv('CONNECTION_TTL_SEC', 45)
+    # Graceful shutdown: clients reconnect after SSE_RETRY_MS plus a random jitter up to SSE_RETRY_JITTER_MS
+    SSE_RETRY_MS: int = os.getenv('SSE_RETRY_MS', 1000)
+    SSE_RETRY_JITTER_MS: int = os.getenv('SSE_RETRY_JITTER_MS', 10000)
+    SSE_SHUTDOWN_GRACE_SEC: float = os.getenv('SSE_SHUTDOWN_GRACE_SEC', 2)
+
     BACKEND_CORS_ORIGINS: list[AnyHttpUrl] = field(default_factory=list)
 
+    @field_validator('WS_QUEUE_POLICY')
+    @classmethod
+    def check_ws_queue_policy(cls, v: str) -> str:
+        if v not in ('drop_oldest', 'disconnect'):
+            raise ValueError(f'WS_QUEUE_POLICY must be drop_oldest or disconnect, not {v}')
+        return v
+
     @field_validator('BACKEND_CORS_ORIGINS', mode='before')
     @classmethod
     def assemble_cors_origins(cls, v: str | list[str]) -> list[str] | str:
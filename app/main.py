@@ -8,11 +8,16 @@ from starlette.middleware.cors import CORSMiddleware
 
 from app.api import api_router
 from app.api.sse_eventbus import event_bus
+from app.api.ws_manager import ws_manager
 from app.core.config import settings
 from app.core.exceptions import exception_handler
 from app.core.logging import UvicornAccessLogFormatter
 from app.core.logging import UvicornCommonLogFormatter
 from app.core.openapi import custom_openapi
+from app.services.expiry import expiry_engine
+from app.services.pubsub import pubsub_mux
+from app.services.redis_service import redis_service
+from app.services.session_sweeper import session_sweeper
 
 
 @asynccontextmanager
@@ -28,9 +33,18 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     access_logger.setLevel(level)
     access_logger.handlers[0].setFormatter(UvicornAccessLogFormatter())
 
+    await redis_service.cache.start(pubsub_mux)
+    session_sweeper.start()
+
     yield
 
-    await event_bus.close_all_connections()
+    await event_bus.close_local_connections()
+    await ws_manager.close()
+    await redis_service.progress.close()
+    await redis_service.cache.close()
+    await session_sweeper.close()
+    await event_bus.backend.close()
+    await expiry_engine.close()
 
 
 app = FastAPI(
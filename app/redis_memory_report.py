@@ -0,0 +1,199 @@
+"""Redis keyspace memory report.
+
+Walks the keyspace with SCAN, so no KEYS or other blocking commands, and groups the keys by the subsystem that
+writes them. Every key is counted, a sample of them is measured with MEMORY USAGE and TTL. Reports per group the
+key count, the estimated total memory, the memory distribution and TTL coverage of the sample and its largest keys.
+
+    python -m app.redis_memory_report --sample-rate 0.1
+    python -m app.redis_memory_report --redis-url redis://localhost:6379 --json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import random
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from fnmatch import fnmatchcase
+from typing import Any
+
+import aioredis
+
+from app.services.redis_service import BaseRedis
+
+# Key patterns of the subsystems, a key belongs to the first group it matches and to 'other' if none
+KEY_GROUPS = {
+    'session': 'session:*',  # APIRedis session hashes
+    'processing_queue': 'processing_queue*',  # APIRedis processing queue
+    'event': 'event:*',  # SSEEventBus history, list storage
+    'event_stream': 'event_stream*',  # SSEEventBus history, stream storage, and the shared stream id
+    'broadcast': 'broadcast:*',  # SSEEventBus broadcast history
+    'sse': 'sse:*',  # SSE connection registry
+    'ws': 'ws:*',  # WebSocket connection registry
+    'eta': 'eta:*',  # Processing time statistics and consumer heartbeats
+    'session_sweeper': 'session_sweeper:*',
+}
+OTHER_GROUP = 'other'
+
+
+def key_group(key: str) -> str:
+    for group, pattern in KEY_GROUPS.items():
+        if fnmatchcase(key, pattern):
+            return group
+    return OTHER_GROUP
+
+
+def percentile(values: list[int], p: float) -> int:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0
+    rank = max(round(p / 100 * len(values)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+@dataclass
+class GroupStats:
+    keys: int = 0
+    sampled: int = 0
+    with_ttl: int = 0  # Sampled keys with an expiration
+    memory: list[int] = field(default_factory=list)  # MEMORY USAGE of the sampled keys
+    largest: list[tuple[int, str]] = field(default_factory=list)  # Heap of the largest sampled keys
+
+    def add_sample(self, key: str, used: int, ttl: int, top: int) -> None:
+        self.sampled += 1
+        self.with_ttl += ttl >= 0
+        self.memory.append(used)
+        if len(self.largest) < top:
+            heapq.heappush(self.largest, (used, key))
+        elif top:
+            heapq.heappushpop(self.largest, (used, key))
+
+    def summary(self) -> dict[str, Any]:
+        memory = sorted(self.memory)
+        mean = sum(memory) / len(memory) if memory else 0
+        return {
+            'keys': self.keys,
+            'sampled': self.sampled,
+            # None if no key of the group was sampled
+            'estimated_bytes': round(mean * self.keys) if memory else None,
+            'memory_bytes': {
+                'mean': round(mean),
+                'p50': percentile(memory, 50),
+                'p90': percentile(memory, 90),
+                'p99': percentile(memory, 99),
+                'max': memory[-1] if memory else 0,
+            },
+            'ttl_coverage': self.with_ttl / self.sampled if self.sampled else None,
+            'largest': [{'key': key, 'bytes': used} for used, key in sorted(self.largest, reverse=True)],
+        }
+
+
+@dataclass
+class ReportConfig:
+    match: str = '*'
+    sample_rate: float = 0.1  # Share of the scanned keys measured with MEMORY USAGE
+    batch_size: int = 1000  # COUNT of every SCAN call
+    pause: float = 0.01  # Seconds between SCAN calls, to leave room for the other clients
+    max_keys: int | None = None  # Stop after the SCAN call that reaches this many keys
+    top: int = 10  # Largest keys reported per group
+    memory_samples: int | None = None  # SAMPLES of MEMORY USAGE for nested values, default: Redis' own
+    seed: int | None = None
+
+
+async def scan_keyspace(redis: aioredis.Redis, config: ReportConfig) -> dict[str, GroupStats]:
+    rng = random.Random(config.seed)
+    groups: dict[str, GroupStats] = {}
+    scanned = 0
+    cursor = 0
+    while True:
+        cursor, keys = await redis.scan(cursor=cursor, match=config.match, count=config.batch_size)
+        sample = []
+        for key in keys:
+            groups.setdefault(key_group(key), GroupStats()).keys += 1
+            if rng.random() < config.sample_rate:
+                sample.append(key)
+        if sample:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in sample:
+                    await pipe.memory_usage(key, samples=config.memory_samples)
+                    await pipe.ttl(key)
+                results = await pipe.execute()
+            for key, used, ttl in zip(sample, results[::2], results[1::2], strict=True):
+                # The key expired or was deleted since the SCAN call
+                if used is not None and ttl != -2:
+                    groups[key_group(key)].add_sample(key, used, ttl, config.top)
+        scanned += len(keys)
+        if cursor == 0 or (config.max_keys is not None and scanned >= config.max_keys):
+            return groups
+        await asyncio.sleep(config.pause)
+
+
+def format_report(groups: dict[str, GroupStats]) -> str:
+    summaries = sorted(
+        ((group, stats.summary()) for group, stats in groups.items()),
+        key=lambda item: (item[1]['estimated_bytes'] or 0, item[1]['keys']),
+        reverse=True,
+    )
+    lines = [
+        f'{"group":<18}{"keys":>10}{"sampled":>9}{"est. total":>14}{"mean":>9}{"p50":>9}{"p90":>9}{"p99":>9}'
+        f'{"max":>10}{"ttl":>7}'
+    ]
+    for group, summary in summaries:
+        memory = summary['memory_bytes']
+        ttl = f'{summary["ttl_coverage"]:.0%}' if summary['ttl_coverage'] is not None else '-'
+        estimated = summary['estimated_bytes'] if summary['estimated_bytes'] is not None else '-'
+        lines.append(
+            f'{group:<18}{summary["keys"]:>10}{summary["sampled"]:>9}{estimated:>14}'
+            f'{memory["mean"]:>9}{memory["p50"]:>9}{memory["p90"]:>9}{memory["p99"]:>9}{memory["max"]:>10}{ttl:>7}'
+        )
+    for group, summary in summaries:
+        if summary['largest']:
+            lines.append(f'\nlargest {group} keys:')
+            lines.extend(f'  {item["bytes"]:>10}  {item["key"]}' for item in summary['largest'])
+    return '\n'.join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> tuple[ReportConfig, argparse.Namespace]:
+    defaults = ReportConfig()
+    parser = argparse.ArgumentParser(description=__doc__.partition('\n')[0])
+    parser.add_argument('--match', default=defaults.match, help='SCAN pattern of the keys to report')
+    parser.add_argument('--sample-rate', type=float, default=defaults.sample_rate, help='share of keys measured')
+    parser.add_argument('--batch-size', type=int, default=defaults.batch_size, help='SCAN count')
+    parser.add_argument('--pause', type=float, default=defaults.pause, help='seconds between SCAN calls')
+    parser.add_argument('--max-keys', type=int, default=None, help='default: the whole keyspace')
+    parser.add_argument('--top', type=int, default=defaults.top, help='largest keys per group')
+    parser.add_argument('--memory-samples', type=int, default=None, help='MEMORY USAGE samples, 0: exact')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--redis-url', default=None, help='default: the REDIS_* settings')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+    config = ReportConfig(**{
+        name: getattr(args, name) for name in ReportConfig.__dataclass_fields__ if hasattr(args, name)
+    })
+    return config, args
+
+
+async def report(config: ReportConfig, redis_url: str | None = None) -> dict[str, GroupStats]:
+    base_redis = BaseRedis()
+    if redis_url:
+        base_redis.redis = aioredis.from_url(redis_url, decode_responses=True)
+    try:
+        return await scan_keyspace(base_redis.redis, config)
+    finally:
+        await base_redis.redis.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    config, args = parse_args(argv)
+    groups = asyncio.run(report(config, args.redis_url))
+    if args.json:
+        output = json.dumps({'config': asdict(config), 'groups': {g: s.summary() for g, s in groups.items()}}, indent=2)
+    else:
+        output = format_report(groups)
+    print(output)  # noqa: T201
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@ from enum import Enum
 from pydantic import BaseModel
 from pydantic import Field
 
+# SSE comment line marking latest-wins events, clients ignore comment lines
+COALESCE_COMMENT = ': coalesce'
+
 
 class NotificationType(str, Enum):
     CRITICAL = 'CRITICAL'
@@ -19,6 +22,21 @@ class Position(str, Enum):
     CENTER = 'center'
 
 
+class EventStorage(str, Enum):
+    LIST = 'list'
+    STREAM = 'stream'
+
+
+class EventEncoding(str, Enum):
+    FRAME = 'frame'
+    COMPACT = 'compact'
+
+
+class EventBackendType(str, Enum):
+    REDIS = 'redis'
+    MEMORY = 'memory'
+
+
 class EventData(BaseModel):
     id: str
     message: str
@@ -30,9 +48,26 @@ class EventData(BaseModel):
 class Event(BaseModel):
     name: str
     data: EventData
+    id: str | None = None  # Redis stream entry id, only set in the stream storage mode
+    coalesce: bool = False  # Latest-wins event, listeners may skip it if a newer one with the same name is queued
+    retry: int | None = None  # Reconnection delay hint for the browser, ms
 
     def as_sse_dict(self) -> dict[str, str]:
-        return {
+        sse_dict = {
             'event': self.name,
             'data': self.data.model_dump(),
         }
+        if self.id:
+            sse_dict['id'] = self.id
+        return sse_dict
+
+    def as_sse_frame(self) -> str:
+        """Encode the event as a server-sent event wire frame with JSON data."""
+        frame = f'event: {self.name}\ndata: {self.data.model_dump_json()}\n\n'
+        if self.id:
+            frame = f'id: {self.id}\n{frame}'
+        if self.retry is not None:
+            frame = f'retry: {self.retry}\n{frame}'
+        if self.coalesce:
+            frame = f'{COALESCE_COMMENT}\n{frame}'
+        return frame
@@ -12,3 +12,23 @@ class Session(SessionPublic):
     estimated_time: int | None = None
     completed_timestamp: float | None = None
     timestamp: float = None
+
+
+class SessionStatusQuery(BaseModel):
+    session_ids: list[str]
+
+
+class SessionRecord(BaseModel):
+    """Session as stored in Redis: the ``session:{id}`` hash and the position in the processing queue.
+
+    Fields that were not read or are not set are None.
+    """
+
+    status: str | None = None
+    progress: int | None = None
+    track_id: str | None = None
+    timestamp: float | None = None
+    completed_timestamp: float | None = None
+    download_url: str | None = None
+    input_size: int | None = None
+    position: int | None = None
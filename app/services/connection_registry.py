@@ -0,0 +1,271 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Any
+
+from aioredis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.utils import generate_id
+from app.services.expiry import ExpiryEngine
+from app.services.expiry import expiry_engine
+from app.services.redis_service import BaseRedis
+from app.services.redis_service import redis_base
+
+# Unique id of this worker process, the hostname alone is not enough for several workers per host
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}:{generate_id()}'
+
+# Removes connections and nodes whose last heartbeat is older than the deadline, at most ARGV[2] connections.
+# Session index entries still pointing to a removed connection are removed too.
+# KEYS[1] - connections zset; KEYS[2] - connection info hash; KEYS[3] - nodes zset; KEYS[4] - session index hash;
+# ARGV[1] - deadline
+SWEEP_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(stale) do
+    local info = redis.call('HGET', KEYS[2], id)
+    local ok, decoded = pcall(cjson.decode, info or '')
+    if ok and type(decoded) == 'table' and decoded['session_id'] then
+        if redis.call('HGET', KEYS[4], decoded['session_id']) == id then
+            redis.call('HDEL', KEYS[4], decoded['session_id'])
+        end
+    end
+end
+if #stale > 0 then
+    redis.call('ZREM', KEYS[1], unpack(stale))
+    redis.call('HDEL', KEYS[2], unpack(stale))
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+return #stale
+"""
+
+# Removes the session index entry only if it still points to the connection.
+# KEYS[1] - session index hash; ARGV[1] - session id; ARGV[2] - connection id
+RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def connection_node(connection_id: str) -> str:
+    return connection_id.partition('|')[0]
+
+
+class ConnectionRegistry:
+    """Cluster-wide registry of open connections kept alive by heartbeats.
+
+    Every node refreshes the scores of its own connections in a sorted set, so connections of a crashed node
+    stop being refreshed and are swept once they are older than connection_ttl. Counting is a ZCARD and
+    listing is paginated with ZSCAN. Transports with one connection per session also keep a session index,
+    see claim_session.
+    """
+
+    def __init__(
+        self,
+        base_redis: BaseRedis,
+        expiry: ExpiryEngine,
+        prefix: str = 'sse',
+        heartbeat_interval: float = 15,
+        connection_ttl: float = 45,
+        batch_size: int = 1000,
+    ) -> None:
+        self.redis = base_redis.get_redis()
+        self.expiry = expiry
+        self.node_id = NODE_ID
+        self.heartbeat_interval = heartbeat_interval
+        self.connection_ttl = connection_ttl
+        self.batch_size = batch_size
+        self.nodes_key = f'{prefix}:nodes'
+        self.connections_key = f'{prefix}:connections'
+        self.info_key = f'{prefix}:connection_info'
+        self.sessions_key = f'{prefix}:sessions'
+        self.sweep_script = self.redis.register_script(SWEEP_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+        self.local_connections: dict[str, dict[str, Any]] = {}
+        # Connection id -> session id of the local connections that claimed their session
+        self._claims: dict[str, str] = {}
+        self._heartbeat: asyncio.Task | None = None
+
+    async def add(self, session_id: str, connection_info: dict[str, Any] | None = None) -> str:
+        connection_id = f'{self.node_id}|{generate_id()}'
+        info = {
+            **(connection_info or {}),
+            'session_id': session_id,
+            'node_id': self.node_id,
+            'connected_at': time.time(),
+        }
+        self.local_connections[connection_id] = info
+        try:
+            async with self.redis.pipeline() as pipe:
+                await pipe.zadd(self.connections_key, {connection_id: time.time()})
+                await pipe.hset(self.info_key, connection_id, json.dumps(info))
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f'Error adding connection for user {session_id}: {e}')
+
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        return connection_id
+
+    def remove(self, connection_id: str) -> None:
+        self.local_connections.pop(connection_id, None)
+        self._claims.pop(connection_id, None)
+        self.expiry.schedule(0, 'zrem', self.connections_key, connection_id)
+        self.expiry.schedule(0, 'hdel', self.info_key, connection_id)
+
+    async def claim_session(self, session_id: str, connection_id: str) -> str | None:
+        """Make the connection the one of the session. Returns the previous connection of the session."""
+        try:
+            async with self.redis.pipeline() as pipe:
+                await pipe.hget(self.sessions_key, session_id)
+                await pipe.hset(self.sessions_key, session_id, connection_id)
+                previous, _ = await pipe.execute()
+        except RedisError as e:
+            logger.error(f'Error claiming session {session_id}: {e}')
+            return None
+        if connection_id in self.local_connections:
+            self._claims[connection_id] = session_id
+        return previous if previous != connection_id else None
+
+    async def release_session(self, session_id: str, connection_id: str) -> None:
+        """Remove the session index entry, unless a newer connection has claimed the session meanwhile."""
+        self._claims.pop(connection_id, None)
+        try:
+            await self.release_script(keys=[self.sessions_key], args=[session_id, connection_id])
+        except RedisError as e:
+            logger.error(f'Error releasing session {session_id}: {e}')
+
+    async def session_connection(self, session_id: str) -> str | None:
+        return await self.redis.hget(self.sessions_key, session_id)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await self.heartbeat()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def heartbeat(self) -> int:
+        """Refresh this node and its connections, then sweep expired ones. Returns the number of swept.
+
+        Connections are written back in full, so local connections another node swept while this one missed
+        heartbeats, e.g. during a Redis outage, are registered again. Their session index entries too, unless
+        a newer connection has claimed the session meanwhile.
+        """
+        now = time.time()
+        infos = [(connection_id, json.dumps(info)) for connection_id, info in self.local_connections.items()]
+        try:
+            async with self.redis.pipeline() as pipe:
+                await pipe.zadd(self.nodes_key, {self.node_id: now})
+                for i in range(0, len(infos), self.batch_size):
+                    batch = dict(infos[i : i + self.batch_size])
+                    await pipe.zadd(self.connections_key, dict.fromkeys(batch, now))
+                    await pipe.hset(self.info_key, mapping=batch)
+                for connection_id, session_id in self._claims.items():
+                    await pipe.hsetnx(self.sessions_key, session_id, connection_id)
+                await pipe.execute()
+            swept = await self.sweep_script(
+                keys=[self.connections_key, self.info_key, self.nodes_key, self.sessions_key],
+                args=[now - self.connection_ttl, self.batch_size],
+            )
+        except RedisError as e:
+            logger.error(f'Error sending connection heartbeat: {e}')
+            return 0
+
+        if swept:
+            logger.info(f'Swept {swept} expired connections')
+        return swept
+
+    async def count(self) -> dict[str, int]:
+        async with self.redis.pipeline() as pipe:
+            await pipe.zcard(self.connections_key)
+            await pipe.zcard(self.nodes_key)
+            connections, nodes = await pipe.execute()
+        return {'connections': connections, 'nodes': nodes, 'local': len(self.local_connections)}
+
+    async def page(self, cursor: int = 0, count: int = 100) -> dict[str, Any]:
+        """One page of connections. The returned cursor is 0 when the iteration is complete."""
+        cursor, members = await self.redis.zscan(self.connections_key, cursor=cursor, count=count)
+        connection_ids = [connection_id for connection_id, _ in members]
+        infos = await self.redis.hmget(self.info_key, connection_ids) if connection_ids else []
+        connections = []
+        for connection_id, (_, heartbeat), info in zip(connection_ids, members, infos, strict=False):
+            connection = json.loads(info) if info else {}
+            connection.update(connection_id=connection_id, heartbeat=heartbeat)
+            connections.append(connection)
+        return {'cursor': cursor, 'connections': connections}
+
+    async def close(self) -> None:
+        """Stop the heartbeat and deregister this node with all of its connections."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        connection_ids = list(self.local_connections)
+        self.local_connections.clear()
+        self._claims.clear()
+        try:
+            async with self.redis.pipeline() as pipe:
+                await pipe.zrem(self.nodes_key, self.node_id)
+                for i in range(0, len(connection_ids), self.batch_size):
+                    batch = connection_ids[i : i + self.batch_size]
+                    await pipe.zrem(self.connections_key, *batch)
+                    await pipe.hdel(self.info_key, *batch)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f'Error deregistering node {self.node_id}: {e}')
+
+
+class LocalConnectionRegistry:
+    """Connection registry of a single-node deployment, connections are only kept in memory."""
+
+    def __init__(self) -> None:
+        self.node_id = NODE_ID
+        self.local_connections: dict[str, dict[str, Any]] = {}
+
+    async def add(self, session_id: str, connection_info: dict[str, Any] | None = None) -> str:
+        connection_id = f'{self.node_id}|{generate_id()}'
+        self.local_connections[connection_id] = {
+            **(connection_info or {}),
+            'session_id': session_id,
+            'node_id': self.node_id,
+            'connected_at': time.time(),
+        }
+        return connection_id
+
+    def remove(self, connection_id: str) -> None:
+        self.local_connections.pop(connection_id, None)
+
+    async def count(self) -> dict[str, int]:
+        return {'connections': len(self.local_connections), 'nodes': 1, 'local': len(self.local_connections)}
+
+    async def page(self, cursor: int = 0, count: int = 100) -> dict[str, Any]:
+        """One page of connections, the cursor is an offset."""
+        connection_ids = list(self.local_connections)[cursor : cursor + count]
+        next_cursor = cursor + count if cursor + count < len(self.local_connections) else 0
+        connections = [
+            {**self.local_connections[connection_id], 'connection_id': connection_id}
+            for connection_id in connection_ids
+        ]
+        return {'cursor': next_cursor, 'connections': connections}
+
+    async def close(self) -> None:
+        self.local_connections.clear()
+
+
+sse_registry = ConnectionRegistry(
+    redis_base,
+    expiry_engine,
+    prefix='sse',
+    heartbeat_interval=settings.CONNECTION_HEARTBEAT_SEC,
+    connection_ttl=settings.CONNECTION_TTL_SEC,
+)
+
+ws_registry = ConnectionRegistry(
+    redis_base,
+    expiry_engine,
+    prefix='ws',
+    heartbeat_interval=settings.CONNECTION_HEARTBEAT_SEC,
+    connection_ttl=settings.CONNECTION_TTL_SEC,
+)
@@ -0,0 +1,219 @@
+import asyncio
+import math
+import time
+from typing import Any
+
+from aioredis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.schemas.session import SessionRecord
+from app.schemas.task import TaskStatus
+from app.services.redis_service import BaseRedis
+from app.services.redis_service import redis_base
+
+# Bucket of all tasks, whatever their input size
+ALL_SIZES = 'all'
+
+# Adds a processing duration to the statistics of the given size buckets: the EWMA, the sample count and the
+# histogram bin of the duration. All statistics live in one hash, '{bucket}:ewma', '{bucket}:count' and
+# '{bucket}:bin:{i}' fields.
+# KEYS[1] - statistics hash; ARGV[1] - duration; ARGV[2] - EWMA weight of the new duration; ARGV[3] - histogram
+# bin of the duration; ARGV[4...] - size buckets
+RECORD_SCRIPT = """
+local duration = tonumber(ARGV[1])
+local alpha = tonumber(ARGV[2])
+for i = 4, #ARGV do
+    local ewma = tonumber(redis.call('HGET', KEYS[1], ARGV[i] .. ':ewma'))
+    if ewma then
+        ewma = alpha * duration + (1 - alpha) * ewma
+    else
+        ewma = duration
+    end
+    redis.call('HSET', KEYS[1], ARGV[i] .. ':ewma', tostring(ewma))
+    redis.call('HINCRBY', KEYS[1], ARGV[i] .. ':count', 1)
+    redis.call('HINCRBY', KEYS[1], ARGV[i] .. ':bin:' .. ARGV[3], 1)
+end
+return 1
+"""
+
+
+def size_bucket(input_size: int | None) -> str | None:
+    """Size bucket of a task input: the power of two megabytes it does not exceed, e.g. '8mb'."""
+    if not input_size:
+        return None
+    megabytes = max(input_size / (1024 * 1024), 1)
+    return f'{2 ** math.ceil(math.log2(megabytes))}mb'
+
+
+class ProcessingTimes:
+    """Processing time statistics of one size bucket: an EWMA and a log-scale histogram of the durations.
+
+    Histogram bin i covers durations from gamma ** (i - 1) to gamma ** i seconds, so quantiles are off by
+    less than (gamma - 1) / 2 relative to the true ones however long the tasks take.
+    """
+
+    def __init__(self, gamma: float, ewma: float | None = None, count: int = 0, bins: dict[int, int] | None = None):
+        self.gamma = gamma
+        self.ewma = ewma
+        self.count = count
+        self.bins = bins or {}
+
+    def quantile(self, q: float) -> float | None:
+        total = sum(self.bins.values())
+        if not total:
+            return None
+        seen = 0
+        for index, count in sorted(self.bins.items()):
+            seen += count
+            if seen >= q * total:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        # q above 1
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'count': self.count,
+            'ewma': self.ewma,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+        }
+
+
+class EtaSnapshot:
+    """Processing statistics and active consumers at one point in time, estimates the time left of tasks."""
+
+    def __init__(self, times: dict[str, ProcessingTimes], workers: int, default: float, min_samples: int) -> None:
+        self.times = times
+        self.workers = workers
+        self.default = default
+        self.min_samples = min_samples
+
+    def task_time(self, input_size: int | None = None) -> float:
+        """Expected processing time of one task: the median of its size bucket once the bucket has enough
+        samples, else the average of all tasks.
+        """
+        times = self.times.get(size_bucket(input_size))
+        if times is not None and times.count >= self.min_samples:
+            return times.quantile(0.5)
+        return self.mean_task_time()
+
+    def mean_task_time(self) -> float:
+        times = self.times.get(ALL_SIZES)
+        return times.ewma if times is not None and times.ewma is not None else self.default
+
+    def estimate(self, record: SessionRecord) -> int | None:
+        """Seconds until the task of the session is done, None if it is not queued or in progress.
+
+        A task in progress has the part of its expected time left that its progress has not covered yet. The
+        tasks ahead in the queue are shared by the active consumers, each one takes the average time.
+        """
+        try:
+            status = TaskStatus(record.status)
+        except ValueError:
+            return None
+        if status == TaskStatus.IN_PROGRESS:
+            done = min(max(record.progress or 0, 0), 100) / 100
+            return round(self.task_time(record.input_size) * (1 - done))
+        if status == TaskStatus.QUEUED:
+            waiting = (record.position or 0) * self.mean_task_time() / max(self.workers, 1)
+            return round(waiting + self.task_time(record.input_size))
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        return {'workers': self.workers, 'buckets': {bucket: times.stats() for bucket, times in self.times.items()}}
+
+
+class EtaModel:
+    """Cluster-wide model of task processing times for the ETAs of queued sessions.
+
+    Consumers record the duration of every processed task, split by the size bucket of its input, and
+    announce themselves with heartbeats. API workers read the statistics into an EtaSnapshot, kept for
+    refresh seconds so status polls do not each go to Redis.
+    """
+
+    def __init__(
+        self,
+        base_redis: BaseRedis,
+        prefix: str = 'eta',
+        alpha: float = 0.2,
+        gamma: float = 1.1,
+        default: float = 60,
+        min_samples: int = 5,
+        worker_ttl: float = 60,
+        refresh: float = 5,
+    ) -> None:
+        self.redis = base_redis.get_redis()
+        self.stats_key = f'{prefix}:stats'
+        self.workers_key = f'{prefix}:workers'
+        self.alpha = alpha
+        self.gamma = gamma
+        self.default = default
+        self.min_samples = min_samples
+        self.worker_ttl = worker_ttl
+        self.refresh = refresh
+        self.record_script = self.redis.register_script(RECORD_SCRIPT)
+        self._snapshot: EtaSnapshot | None = None
+        self._snapshot_time = 0.0
+
+    async def record(self, duration: float, input_size: int | None = None) -> None:
+        """Add the processing duration of a task in seconds."""
+        buckets = [ALL_SIZES]
+        if (bucket := size_bucket(input_size)) is not None:
+            buckets.append(bucket)
+        index = math.ceil(math.log(max(duration, 0.01), self.gamma))
+        try:
+            await self.record_script(keys=[self.stats_key], args=[duration, self.alpha, index, *buckets])
+        except RedisError as e:
+            logger.error(f'Error recording processing time: {e}')
+
+    async def heartbeat(self, worker_id: str) -> None:
+        now = time.time()
+        async with self.redis.pipeline() as pipe:
+            await pipe.zadd(self.workers_key, {worker_id: now})
+            await pipe.zremrangebyscore(self.workers_key, '-inf', now - self.worker_ttl)
+            await pipe.execute()
+
+    async def heartbeat_loop(self, worker_id: str) -> None:
+        while True:
+            try:
+                await self.heartbeat(worker_id)
+            except RedisError as e:
+                logger.error(f'Error sending consumer heartbeat: {e}')
+            await asyncio.sleep(self.worker_ttl / 3)
+
+    async def remove_worker(self, worker_id: str) -> None:
+        await self.redis.zrem(self.workers_key, worker_id)
+
+    async def snapshot(self) -> EtaSnapshot:
+        if self._snapshot is not None and time.monotonic() - self._snapshot_time < self.refresh:
+            return self._snapshot
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.hgetall(self.stats_key)
+            await pipe.zcount(self.workers_key, time.time() - self.worker_ttl, '+inf')
+            fields, workers = await pipe.execute()
+
+        times: dict[str, ProcessingTimes] = {}
+        for field, value in fields.items():
+            bucket, _, stat = field.partition(':')
+            bucket_times = times.setdefault(bucket, ProcessingTimes(self.gamma))
+            if stat == 'ewma':
+                bucket_times.ewma = float(value)
+            elif stat == 'count':
+                bucket_times.count = int(value)
+            elif stat.startswith('bin:'):
+                bucket_times.bins[int(stat[4:])] = int(value)
+
+        self._snapshot = EtaSnapshot(times, workers, self.default, self.min_samples)
+        self._snapshot_time = time.monotonic()
+        return self._snapshot
+
+
+eta_model = EtaModel(
+    redis_base,
+    alpha=settings.ETA_EWMA_ALPHA,
+    default=settings.ETA_DEFAULT_TASK_SEC,
+    worker_ttl=settings.ETA_WORKER_TTL_SEC,
+    refresh=settings.ETA_REFRESH_SEC,
+)
@@ -0,0 +1,391 @@
+import json
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import deque
+from collections.abc import Iterable
+from typing import Any
+
+import aioredis
+from aioredis.exceptions import RedisError
+
+from app.core.logging import logger
+from app.schemas.events import COALESCE_COMMENT
+from app.schemas.events import Event
+from app.schemas.events import EventData
+from app.schemas.events import EventEncoding
+from app.schemas.events import EventStorage
+from app.schemas.events import NotificationType
+from app.schemas.events import Position
+from app.services.expiry import ExpiryEngine
+from app.services.pubsub import PubSubMultiplexer
+from app.services.pubsub import Subscriber
+from app.services.redis_service import BaseRedis
+
+# Appends the event to a stream, trims the stream by length and by age and publishes the event with the
+# stream entry id spliced in, so listeners and the history share the same monotonic ids. The entry id comes from
+# a counter shared by the session and broadcast streams, so ids of events in different streams never collide and
+# their order is the order of the posts.
+# KEYS[1] - stream key; KEYS[2] - last assigned id; ARGV[1] - SSE frame; ARGV[2] - channel; ARGV[3] - max length;
+# ARGV[4] - lifetime, sec; ARGV[5] - compact event, stored instead of the frame if set
+STREAM_POST_SCRIPT = """
+local function after(ms, seq, last)
+    if not last then
+        return ms, seq
+    end
+    local last_ms, last_seq = string.match(last, '^(%d+)-(%d+)$')
+    last_ms, last_seq = tonumber(last_ms), tonumber(last_seq)
+    if last_ms > ms or (last_ms == ms and last_seq >= seq) then
+        return last_ms, last_seq + 1
+    end
+    return ms, seq
+end
+
+local field, value = 'frame', ARGV[1]
+if ARGV[5] then
+    field, value = 'e', ARGV[5]
+end
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local ms, seq = after(now_ms, 0, redis.call('GET', KEYS[2]))
+-- Streams written before the shared counter may be ahead of it
+local top = redis.call('XREVRANGE', KEYS[1], '+', '-', 'COUNT', 1)[1]
+if top then
+    ms, seq = after(ms, seq, top[1])
+end
+local id = string.format('%d-%d', ms, seq)
+redis.call('SET', KEYS[2], id)
+redis.call('XADD', KEYS[1], 'MAXLEN', ARGV[3], id, field, value)
+redis.call('XTRIM', KEYS[1], 'MINID', string.format('%d', now_ms - tonumber(ARGV[4]) * 1000))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('PUBLISH', ARGV[2], 'id: ' .. id .. '\\n' .. ARGV[1])
+return id
+"""
+
+BROADCAST_CHANNEL = 'broadcast:all'
+
+
+def channel_name(session_id: str | None) -> str:
+    """Pub/sub channel of the session, the broadcast channel for None."""
+    return BROADCAST_CHANNEL if session_id is None else f'user:{session_id}'
+
+
+# Compact stored form of an event: the prefix and a JSON array of the name, message, notification type and
+# position indexes, info, coalesce flag, data id and retry hint. Trailing items with their default value are left
+# out, the data id too if it is the session id.
+COMPACT_EVENT_PREFIX = '~1'
+NOTIFICATION_TYPES = list(NotificationType)
+POSITIONS = list(Position)
+COMPACT_EVENT_DEFAULTS = [
+    None,
+    None,
+    NOTIFICATION_TYPES.index(NotificationType.SUCCESS),
+    POSITIONS.index(Position.RIGHT_BOTTOM),
+    None,
+    0,
+    None,
+    None,
+]
+
+
+def encode_event(frame: str, session_id: str | None) -> str:
+    """Compact stored form of an SSE frame built by Event.as_sse_frame."""
+    header, _, data = frame.partition('data: ')
+    lines = header.splitlines()
+    name = retry = None
+    for line in lines:
+        if line.startswith('event: '):
+            name = line[7:]
+        elif line.startswith('retry: '):
+            retry = int(line[7:])
+    event_data = EventData.model_validate_json(data)
+    items = [
+        name,
+        event_data.message,
+        NOTIFICATION_TYPES.index(event_data.notification_type),
+        POSITIONS.index(event_data.position),
+        event_data.info,
+        int(COALESCE_COMMENT in lines),
+        None if event_data.id == session_id else event_data.id,
+        retry,
+    ]
+    while len(items) > 2 and items[-1] == COMPACT_EVENT_DEFAULTS[len(items) - 1]:
+        items.pop()
+    return COMPACT_EVENT_PREFIX + json.dumps(items, separators=(',', ':'))
+
+
+def decode_event(data: str, session_id: str | None) -> Event:
+    items = json.loads(data[len(COMPACT_EVENT_PREFIX) :])
+    name, message, notification_type, position, info, coalesce, data_id, retry = (
+        items + COMPACT_EVENT_DEFAULTS[len(items) :]
+    )
+    return Event(
+        name=name,
+        data=EventData(
+            id=data_id or session_id,
+            message=message,
+            notification_type=NOTIFICATION_TYPES[notification_type],
+            position=POSITIONS[position],
+            info=info,
+        ),
+        coalesce=bool(coalesce),
+        retry=retry,
+    )
+
+
+def as_frame(data: str, broadcast: bool = False, session_id: str | None = None) -> str:
+    """Convert a stored or published message to an SSE frame. Compact events and JSON events of older workers
+    are re-encoded.
+    """
+    if data.startswith(COMPACT_EVENT_PREFIX):
+        event = decode_event(data, session_id)
+    elif data.startswith('{'):
+        event = Event.model_validate_json(data)
+    else:
+        return data
+    if broadcast:
+        event.data.info = {**(event.data.info or {}), 'broadcast': True}
+    return event.as_sse_frame()
+
+
+def parse_stream_id(stream_id: str | None) -> tuple[int, int] | None:
+    try:
+        ms, seq = stream_id.split('-')
+        return int(ms), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+
+class EventBackend(ABC):
+    """Storage and fan-out of encoded SSE frames.
+
+    Session events are addressed by session id, broadcasts by None. Listeners subscribe a queue to the
+    channels returned by channel_name and get ``(channel, frame)`` tuples.
+    """
+
+    @abstractmethod
+    async def append(self, session_id: str | None, frame: str) -> None:
+        """Store the frame in the recent history and publish it."""
+
+    @abstractmethod
+    async def publish(self, messages: Iterable[tuple[str | None, str]]) -> None:
+        """Publish (session id, frame) messages in one batch without storing them."""
+
+    @abstractmethod
+    async def history(self, session_id: str, last_event_id: str | None = None) -> list[tuple[str | None, str]]:
+        """(id, frame) of the recent session events, only the ones after last_event_id if it is known."""
+
+    @abstractmethod
+    async def subscribe(self, queue: Subscriber, *channels: str) -> None: ...
+
+    @abstractmethod
+    async def unsubscribe(self, queue: Subscriber, *channels: str) -> None: ...
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
+
+class RedisEventBackend(EventBackend):
+    """Frames are kept in Redis lists or streams and fanned out with Redis pub/sub, shared by all workers."""
+
+    def __init__(
+        self,
+        base_redis: BaseRedis,
+        pubsub: PubSubMultiplexer,
+        expiry: ExpiryEngine,
+        max_events_per_user: int = 100,
+        message_lifetime: int = 3600,
+        storage: EventStorage = EventStorage.LIST,
+        encoding: EventEncoding = EventEncoding.FRAME,
+    ) -> None:
+        self.redis: aioredis.Redis = base_redis.get_redis()
+        self.pubsub = pubsub
+        self.expiry = expiry
+        self.max_events_per_user = max_events_per_user
+        self.message_lifetime = message_lifetime
+        self.storage = storage
+        self.encoding = encoding
+        self.broadcast_key = 'broadcast:messages'
+        self.broadcast_stream_key = 'broadcast:stream'
+        self.stream_id_key = 'event_stream_id'
+        self.stream_post_script = self.redis.register_script(STREAM_POST_SCRIPT)
+
+    async def append(self, session_id: str | None, frame: str) -> None:
+        channel = channel_name(session_id)
+        # The frame is published as it is, only the stored copy is compact
+        stored = encode_event(frame, session_id) if self.encoding == EventEncoding.COMPACT else None
+        if self.storage == EventStorage.STREAM:
+            stream_key = self.broadcast_stream_key if session_id is None else f'event_stream:{session_id}'
+            await self._stream_post(stream_key, channel, frame, stored)
+            return
+        stored = stored or frame
+
+        event_key = self.broadcast_key if session_id is None else f'event:{session_id}'
+        try:
+            async with self.redis.pipeline() as pipe:
+                # Добавляем событие в List
+                await pipe.lpush(event_key, stored)
+                # Ограничиваем количество событий
+                await pipe.ltrim(event_key, 0, self.max_events_per_user - 1)
+                # Устанавливаем TTL для всего списка событий
+                await pipe.expire(event_key, self.message_lifetime)
+                await pipe.publish(channel, frame)
+
+                await pipe.execute()
+
+            self.expiry.schedule(self.message_lifetime, 'lrem', event_key, 1, stored)
+        except RedisError as e:
+            logger.error(f'Redis error in post to {channel}: {e}')
+
+    async def _stream_post(self, stream_key: str, channel: str, frame: str, stored: str | None = None) -> None:
+        try:
+            await self.stream_post_script(
+                keys=[stream_key, self.stream_id_key],
+                args=[
+                    frame,
+                    channel,
+                    self.max_events_per_user,
+                    self.message_lifetime,
+                    *([stored] if stored else []),
+                ],
+            )
+        except RedisError as e:
+            logger.error(f'Redis error in _stream_post: {e}')
+
+    async def publish(self, messages: Iterable[tuple[str | None, str]]) -> None:
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for session_id, frame in messages:
+                    await pipe.publish(channel_name(session_id), frame)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f'Redis error in publish: {e}')
+
+    async def history(self, session_id: str, last_event_id: str | None = None) -> list[tuple[str | None, str]]:
+        if self.storage == EventStorage.STREAM:
+            return await self._stream_history(session_id, last_event_id if parse_stream_id(last_event_id) else None)
+
+        events = await self.redis.lrange(f'event:{session_id}', 0, -1)
+        return [(None, as_frame(data, session_id=session_id)) for data in events]
+
+    async def _stream_history(self, session_id: str, last_event_id: str | None) -> list[tuple[str, str]]:
+        """(id, frame) of the session stream events after last_event_id (all of them if it is not set).
+
+        Broadcasts are only replayed when resuming, a fresh connection gets the session history only.
+        """
+        start = f'({last_event_id}' if last_event_id else '-'
+        async with self.redis.pipeline() as pipe:
+            await pipe.xrange(f'event_stream:{session_id}', min=start)
+            if last_event_id:
+                await pipe.xrange(self.broadcast_stream_key, min=start)
+            results = await pipe.execute()
+
+        frames = []
+        for entries, broadcast in zip(results, (False, True), strict=False):
+            for entry_id, fields in entries:
+                stored = fields.get('frame') or fields.get('e') or fields['event']
+                frame = as_frame(stored, broadcast=broadcast, session_id=None if broadcast else session_id)
+                frames.append((entry_id, f'id: {entry_id}\n{frame}'))
+        frames.sort(key=lambda item: parse_stream_id(item[0]))
+        return frames
+
+    async def subscribe(self, queue: Subscriber, *channels: str) -> None:
+        await self.pubsub.subscribe(queue, *channels)
+
+    async def unsubscribe(self, queue: Subscriber, *channels: str) -> None:
+        await self.pubsub.unsubscribe(queue, *channels)
+
+    def stats(self) -> dict[str, Any]:
+        return self.pubsub.stats()
+
+    async def close(self) -> None:
+        await self.pubsub.close()
+
+
+class MemoryEventBackend(EventBackend):
+    """In-process backend for single-node deployments and tests, no Redis round trips.
+
+    Every session keeps a ring buffer of its recent frames and listener queues are fed directly. Frames get
+    stream-like ``<ms>-<seq>`` ids, so resuming with Last-Event-ID works the same as with Redis streams.
+    """
+
+    def __init__(self, max_events_per_user: int = 100, message_lifetime: int = 3600) -> None:
+        self.max_events_per_user = max_events_per_user
+        self.message_lifetime = message_lifetime
+        # Session id (None for broadcast) -> (id, expiration time, frame), oldest first
+        self._history: dict[str | None, deque[tuple[str, float, str]]] = {}
+        self._subscribers: dict[str, set[Subscriber]] = {}
+        self._last_id = (0, 0)
+
+    def _next_id(self) -> str:
+        ms = time.time_ns() // 1_000_000
+        last_ms, seq = self._last_id
+        self._last_id = (ms, 0) if ms > last_ms else (last_ms, seq + 1)
+        return '{}-{}'.format(*self._last_id)
+
+    def _dispatch(self, channel: str, frame: str) -> None:
+        for queue in tuple(self._subscribers.get(channel, ())):
+            queue.put_nowait((channel, frame))
+
+    async def append(self, session_id: str | None, frame: str) -> None:
+        event_id = self._next_id()
+        now = time.monotonic()
+        entries = self._history.get(session_id)
+        if entries is None:
+            entries = self._history[session_id] = deque(maxlen=self.max_events_per_user)
+        while entries and entries[0][1] <= now:
+            entries.popleft()
+        entries.append((event_id, now + self.message_lifetime, frame))
+        self._dispatch(channel_name(session_id), f'id: {event_id}\n{frame}')
+
+    async def publish(self, messages: Iterable[tuple[str | None, str]]) -> None:
+        for session_id, frame in messages:
+            self._dispatch(channel_name(session_id), frame)
+
+    async def history(self, session_id: str, last_event_id: str | None = None) -> list[tuple[str | None, str]]:
+        """Same as the Redis streams: broadcasts are only replayed when resuming."""
+        last_id = parse_stream_id(last_event_id)
+        now = time.monotonic()
+        self._prune(now)
+
+        keys = (session_id, None) if last_id else (session_id,)
+        frames = [
+            (event_id, f'id: {event_id}\n{frame}')
+            for key in keys
+            for event_id, expires_at, frame in self._history.get(key, ())
+            if expires_at > now and (last_id is None or parse_stream_id(event_id) > last_id)
+        ]
+        frames.sort(key=lambda item: parse_stream_id(item[0]))
+        return frames
+
+    def _prune(self, now: float) -> None:
+        """Drop the histories of the sessions whose newest event has expired."""
+        for key in [key for key, entries in self._history.items() if not entries or entries[-1][1] <= now]:
+            del self._history[key]
+
+    async def subscribe(self, queue: Subscriber, *channels: str) -> None:
+        for channel in channels:
+            self._subscribers.setdefault(channel, set()).add(queue)
+
+    async def unsubscribe(self, queue: Subscriber, *channels: str) -> None:
+        for channel in channels:
+            queues = self._subscribers.get(channel)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'channels': len(self._subscribers),
+            'listeners': len({queue for queues in self._subscribers.values() for queue in queues}),
+            'histories': len(self._history),
+        }
+
+    async def close(self) -> None:
+        self._subscribers.clear()
+        self._history.clear()
@@ -0,0 +1,110 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any
+
+from aioredis.exceptions import RedisError
+
+from app.core.logging import logger
+from app.services.redis_service import BaseRedis
+from app.services.redis_service import redis_base
+
+
+class ExpiryEngine:
+    """Runs delayed Redis commands (LREM, HDEL, ...) for the whole process from one background task.
+
+    Commands are kept in a deadline heap. The task sleeps until the earliest deadline, then sends every
+    command due within `resolution` seconds in one pipeline, at most batch_size commands per round trip.
+    """
+
+    def __init__(self, base_redis: BaseRedis, batch_size: int = 500, resolution: float = 0.1) -> None:
+        self.redis = base_redis.get_redis()
+        self.batch_size = batch_size
+        self.resolution = resolution
+        self._heap: list[tuple[float, int, str, tuple[Any, ...]]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.scheduled = 0
+        self.expired = 0
+        self.failed = 0
+        self.batches = 0
+
+    def schedule(self, delay: float, command: str, *args: Any) -> None:  # noqa: ANN401
+        """Run the pipeline command `command(*args)` in `delay` seconds."""
+        item = (time.monotonic() + delay, next(self._counter), command, args)
+        heapq.heappush(self._heap, item)
+        self.scheduled += 1
+        if self._heap[0] is item:
+            self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            batch = []
+            due = time.monotonic() + self.resolution
+            while self._heap and self._heap[0][0] <= due and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap))
+            await self._execute(batch)
+
+    async def _execute(self, batch: list[tuple[float, int, str, tuple[Any, ...]]]) -> None:
+        try:
+            async with self.redis.pipeline() as pipe:
+                for _, _, command, args in batch:
+                    await getattr(pipe, command)(*args)
+                results = await pipe.execute(raise_on_error=False)
+        except RedisError as e:
+            self.failed += len(batch)
+            logger.error(f'Redis error in expiry batch of {len(batch)} commands: {e}')
+            return
+
+        errors = sum(isinstance(result, Exception) for result in results)
+        self.expired += len(batch) - errors
+        self.failed += errors
+        self.batches += 1
+        logger.debug(f'Expiry batch executed: {len(batch)} commands, {errors} errors')
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'pending': len(self._heap),
+            'next_due_in': max(self._heap[0][0] - time.monotonic(), 0) if self._heap else None,
+            'scheduled': self.scheduled,
+            'expired': self.expired,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    async def close(self) -> None:
+        """Stop the task and run the commands that are due already, e.g. the cleanups of removed connections.
+
+        Commands due later are dropped, their keys are left to the sweepers and TTLs.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        due = time.monotonic() + self.resolution
+        batch = []
+        while self._heap and self._heap[0][0] <= due:
+            batch.append(heapq.heappop(self._heap))
+        for start in range(0, len(batch), self.batch_size):
+            await self._execute(batch[start : start + self.batch_size])
+        logger.info(f'Expiry engine stopped, {len(batch)} due commands run, {len(self._heap)} pending dropped')
+
+
+expiry_engine = ExpiryEngine(redis_base)
@@ -0,0 +1,124 @@
+import asyncio
+import weakref
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Hashable
+from enum import Enum
+from typing import Any
+
+
+class QueuePolicy(str, Enum):
+    DROP_OLDEST = 'drop_oldest'  # Drop the oldest queued message
+    COALESCE = 'coalesce'  # Replace the queued message with the same key, drop the oldest one if there is none
+    DISCONNECT = 'disconnect'  # Close the queue, the connection is dropped and the client has to reconnect
+
+
+class SlowConsumerError(Exception):
+    """The queue was closed because its consumer could not keep up."""
+
+
+class QueueMetrics:
+    """Depth and drop counters of a group of listener queues."""
+
+    def __init__(self) -> None:
+        self.queues: weakref.WeakSet[ListenerQueue] = weakref.WeakSet()
+        self.dropped = 0
+        self.disconnected = 0
+
+    def stats(self) -> dict[str, Any]:
+        depths = [len(queue) for queue in self.queues if not queue.closed]
+        return {
+            'queues': len(depths),
+            'depth': sum(depths),
+            'max_depth': max(depths, default=0),
+            'dropped': self.dropped,
+            'disconnected': self.disconnected,
+        }
+
+
+class ListenerQueue:
+    """Bounded outbound queue of one SSE or WebSocket connection.
+
+    Producers never wait: when the queue is full the policy decides which message is lost. Implements the
+    part of the asyncio.Queue interface used by the pub/sub multiplexer and the listeners. on_drop is called
+    with every message that is lost, dropped by the policy or discarded by close.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        policy: QueuePolicy = QueuePolicy.DROP_OLDEST,
+        key: Callable[[Any], Hashable | None] | None = None,
+        metrics: QueueMetrics | None = None,
+        on_drop: Callable[[Any], None] | None = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+        self.on_drop = on_drop
+        self.metrics = metrics or QueueMetrics()
+        self.metrics.queues.add(self)
+        self.closed = False
+        self.dropped = 0
+        self._items: deque = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def put_nowait(self, item: Any) -> None:  # noqa: ANN401
+        if self.closed:
+            return
+
+        if len(self._items) >= self.maxsize:
+            if self.policy == QueuePolicy.DISCONNECT:
+                self.metrics.disconnected += 1
+                self.close()
+                self._drop(item)
+                return
+            if not (self.policy == QueuePolicy.COALESCE and self._replace(item)):
+                self._drop(self._items.popleft())
+            self.dropped += 1
+            self.metrics.dropped += 1
+
+        self._items.append(item)
+        self._ready.set()
+
+    def _replace(self, item: Any) -> bool:  # noqa: ANN401
+        """Remove the queued message with the same key as the item."""
+        key = self.key(item) if self.key else None
+        if key is None:
+            return False
+        for queued in self._items:
+            if self.key(queued) == key:
+                self._items.remove(queued)
+                self._drop(queued)
+                return True
+        return False
+
+    def _drop(self, item: Any) -> None:  # noqa: ANN401
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def get_nowait(self) -> Any:  # noqa: ANN401
+        if not self._items:
+            raise asyncio.QueueEmpty
+        return self._items.popleft()
+
+    async def get(self) -> Any:  # noqa: ANN401
+        while not self._items:
+            if self.closed:
+                raise SlowConsumerError
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+    def close(self) -> None:
+        self.closed = True
+        items, self._items = self._items, deque()
+        self._ready.set()
+        for item in items:
+            self._drop(item)
@@ -50,28 +50,39 @@ class RQueue:
             logger.error(f'Error connecting to RabbitMQ: {e}')
             raise e
 
-    async def send_to_queue(self, message: dict) -> bool:
-        """Sends a message to the processing queue and creates a task record in Redis.
+    async def send_to_queue(self, message: dict) -> int | None:
+        """Queues the task in Redis and sends the message to the processing queue.
 
         Args:
-        - message (dict): Message data to be sent, including 'session_id'.
+        - message (dict): Message data to be sent, including 'session_id' and 'task_id', optionally 'input_size'.
 
         Steps:
         1. Extracts 'session_id' from the message.
-        2. Acquires a channel from the RabbitMQ channel pool.
-        3. Declares a durable queue 'processing_queue'.
-        4. Publishes the message to the queue as a JSON byte string.
-        5. Releases the channel back to the pool.
-        6. Creates a task record in Redis using 'session_id'.
+        2. Queues the task in Redis using 'session_id', unless the session is queued already.
+        3. Acquires a channel from the RabbitMQ channel pool.
+        4. Declares a durable queue 'processing_queue'.
+        5. Publishes the message to the queue as a JSON byte string.
+        6. Releases the channel back to the pool.
 
-        Logs errors if sending the message or creating the record fails.
+        The task is queued in Redis first, so concurrent requests of the same session cannot both publish it
+        and the consumer never gets a task without its record. If publishing fails the task is deleted.
 
-        Returns: None
+        Logs errors if creating the record or sending the message fails.
+
+        Returns: position of the task in the processing queue, None on errors.
+
+        Raises: TaskAlreadyQueuedError if the session is queued already.
 
         """
         session_id = message['session_id']
         task_id = message['task_id']
 
+        try:
+            position = await redis_service.create_task(session_id, task_id, message.get('input_size'))
+        except RedisError as e:
+            logger.error(f'Error creating record in Redis queue: {e!s}')
+            return None
+
         try:
             async with self.channel_pool.acquire() as channel:
                 queue = await channel.declare_queue('processing_queue', durable=True)
@@ -82,15 +93,10 @@ class RQueue:
                 )
         except AMQPError as e:
             logger.error(f'Error sending message to queue: {e!s}')
-            return False
-
-        try:
-            await redis_service.create_task(session_id, task_id)
-        except RedisError as e:
-            logger.error(f'Error creating record in Redis queue: {e!s}')
-            return False
+            await redis_service.delete_task(session_id)
+            return None
 
-        return True
+        return position
 
 
 r_queue = RQueue()
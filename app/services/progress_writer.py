@@ -0,0 +1,115 @@
+import asyncio
+import time
+from collections.abc import Awaitable
+from collections.abc import Callable
+
+from aioredis.exceptions import RedisError
+
+from app.core.logging import logger
+
+
+class ProgressWriter:
+    """Throttles and batches the progress writes of the sessions of the process.
+
+    update only records the value. Every tick seconds the values that changed by at least min_delta percent
+    since the last write, or were last written min_interval seconds ago, are written with one call of write
+    for all sessions. flush writes the last value of a session right away, e.g. the final one.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[dict[str, int]], Awaitable[None]],
+        min_delta: int = 5,
+        min_interval: float = 1,
+        tick: float = 0.2,
+    ) -> None:
+        self.write = write
+        self.min_delta = min_delta
+        self.min_interval = min_interval
+        self.tick = tick
+        # Session id -> last value
+        self._latest: dict[str, int] = {}
+        # Session id -> (last written value, time of the write)
+        self._written: dict[str, tuple[int, float]] = {}
+        # Writes of the ticks and of flush do not overlap, so an older value never lands after a newer one
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.updates = 0
+        self.writes = 0
+        self.batches = 0
+
+    def update(self, session_id: str, progress: int) -> None:
+        self._latest[session_id] = progress
+        self.updates += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self, session_id: str) -> None:
+        """Write the last value of the session if it is not written yet and forget the session."""
+        async with self._lock:
+            progress = self._latest.pop(session_id, None)
+            written = self._written.pop(session_id, None)
+            if progress is not None and (written is None or written[0] != progress):
+                await self.write({session_id: progress})
+                self.writes += 1
+                self.batches += 1
+
+    def discard(self, session_id: str) -> None:
+        """Forget the session without writing its last value, e.g. once its task has failed."""
+        self._latest.pop(session_id, None)
+        self._written.pop(session_id, None)
+
+    async def _run(self) -> None:
+        while self._latest:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._write_due()
+            except RedisError as e:
+                # The values stay due and are written by the next tick
+                logger.error(f'Error writing progress of {len(self._latest)} sessions: {e}')
+
+    async def _write_due(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            due = {}
+            for session_id, progress in list(self._latest.items()):
+                written = self._written.get(session_id)
+                if written is None:
+                    due[session_id] = progress
+                    continue
+                value, written_at = written
+                if value == progress:
+                    if now - written_at >= self.min_interval:
+                        # Nothing changed for a while, the session is forgotten until its next update
+                        del self._latest[session_id]
+                        del self._written[session_id]
+                elif abs(progress - value) >= self.min_delta or now - written_at >= self.min_interval:
+                    due[session_id] = progress
+            if not due:
+                return
+
+            await self.write(due)
+            for session_id, progress in due.items():
+                if session_id in self._latest:
+                    self._written[session_id] = (progress, now)
+            self.writes += len(due)
+            self.batches += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'sessions': len(self._latest),
+            'updates': self.updates,
+            'writes': self.writes,
+            'batches': self.batches,
+        }
+
+    async def close(self) -> None:
+        """Write the last values of all sessions and stop."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for session_id in list(self._latest):
+            try:
+                await self.flush(session_id)
+            except RedisError as e:
+                logger.error(f'Error writing progress of session {session_id}: {e}')
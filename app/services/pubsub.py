@@ -0,0 +1,122 @@
+import asyncio
+from typing import Any
+
+from aioredis.client import PubSub
+from aioredis.exceptions import RedisError
+
+from app.core.logging import logger
+from app.services.listener_queue import ListenerQueue
+from app.services.redis_service import BaseRedis
+from app.services.redis_service import redis_base
+
+Subscriber = asyncio.Queue | ListenerQueue
+
+
+class PubSubMultiplexer:
+    """One Redis pub/sub connection per process, shared by every local listener.
+
+    Listeners register a queue for a set of channels. Redis SUBSCRIBE is only sent for the first local
+    subscriber of a channel and UNSUBSCRIBE for the last one, so the number of Redis connections and the
+    number of copies of a broadcast sent over the wire do not depend on the number of listeners.
+    Incoming messages are put into every registered queue as ``(channel, data)`` tuples.
+    """
+
+    def __init__(self, base_redis: BaseRedis, read_timeout: float = 1.0) -> None:
+        self.redis = base_redis.get_redis()
+        self.read_timeout = read_timeout
+        self._pubsub: PubSub | None = None
+        self._reader: asyncio.Task | None = None
+        self._subscribers: dict[str, set[Subscriber]] = {}
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, queue: Subscriber, *channels: str) -> None:
+        async with self._lock:
+            new_channels = [channel for channel in channels if not self._subscribers.get(channel)]
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(queue)
+
+            if new_channels:
+                if self._pubsub is None:
+                    self._pubsub = self.redis.pubsub()
+                try:
+                    await self._pubsub.subscribe(*new_channels)
+                except RedisError:
+                    for channel in channels:
+                        self._discard(queue, channel)
+                    raise
+                logger.info(f'Pubsub subscribed: {", ".join(new_channels)}')
+
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, queue: Subscriber, *channels: str) -> None:
+        async with self._lock:
+            stale_channels = [channel for channel in channels if self._discard(queue, channel)]
+            if not stale_channels or self._pubsub is None:
+                return
+            try:
+                await self._pubsub.unsubscribe(*stale_channels)
+                logger.info(f'Pubsub unsubscribed: {", ".join(stale_channels)}')
+            except RedisError as e:
+                logger.error(f'Error unsubscribing from {", ".join(stale_channels)}: {e}')
+
+    def _discard(self, queue: Subscriber, channel: str) -> bool:
+        """Remove the queue from the channel. Returns True if the channel has no local subscribers left."""
+        queues = self._subscribers.get(channel)
+        if not queues or queue not in queues:
+            return False
+        queues.discard(queue)
+        if queues:
+            return False
+        del self._subscribers[channel]
+        return True
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        for queue in tuple(self._subscribers.get(channel, ())):
+            queue.put_nowait((channel, data))
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=self.read_timeout)
+            except (RedisError, OSError) as e:
+                logger.error(f'Error reading pubsub: {e}')
+                await asyncio.sleep(self.read_timeout)
+                await self._reconnect()
+                continue
+
+            if message is None or message['type'] != 'message':
+                continue
+            self._dispatch(message['channel'], message['data'])
+
+    async def _reconnect(self) -> None:
+        # Reconnecting fires the connection callback of aioredis, which re-subscribes to every channel
+        connection = self._pubsub.connection if self._pubsub is not None else None
+        if connection is None:
+            return
+        try:
+            await connection.connect()
+        except (RedisError, OSError) as e:
+            logger.error(f'Error reconnecting pubsub: {e}')
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'channels': len(self._subscribers),
+            'listeners': len({queue for queues in self._subscribers.values() for queue in queues}),
+        }
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except RedisError as e:
+                logger.error(f'Error closing pubsub: {e}')
+            self._pubsub = None
+        self._subscribers.clear()
+        logger.info('Pubsub closed')
+
+
+pubsub_mux = PubSubMultiplexer(redis_base)
@@ -1,10 +1,20 @@
+import json
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
 from datetime import datetime
+from typing import Any
 
 import aioredis
+from aioredis.client import Pipeline
+from aioredis.client import Script
 
 from app.core.config import settings
 from app.core.logging import logger
+from app.schemas.session import SessionRecord
 from app.schemas.task import TaskStatus
+from app.services.progress_writer import ProgressWriter
+from app.services.session_cache import SessionCache
 
 
 class BaseRedis:
@@ -52,32 +62,490 @@ class BaseRedis:
 
 redis_base = BaseRedis()
 
+# Every write of the session hash publishes the changed fields to the session channel and every change of the
+# processing queue publishes the session id to QUEUE_CHANNEL, so status listeners do not have to poll
+QUEUE_CHANNEL = 'processing_queue:changed'
+# Every write of a session also publishes its id here, for the session caches of all workers
+SESSION_CHANGED_CHANNEL = 'sessions:changed'
+
+
+def session_channel(session_id: str) -> str:
+    return f'session_status:{session_id}'
+
+
+# Queued sessions scored by enqueue time, the position of a session is its ZRANK.
+# Older workers kept the queue in the 'processing_queue' list, see APIRedis.migrate_queue
+QUEUE_KEY = 'processing_queue:zset'
+LEGACY_QUEUE_KEY = 'processing_queue'
+
+# Moves the sessions of the legacy list into the sorted set in the list order, ahead of the sessions enqueued
+# since the sorted set exists. Sessions already in the sorted set keep their score.
+# KEYS[1] - legacy list; KEYS[2] - sorted set; ARGV[1] - current time
+MIGRATE_QUEUE_SCRIPT = """
+if redis.call('TYPE', KEYS[1])['ok'] ~= 'list' then
+    return 0
+end
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+local base = tonumber(first[2] or ARGV[1]) - #items
+for i, session_id in ipairs(items) do
+    redis.call('ZADD', KEYS[2], 'NX', base + i - 1, session_id)
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+# Session state transitions, each one is a single round trip. The scripts publish the same notifications as
+# APIRedis._notify when they change the session.
+# KEYS[1] - session hash; KEYS[2] - processing queue; ARGV[1] - session id; ARGV[2] - changes JSON;
+# ARGV[3] - session channel; ARGV[4] - SESSION_CHANGED_CHANNEL; ARGV[5] - QUEUE_CHANNEL;
+# ARGV[6] - TTL of the session hash after the change
+NOTIFY_LUA = """
+local function notify(queue_changed)
+    redis.call('PUBLISH', ARGV[3], ARGV[2])
+    redis.call('PUBLISH', ARGV[4], ARGV[1])
+    if queue_changed then
+        redis.call('PUBLISH', ARGV[5], ARGV[1])
+    end
+end
+
+-- Sets the hash fields of a JSON object from encode_session, fields mapped to null are deleted
+local function write(fields)
+    for field, value in pairs(cjson.decode(fields)) do
+        if value == cjson.null then
+            redis.call('HDEL', KEYS[1], field)
+        else
+            redis.call('HSET', KEYS[1], field, value)
+        end
+    end
+end
+"""
+
+# Sets the status if the current one is allowed and, if ARGV[7] is 1, the session is not queued.
+# Returns {1 if the status was set else 0, status before}.
+# ARGV[7] - refuse queued sessions; ARGV[8] - new status; ARGV[9...] - statuses allowed before
+TRANSITION_SCRIPT = NOTIFY_LUA + """
+local current = redis.call('HGET', KEYS[1], 'status')
+if ARGV[7] == '1' and redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return {0, current}
+end
+for i = 9, #ARGV do
+    if ARGV[i] == current then
+        redis.call('HSET', KEYS[1], 'status', ARGV[8])
+        redis.call('EXPIRE', KEYS[1], ARGV[6])
+        notify(false)
+        return {1, current}
+    end
+end
+return {0, current}
+"""
+
+# Queues the session and sets the hash fields, unless the session is queued already.
+# Returns {1 if queued else 0, position}.
+# ARGV[7] - enqueue time; ARGV[8] - hash fields JSON
+ENQUEUE_SCRIPT = NOTIFY_LUA + """
+if redis.call('ZADD', KEYS[2], 'NX', ARGV[7], ARGV[1]) == 0 then
+    return {0, redis.call('ZRANK', KEYS[2], ARGV[1])}
+end
+write(ARGV[8])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+notify(true)
+return {1, redis.call('ZRANK', KEYS[2], ARGV[1])}
+"""
+
+# Sets the progress fields if the task of the session is running, a progress write that arrives after the task
+# finished is dropped, so it can not give a finished session the TTL of a running one. Returns 1 if written.
+# ARGV[6] - not used; ARGV[7] - hash fields JSON; ARGV[8...] - pairs of a status value that reports progress and
+# the TTL of the session hash in that status
+PROGRESS_SCRIPT = NOTIFY_LUA + """
+local current = redis.call('HGET', KEYS[1], 'status')
+for i = 8, #ARGV, 2 do
+    if ARGV[i] == current then
+        write(ARGV[7])
+        redis.call('EXPIRE', KEYS[1], ARGV[i + 1])
+        notify(false)
+        return 1
+    end
+end
+return 0
+"""
+
+# Removes the session from the queue and sets the hash fields, unless it is not queued (anymore).
+# Returns 1 if the session was dequeued.
+# ARGV[7] - hash fields JSON
+DEQUEUE_SCRIPT = NOTIFY_LUA + """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+write(ARGV[7])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+notify(true)
+return 1
+"""
+
+# Removes the given sessions from the processing queue if their hash does not exist (anymore), e.g. it expired
+# while the session was queued. Returns the number removed.
+# KEYS[1] - processing queue; ARGV[1] - QUEUE_CHANNEL; ARGV[2...] - session ids
+REMOVE_ORPHANS_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV do
+    if redis.call('EXISTS', 'session:' .. ARGV[i]) == 0 and redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        redis.call('PUBLISH', ARGV[1], ARGV[i])
+        removed = removed + 1
+    end
+end
+return removed
+"""
+
+# TTL of the session hash per state of the session, see SESSION_IDLE_EXPIRE_SEC
+SESSION_TTLS: dict[TaskStatus, int] = {
+    TaskStatus.INIT: int(settings.SESSION_IDLE_EXPIRE_SEC),
+    TaskStatus.WAITING: int(settings.SESSION_IDLE_EXPIRE_SEC),
+    TaskStatus.UPLOADING: int(settings.QUEUE_EXPIRE_SEC),
+    TaskStatus.QUEUED: int(settings.QUEUE_EXPIRE_SEC),
+    TaskStatus.IN_PROGRESS: int(settings.QUEUE_EXPIRE_SEC),
+    TaskStatus.COMPLETED: int(settings.SESSION_EXPIRE_MINUTES) * 60,
+    TaskStatus.FAILED: int(settings.SESSION_EXPIRE_MINUTES) * 60,
+    TaskStatus.STOPPED: int(settings.SESSION_EXPIRE_MINUTES) * 60,
+}
+
+
+# States of a running task, progress is only reported in these
+PROGRESS_STATUSES = (TaskStatus.UPLOADING, TaskStatus.IN_PROGRESS)
+
+
+class TaskAlreadyQueuedError(Exception):
+    """The session already has a task in the processing queue."""
+
+
+# Session hash encodings. Version 0 keeps the values as they are, version 1 stores statuses as one letter codes
+# and timestamps as integer epoch milliseconds, leaves out fields with their default value and marks the hash
+# with a 'v' field. Hashes of both versions, and hashes written by both, are read alike.
+STATUS_CODES = {
+    TaskStatus.INIT: 'i',
+    TaskStatus.UPLOADING: 'u',
+    TaskStatus.QUEUED: 'q',
+    TaskStatus.IN_PROGRESS: 'p',
+    TaskStatus.COMPLETED: 'c',
+    TaskStatus.FAILED: 'f',
+    TaskStatus.STOPPED: 's',
+    TaskStatus.WAITING: 'w',
+}
+CODE_STATUSES = {code: status.value for status, code in STATUS_CODES.items()}
+TIMESTAMP_FIELDS = {'timestamp', 'completed_timestamp'}
+# Values of the fields left out of version 1 hashes
+SESSION_FIELD_DEFAULTS: dict[str, Any] = {'progress': 0, 'download_url': ''}
+VERSION_FIELD = 'v'
+
+
+def decode_status(value: str) -> str:
+    return CODE_STATUSES.get(value, value)
+
+
+def decode_timestamp(value: str, version: str | None = None) -> float:
+    """Version 0 stores float seconds, version 1 integer milliseconds. A version 1 hash may still hold float
+    seconds written by version 0 before or since, those are never integers.
+    """
+    if version is None:
+        return float(value)
+    try:
+        return int(value) / 1000
+    except ValueError:
+        return float(value)
+
+
+def status_values(status: TaskStatus) -> list[str]:
+    """The stored values of the status in all encodings."""
+    return [status.value, STATUS_CODES[status]]
+
+
+def encode_session(mapping: dict[str, Any], version: int) -> dict[str, str | None]:
+    """Hash fields of the session values in the encoding version, None marks a field to delete."""
+    if version == 0:
+        return {field: str(value) for field, value in mapping.items()}
+
+    fields: dict[str, str | None] = {VERSION_FIELD: str(version)}
+    for field, value in mapping.items():
+        if field in SESSION_FIELD_DEFAULTS and value == SESSION_FIELD_DEFAULTS[field]:
+            fields[field] = None
+        elif field == 'status':
+            fields[field] = STATUS_CODES[TaskStatus(value)]
+        elif field in TIMESTAMP_FIELDS:
+            fields[field] = str(round(value * 1000))
+        else:
+            fields[field] = str(value)
+    return fields
+
+
+# Decoders of the session hash fields, Redis keeps every value as a string
+SESSION_FIELD_TYPES: dict[str, Callable[[str], Any]] = {
+    'status': decode_status,
+    'progress': int,
+    'track_id': str,
+    'timestamp': decode_timestamp,
+    'completed_timestamp': decode_timestamp,
+    'download_url': str,
+    'input_size': int,
+}
+SESSION_FIELDS = (*SESSION_FIELD_TYPES, 'position')
+
+
+def session_fields(fields: Iterable[str]) -> list[str]:
+    """The requested session fields without duplicates, raises ValueError for an unknown one."""
+    fields = list(dict.fromkeys(fields))
+    for field in fields:
+        if field not in SESSION_FIELDS:
+            raise ValueError(f'Unknown session field: {field}')
+    return fields
+
+
+def decode_session(
+    session_id: str,
+    fields: list[str],
+    values: list[str | None],
+    version: str | None = None,
+) -> dict[str, Any]:
+    """Decode the HMGET values of the session fields, version is the value of the 'v' field of the hash."""
+    defaults = SESSION_FIELD_DEFAULTS if version is not None else {}
+    record = {}
+    for field, value in zip(fields, values, strict=True):
+        if value is None:
+            record[field] = defaults.get(field)
+            continue
+        try:
+            if field in TIMESTAMP_FIELDS:
+                record[field] = decode_timestamp(value, version)
+            else:
+                record[field] = SESSION_FIELD_TYPES[field](value)
+        except ValueError:
+            logger.warning(f'Invalid {field}={value!r} of session {session_id}')
+            record[field] = None
+    return record
+
 
 class APIRedis:
-    def __init__(self, redis: BaseRedis):
+    def __init__(
+        self,
+        redis: BaseRedis,
+        cache: SessionCache | None = None,
+        ttls: dict[TaskStatus, int] = SESSION_TTLS,
+        encoding: int = settings.SESSION_ENCODING_VERSION,
+    ):
         self.redis = redis.get_redis()
+        self.cache = cache
+        self.ttls = ttls
+        self.encoding = encoding
+        self.progress = ProgressWriter(
+            self.write_progress,
+            min_delta=settings.PROGRESS_MIN_DELTA,
+            min_interval=settings.PROGRESS_MIN_INTERVAL_SEC,
+            tick=settings.PROGRESS_TICK_SEC,
+        )
+        self.migrate_queue_script = self.redis.register_script(MIGRATE_QUEUE_SCRIPT)
+        self.transition_script = self.redis.register_script(TRANSITION_SCRIPT)
+        self.enqueue_script = self.redis.register_script(ENQUEUE_SCRIPT)
+        self.dequeue_script = self.redis.register_script(DEQUEUE_SCRIPT)
+        self.progress_script = self.redis.register_script(PROGRESS_SCRIPT)
+        self.remove_orphans_script = self.redis.register_script(REMOVE_ORPHANS_SCRIPT)
+
+    async def migrate_queue(self) -> int:
+        """Move the sessions of the legacy processing_queue list to the sorted set. Returns the number moved.
+
+        Safe to run on every start, a missing or already migrated list is left alone.
+        """
+        return await self.migrate_queue_script(keys=[LEGACY_QUEUE_KEY, QUEUE_KEY], args=[time.time()])
+
+    def _encode(self, mapping: dict[str, Any]) -> dict[str, str | None]:
+        return encode_session(mapping, self.encoding)
+
+    async def _write(self, pipe: Pipeline, session_id: str, mapping: dict[str, Any]) -> None:
+        fields = self._encode(mapping)
+        values = {field: value for field, value in fields.items() if value is not None}
+        deleted = [field for field, value in fields.items() if value is None]
+        if values:
+            await pipe.hset(f'session:{session_id}', mapping=values)
+        if deleted:
+            await pipe.hdel(f'session:{session_id}', *deleted)
+
+    def session_ttl(self, status: TaskStatus | str | None) -> int:
+        """TTL of the session hash in the given state, a missing or unknown status counts as idle."""
+        try:
+            return self.ttls[TaskStatus(decode_status(status))]
+        except ValueError:
+            return self.ttls[TaskStatus.WAITING]
+
+    async def session_exists(self, session_id: str) -> bool:
+        return bool(await self.redis.exists(f'session:{session_id}'))
+
+    async def remove_orphans(self, session_ids: list[str]) -> int:
+        """Remove the sessions without a hash from the processing queue. Returns the number removed."""
+        if not session_ids:
+            return 0
+        removed = await self.remove_orphans_script(keys=[QUEUE_KEY], args=[QUEUE_CHANNEL, *session_ids])
+        if removed:
+            for session_id in session_ids:
+                self._invalidate(session_id, queue_changed=True)
+        return removed
+
+    async def _notify(
+        self,
+        pipe: Pipeline,
+        session_id: str,
+        changes: dict[str, Any],
+        queue_changed: bool = False,
+    ) -> None:
+        self._invalidate(session_id, queue_changed)
+        await pipe.publish(session_channel(session_id), json.dumps(changes))
+        await pipe.publish(SESSION_CHANGED_CHANNEL, session_id)
+        if queue_changed:
+            await pipe.publish(QUEUE_CHANNEL, session_id)
+
+    def _invalidate(self, session_id: str, queue_changed: bool) -> None:
+        if self.cache is not None:
+            # The local cache is invalidated right away, so a read following the write never gets the old record
+            self.cache.invalidate(session_id, queue_changed)
+
+    async def _run_script(
+        self,
+        script: Script,
+        session_id: str,
+        changes: dict[str, Any],
+        queue_changed: bool,
+        ttl: int,
+        *args: Any,
+        client: Pipeline | None = None,
+    ) -> Any:
+        self._invalidate(session_id, queue_changed)
+        return await script(
+            client=client,
+            keys=[f'session:{session_id}', QUEUE_KEY],
+            args=[
+                session_id,
+                json.dumps(changes),
+                session_channel(session_id),
+                SESSION_CHANGED_CHANNEL,
+                QUEUE_CHANNEL,
+                ttl,
+                *args,
+            ],
+        )
+
+    async def transition(
+        self,
+        session_id: str,
+        status: TaskStatus,
+        allowed_from: Iterable[TaskStatus],
+        unqueued: bool = False,
+    ) -> tuple[bool, str | None]:
+        """Set the status if the current one is in allowed_from and, if unqueued is set, the session is not in
+        the processing queue. Returns whether the status was set and the status before.
+        """
+        applied, previous = await self._run_script(
+            self.transition_script,
+            session_id,
+            {'status': status.value},
+            False,
+            self.session_ttl(status),
+            int(unqueued),
+            self._encode({'status': status.value})['status'],
+            *(value for allowed in allowed_from for value in status_values(allowed)),
+        )
+        return bool(applied), previous if previous is None else decode_status(previous)
 
     async def init_task(self, session_id: str) -> None:
+        mapping = {'status': TaskStatus.WAITING.value, 'progress': 0, 'download_url': ''}
         async with self.redis.pipeline() as pipe:
-            await pipe.hset(
-                f'session:{session_id}', mapping={'status': TaskStatus.WAITING.value, 'progress': 0, 'download_url': ''},
-            )
+            await self._write(pipe, session_id, mapping)
+            await pipe.expire(f'session:{session_id}', self.session_ttl(TaskStatus.WAITING))
+            await self._notify(pipe, session_id, mapping)
             await pipe.execute()
 
-    async def create_task(self, session_id: str, track_id: str) -> None:
-        async with self.redis.pipeline() as pipe:
-            await pipe.rpush('processing_queue', session_id)
-            await pipe.hset(
-                f'session:{session_id}',
-                mapping={
-                    'track_id': track_id,
-                    'progress': 0,
-                    'status': TaskStatus.QUEUED.value,
-                    'timestamp': datetime.now().timestamp(),
-                    'download_url': '',
-                },
-            )
-            await pipe.execute()
+    async def create_task(self, session_id: str, track_id: str, input_size: int | None = None) -> int:
+        """Queue the task of the session. Returns its position in the processing queue.
+
+        The input size in bytes, if known, lets the ETA of the task take the processing times of similar ones.
+
+        Raises TaskAlreadyQueuedError if the session is queued already, its task is left as it is.
+        """
+        mapping = {
+            'track_id': track_id,
+            'progress': 0,
+            'status': TaskStatus.QUEUED.value,
+            'timestamp': datetime.now().timestamp(),
+            'download_url': '',
+        }
+        if input_size is not None:
+            mapping['input_size'] = input_size
+        queued, position = await self._run_script(
+            self.enqueue_script,
+            session_id,
+            mapping,
+            True,
+            self.session_ttl(TaskStatus.QUEUED),
+            time.time(),
+            json.dumps(self._encode(mapping)),
+        )
+        if not queued:
+            raise TaskAlreadyQueuedError(session_id)
+        return position
+
+    async def read_session(self, session_id: str, fields: Iterable[str] = SESSION_FIELDS) -> SessionRecord:
+        """Read the session fields, from the session cache if it is running.
+
+        A cache miss reads the whole record, so the other fields of the session are cached too.
+        """
+        fields = session_fields(fields)
+        if self.cache is not None and self.cache.active:
+            record = await self.cache.read(session_id, fields, lambda: self._load_session(session_id, SESSION_FIELDS))
+        else:
+            record = await self._load_session(session_id, fields)
+        return SessionRecord.model_construct(**{field: record[field] for field in fields})
+
+    async def read_sessions(
+        self,
+        session_ids: Iterable[str],
+        fields: Iterable[str] = SESSION_FIELDS,
+    ) -> dict[str, SessionRecord]:
+        """Read the fields of many sessions in a single round trip, bypassing the session cache.
+
+        Sessions that do not exist are returned with all fields None.
+        """
+        fields = session_fields(fields)
+        session_ids = list(dict.fromkeys(session_ids))
+        records = await self._load_sessions(session_ids, fields)
+        return {
+            session_id: SessionRecord.model_construct(**record)
+            for session_id, record in zip(session_ids, records, strict=True)
+        }
+
+    async def _load_session(self, session_id: str, fields: Iterable[str]) -> dict[str, Any]:
+        """Read the session fields with one HMGET, plus a ZRANK for the position, in a single round trip."""
+        return (await self._load_sessions([session_id], fields))[0]
+
+    async def _load_sessions(self, session_ids: list[str], fields: Iterable[str]) -> list[dict[str, Any]]:
+        if not session_ids:
+            return []
+        hash_fields = [field for field in fields if field != 'position']
+        position = 'position' in fields
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                if hash_fields:
+                    await pipe.hmget(f'session:{session_id}', [*hash_fields, VERSION_FIELD])
+                if position:
+                    await pipe.zrank(QUEUE_KEY, session_id)
+            results = await pipe.execute()
+
+        step = bool(hash_fields) + position
+        records = []
+        for i, session_id in enumerate(session_ids):
+            replies = results[i * step : (i + 1) * step]
+            values, version = (replies[0][:-1], replies[0][-1]) if hash_fields else ([], None)
+            record = decode_session(session_id, hash_fields, values, version)
+            if position:
+                record['position'] = replies[-1]
+            records.append(record)
+        return records
 
     async def get_session_data(
         self,
@@ -89,124 +557,103 @@ class APIRedis:
         position: bool = False,
         completed_timestamp: bool = False,
         download_url: bool = False,
-    ) -> dict[str, str | int | float | None]:
-        fields = []
-        if status:
-            fields.append('status')
-        if progress:
-            fields.append('progress')
-        if track_id:
-            fields.append('track_id')
-        if position:
-            fields.append('position')
-        if completed_timestamp:
-            fields.append('completed_timestamp')
-        if download_url:
-            fields.append('download_url')
-
-        async with self.redis.pipeline() as pipe:
-            for field in fields:
-                if field == 'position':
-                    await pipe.lpos('processing_queue', session_id)
-                else:
-                    await pipe.hget(f'session:{session_id}', field)
-
-            results = await pipe.execute()
-
-            if len(fields) == 1:
-                value = results[0]
-                if fields[0] == 'progress':
-                    return int(value) if value is not None else None
-                if fields[0] == 'completed_timestamp':
-                    return float(value) if value is not None else None
-                return value
-            data = {}
-            for field, value in zip(fields, results, strict=False):
-                if field == 'progress':
-                    data[field] = int(value) if value is not None else None
-                elif field == 'completed_timestamp':
-                    data[field] = float(value) if value is not None else None
-                else:
-                    data[field] = value
-
-            return data
-
-    @staticmethod
-    def cast_to_int_float(value):
-        if value is not None and isinstance(value, str):
-            value = int(value) if value.isdecimal() else value
-            value = float(value) if value.replace('.', '', 1).replace('-', '', 1).isdecimal() else value
-        return value
+    ) -> dict[str, str | int | float | None] | str | int | float | None:
+        flags = {
+            'status': status,
+            'progress': progress,
+            'track_id': track_id,
+            'position': position,
+            'completed_timestamp': completed_timestamp,
+            'download_url': download_url,
+        }
+        fields = [field for field, requested in flags.items() if requested]
+        data = await self.get_session_data_multiple(session_id, fields)
+        return data[fields[0]] if len(fields) == 1 else data
 
     async def get_session_data_single(self, session_id: str, field: str) -> str | int | float | None:
         # status, progress, track_id, position, completed_timestamp, download_url,
-        async with self.redis.pipeline() as pipe:
-            if field == 'position':
-                await pipe.lpos('processing_queue', session_id)
-            else:
-                await pipe.hget(f'session:{session_id}', field)
-            result = await pipe.execute()
-            value = result[0] if result else None
-            value = self.cast_to_int_float(value)
-            return value
+        record = await self.read_session(session_id, [field])
+        return getattr(record, field)
 
-    async def get_session_data_multiple(self, session_id: str, fields: list[str]) -> dict[str, str | int | float | None]:
+    async def get_session_data_multiple(
+        self,
+        session_id: str,
+        fields: list[str],
+    ) -> dict[str, str | int | float | None]:
         # status, progress, track_id, position, completed_timestamp, download_url,
-        async with self.redis.pipeline() as pipe:
-            for field in fields:
-                if field == 'position':
-                    await pipe.lpos('processing_queue', session_id)
-                else:
-                    await pipe.hget(f'session:{session_id}', field)
-            results = await pipe.execute()
-
-        data = {}
-        for field, value in zip(fields, results, strict=False):
-            value = self.cast_to_int_float(value)
-            data[field] = value
-        return data
+        record = await self.read_session(session_id, fields)
+        return {field: getattr(record, field) for field in fields}
 
     async def set_status(self, session_id: str, status: TaskStatus) -> None:
         async with self.redis.pipeline() as pipe:
-            await pipe.hset(
-                f'session:{session_id}',
-                mapping={'status': status.value},
-            )
+            await self._write(pipe, session_id, {'status': status.value})
+            await pipe.expire(f'session:{session_id}', self.session_ttl(status))
+            await self._notify(pipe, session_id, {'status': status.value})
             await pipe.execute()
 
     async def set_progress(self, session_id: str, progress: int) -> None:
-        async with self.redis.pipeline() as pipe:
-            await pipe.hset(
-                f'session:{session_id}',
-                mapping={'progress': progress},
-            )
-            await pipe.execute()
+        """Write the progress right away, frequent reports go through self.progress instead."""
+        await self.write_progress({session_id: progress})
 
-    async def complete_task(self, session_id: str, download_url: str) -> None:
-        async with self.redis.pipeline() as pipe:
-            await pipe.hset(
-                f'session:{session_id}',
-                mapping={
-                    'status': TaskStatus.COMPLETED.value,
-                    'completed_timestamp': datetime.now().timestamp(),
-                    'download_url': download_url,
-                },
-            )
-            await pipe.lrem('processing_queue', 1, session_id)
-            await pipe.execute()
+    async def write_progress(self, progress: dict[str, int]) -> None:
+        """Write the progress of many sessions in one round trip.
 
-    async def delete_task(self, session_id: str, status: TaskStatus = TaskStatus.FAILED) -> None:
+        Sessions whose task is not running (anymore) are skipped, see PROGRESS_SCRIPT.
+        """
+        ttls = [
+            item
+            for status in PROGRESS_STATUSES
+            for value in status_values(status)
+            for item in (value, self.session_ttl(status))
+        ]
         async with self.redis.pipeline() as pipe:
-            await pipe.hset(
-                f'session:{session_id}',
-                mapping={
-                    'status': status.value,
-                    'completed_timestamp': datetime.now().timestamp(),
-                    'download_url': None,
-                },
-            )
-            await pipe.lrem('processing_queue', 1, session_id)
+            for session_id, value in progress.items():
+                changes = {'progress': value}
+                await self._run_script(
+                    self.progress_script,
+                    session_id,
+                    changes,
+                    False,
+                    0,
+                    json.dumps(self._encode(changes)),
+                    *ttls,
+                    client=pipe,
+                )
             await pipe.execute()
 
+    async def complete_task(self, session_id: str, download_url: str) -> bool:
+        """Dequeue the session and mark its task completed. Returns False if the session was not queued,
+        e.g. its task was completed or deleted by an earlier delivery of the same message.
+        """
+        return await self._finish_task(session_id, TaskStatus.COMPLETED, download_url)
+
+    async def delete_task(self, session_id: str, status: TaskStatus = TaskStatus.FAILED) -> bool:
+        """Dequeue the session and mark its task failed. Returns False if the session was not queued."""
+        return await self._finish_task(session_id, status, '')
+
+    async def _finish_task(self, session_id: str, status: TaskStatus, download_url: str) -> bool:
+        mapping = {
+            'status': status.value,
+            'completed_timestamp': datetime.now().timestamp(),
+            'download_url': download_url,
+        }
+        dequeued = await self._run_script(
+            self.dequeue_script,
+            session_id,
+            mapping,
+            True,
+            self.session_ttl(status),
+            json.dumps(self._encode(mapping)),
+        )
+        return bool(dequeued)
+
 
-redis_service = APIRedis(redis_base)
+redis_service = APIRedis(
+    redis_base,
+    cache=SessionCache(
+        SESSION_CHANGED_CHANNEL,
+        QUEUE_CHANNEL,
+        maxsize=settings.SESSION_CACHE_SIZE,
+        ttl=settings.SESSION_CACHE_TTL_SEC,
+    ),
+)
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+from typing import Any
+
+if TYPE_CHECKING:
+    from app.services.pubsub import PubSubMultiplexer
+
+
+class SessionCache:
+    """Per-process read-through LRU cache of session records in front of APIRedis.read_session.
+
+    Entries live for at most ttl seconds and are dropped as soon as a write of any worker publishes the session
+    id to changed_channel. Positions shift with every change of the processing queue, so a cached position is
+    only valid until the next message on queue_channel. Until start has subscribed the cache to these channels
+    it is bypassed, the ttl only bounds staleness while the pub/sub connection is down.
+    """
+
+    def __init__(self, changed_channel: str, queue_channel: str, maxsize: int = 10000, ttl: float = 5) -> None:
+        self.changed_channel = changed_channel
+        self.queue_channel = queue_channel
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Session id -> (expiration time, queue generation of the position, record), least recently used first
+        self._entries: OrderedDict[str, tuple[float, int, dict[str, Any]]] = OrderedDict()
+        self._queue_generation = 0
+        # Sessions being read from Redis, an invalidation during the read makes the result unfit for caching
+        self._loading: dict[str, int] = {}
+        self._invalidated: set[str] = set()
+        self._pubsub: 'PubSubMultiplexer | None' = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def active(self) -> bool:
+        return self._pubsub is not None
+
+    async def start(self, pubsub: 'PubSubMultiplexer') -> None:
+        await pubsub.subscribe(self, self.changed_channel, self.queue_channel)
+        self._pubsub = pubsub
+
+    async def close(self) -> None:
+        pubsub, self._pubsub = self._pubsub, None
+        self._entries.clear()
+        if pubsub is not None:
+            await pubsub.unsubscribe(self, self.changed_channel, self.queue_channel)
+
+    def put_nowait(self, message: tuple[str, str]) -> None:
+        """Pub/sub subscriber interface: invalidate on every published change."""
+        channel, session_id = message
+        self.invalidate(session_id, queue_changed=channel == self.queue_channel)
+
+    def invalidate(self, session_id: str, queue_changed: bool = False) -> None:
+        self.invalidations += 1
+        self._entries.pop(session_id, None)
+        if session_id in self._loading:
+            self._invalidated.add(session_id)
+        if queue_changed:
+            self._queue_generation += 1
+
+    async def read(
+        self,
+        session_id: str,
+        fields: Iterable[str],
+        load: Callable[[], Awaitable[dict[str, Any]]],
+    ) -> dict[str, Any]:
+        """The cached record of the session, load() reads the whole record from Redis on a miss."""
+        record = self._get(session_id, fields)
+        if record is not None:
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        generation = self._queue_generation
+        self._loading[session_id] = self._loading.get(session_id, 0) + 1
+        try:
+            record = await load()
+        finally:
+            self._loading[session_id] -= 1
+            stale = session_id in self._invalidated
+            if not self._loading[session_id]:
+                del self._loading[session_id]
+                self._invalidated.discard(session_id)
+        if not stale and self.active:
+            self._put(session_id, generation, record)
+        return record
+
+    def _get(self, session_id: str, fields: Iterable[str]) -> dict[str, Any] | None:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, generation, record = entry
+        if expires_at <= time.monotonic():
+            del self._entries[session_id]
+            return None
+        if generation != self._queue_generation and 'position' in fields:
+            return None
+        self._entries.move_to_end(session_id)
+        return record
+
+    def _put(self, session_id: str, generation: int, record: dict[str, Any]) -> None:
+        self._entries[session_id] = (time.monotonic() + self.ttl, generation, record)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        reads = self.hits + self.misses
+        return {
+            'active': self.active,
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / reads, 3) if reads else 0.0,
+            'invalidations': self.invalidations,
+        }
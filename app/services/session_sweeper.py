@@ -0,0 +1,143 @@
+import asyncio
+import time
+from typing import Any
+
+from aioredis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.services.connection_registry import NODE_ID
+from app.services.redis_service import QUEUE_KEY
+from app.services.redis_service import APIRedis
+from app.services.redis_service import redis_service
+
+
+class SessionSweeper:
+    """Reclaims what the expiration of the session hashes leaves behind, in small batches.
+
+    Processing queue entries of sessions whose hash has expired are removed and session hashes written by older
+    workers, which did not set a TTL, get the one of their state. Keys are walked with ZSCAN and SCAN, batch_size
+    keys per round trip with a pause in between, so Redis keeps serving the other clients during a pass. Every
+    worker runs a sweeper, the lock key lets only one of them make a pass per interval.
+    """
+
+    def __init__(
+        self,
+        service: APIRedis,
+        interval: float = 300,
+        batch_size: int = 100,
+        pause: float = 0.01,
+        lock_key: str = 'session_sweeper:lock',
+    ) -> None:
+        self.service = service
+        self.redis = service.redis
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock_key = lock_key
+        self._task: asyncio.Task | None = None
+        self.passes = 0
+        self.scanned = 0
+        self.orphans_removed = 0
+        self.expirations_set = 0
+        self.last_pass: dict[str, Any] | None = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.redis.set(self.lock_key, NODE_ID, nx=True, ex=max(int(self.interval), 1)):
+                    await self.sweep()
+            except RedisError as e:
+                logger.error(f'Error sweeping sessions: {e}')
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> dict[str, Any]:
+        """One full pass over the processing queue and the session hashes. Returns what it reclaimed."""
+        started = time.monotonic()
+        orphans_removed = await self._sweep_queue()
+        expirations_set = await self._sweep_sessions()
+
+        self.passes += 1
+        self.orphans_removed += orphans_removed
+        self.expirations_set += expirations_set
+        self.last_pass = {
+            'orphans_removed': orphans_removed,
+            'expirations_set': expirations_set,
+            'duration': round(time.monotonic() - started, 3),
+        }
+        if orphans_removed or expirations_set:
+            logger.info(
+                f'Session sweep removed {orphans_removed} orphaned queue entries '
+                f'and set the expiration of {expirations_set} sessions',
+            )
+        return self.last_pass
+
+    async def _sweep_queue(self) -> int:
+        removed = 0
+        cursor = 0
+        while True:
+            cursor, members = await self.redis.zscan(QUEUE_KEY, cursor=cursor, count=self.batch_size)
+            self.scanned += len(members)
+            removed += await self.service.remove_orphans([session_id for session_id, _ in members])
+            if not cursor:
+                return removed
+            await asyncio.sleep(self.pause)
+
+    async def _sweep_sessions(self) -> int:
+        expired = 0
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(
+                cursor=cursor,
+                match='session:*',
+                count=self.batch_size,
+                _type='hash',
+            )
+            self.scanned += len(keys)
+            if keys:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        await pipe.ttl(key)
+                        await pipe.hget(key, 'status')
+                    results = await pipe.execute()
+
+                # TTL is -1 for a key without expiration, -2 for one that is gone already
+                persistent = [
+                    (key, status)
+                    for key, ttl, status in zip(keys, results[::2], results[1::2], strict=True)
+                    if ttl == -1
+                ]
+                if persistent:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for key, status in persistent:
+                            await pipe.expire(key, self.service.session_ttl(status))
+                        await pipe.execute()
+                    expired += len(persistent)
+            if not cursor:
+                return expired
+            await asyncio.sleep(self.pause)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'passes': self.passes,
+            'scanned': self.scanned,
+            'orphans_removed': self.orphans_removed,
+            'expirations_set': self.expirations_set,
+            'last_pass': self.last_pass,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+session_sweeper = SessionSweeper(
+    redis_service,
+    interval=settings.SESSION_SWEEP_INTERVAL_SEC,
+    batch_size=settings.SESSION_SWEEP_BATCH_SIZE,
+)
@@ -0,0 +1,100 @@
+import asyncio
+import json
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from app.core.config import settings
+from app.services.listener_queue import ListenerQueue
+from app.services.listener_queue import QueuePolicy
+from app.services.pubsub import PubSubMultiplexer
+from app.services.pubsub import pubsub_mux
+from app.services.redis_service import QUEUE_CHANNEL
+from app.services.redis_service import APIRedis
+from app.services.redis_service import redis_service
+from app.services.redis_service import session_channel
+
+
+class SessionStatusWatcher:
+    """Session status stream driven by the change notifications published by APIRedis.
+
+    The session fields are read once and then updated from the published changes. The position is only
+    re-read when the session is queued or dequeued and, while it is in the processing queue, when the queue
+    changes: the queue changes of finished or never queued sessions cost no Redis reads. Everything is re-read
+    every resync_interval seconds and after lost notifications, in case a writer did not publish.
+    """
+
+    def __init__(
+        self,
+        service: APIRedis,
+        pubsub: PubSubMultiplexer,
+        resync_interval: float = 30,
+        queue_size: int = 100,
+    ) -> None:
+        self.service = service
+        self.pubsub = pubsub
+        self.resync_interval = resync_interval
+        self.queue_size = queue_size
+
+    async def watch(self, session_id: str, fields: list[str]) -> AsyncGenerator[dict[str, Any], None]:
+        """Yield the session fields right away and then every time one of them changes."""
+        queue = ListenerQueue(self.queue_size, QueuePolicy.DROP_OLDEST)
+        channels = [session_channel(session_id)]
+        if 'position' in fields:
+            channels.append(QUEUE_CHANNEL)
+
+        # Subscribe before the first read, so no change in between is lost
+        await self.pubsub.subscribe(queue, *channels)
+        try:
+            state = await self.service.get_session_data_multiple(session_id, fields)
+            yield dict(state)
+            dropped = queue.dropped
+
+            while True:
+                messages = await self._next_messages(queue)
+                if messages is None or queue.dropped != dropped:
+                    dropped = queue.dropped
+                    new_state = await self.service.get_session_data_multiple(session_id, fields)
+                else:
+                    new_state = await self._apply(session_id, fields, state, messages)
+
+                if new_state != state:
+                    state = new_state
+                    yield dict(state)
+        finally:
+            queue.close()
+            await self.pubsub.unsubscribe(queue, *channels)
+
+    async def _next_messages(self, queue: ListenerQueue) -> list[tuple[str, str]] | None:
+        """Wait for the next notification and take the already queued ones, None if it is time to resync."""
+        try:
+            messages = [await asyncio.wait_for(queue.get(), timeout=self.resync_interval)]
+        except asyncio.TimeoutError:
+            return None
+        while not queue.empty():
+            messages.append(queue.get_nowait())
+        return messages
+
+    async def _apply(
+        self,
+        session_id: str,
+        fields: list[str],
+        state: dict[str, Any],
+        messages: list[tuple[str, str]],
+    ) -> dict[str, Any]:
+        new_state = dict(state)
+        queue_changed = status_changed = False
+        for channel, data in messages:
+            if channel == QUEUE_CHANNEL:
+                queue_changed = True
+                continue
+            changes = json.loads(data)
+            status_changed = status_changed or 'status' in changes
+            new_state.update({field: changes[field] for field in fields if field in changes})
+
+        # A session without a position is not in the processing queue until its status changes
+        if status_changed or (queue_changed and state.get('position') is not None):
+            new_state['position'] = await self.service.get_session_data_single(session_id, 'position')
+        return new_state
+
+
+status_watcher = SessionStatusWatcher(redis_service, pubsub_mux, resync_interval=settings.WS_STATUS_RESYNC_SEC)
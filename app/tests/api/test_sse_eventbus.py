@@ -0,0 +1,170 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.api.sse_eventbus import SSEEventBus
+from app.api.sse_eventbus import coalesce_key
+from app.api.sse_eventbus import parse_sse_frame
+from app.schemas.events import Event
+from app.schemas.events import EventData
+from app.services.connection_registry import LocalConnectionRegistry
+from app.services.event_backend import MemoryEventBackend
+
+
+def make_event(message: str) -> Event:
+    return Event(name='message', data=EventData(id='session', message=message))
+
+
+@pytest.fixture
+def event_bus() -> SSEEventBus:
+    bus = SSEEventBus(MemoryEventBackend(), LocalConnectionRegistry(), coalesce_window=0.01)
+    bus._post = AsyncMock()
+    return bus
+
+
+@pytest.mark.asyncio
+async def test_coalesced_events_keep_latest(event_bus: SSEEventBus) -> None:
+    for i in range(5):
+        await event_bus.post('session', make_event(f'Progress state: {i * 20}'), coalesce=True)
+    event_bus._post.assert_not_awaited()
+
+    await asyncio.sleep(0.05)
+
+    event_bus._post.assert_awaited_once()
+    session_id, event = event_bus._post.await_args.args
+    assert session_id == 'session'
+    assert event.data.message == 'Progress state: 80'
+    assert event.coalesce
+
+
+@pytest.mark.asyncio
+async def test_coalesced_broadcasts_keep_latest_per_session(event_bus: SSEEventBus) -> None:
+    event_bus._broadcast = AsyncMock()
+    events = [
+        Event(name='upload_progress', data=EventData(id=session_id, message=progress))
+        for session_id, progress in (('a', '10'), ('b', '20'), ('a', '30'))
+    ]
+    for event in events:
+        await event_bus.broadcast(event, coalesce=True)
+
+    await asyncio.sleep(0.05)
+
+    sent = [(call.args[0].data.id, call.args[0].data.message) for call in event_bus._broadcast.await_args_list]
+    assert sent == [('a', '30'), ('b', '20')]
+    assert not any(event.coalesce for event in events)
+
+
+@pytest.mark.asyncio
+async def test_regular_event_flushes_coalesced_first(event_bus: SSEEventBus) -> None:
+    await event_bus.post('session', make_event('Progress state: 99'), coalesce=True)
+    await event_bus.post('session', make_event('Upload completed'))
+
+    messages = [call.args[1].data.message for call in event_bus._post.await_args_list]
+    assert messages == ['Progress state: 99', 'Upload completed']
+
+    await asyncio.sleep(0.05)
+    assert event_bus._post.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_listener_gets_newest_coalesced_event() -> None:
+    queue = asyncio.Queue()
+    for message in ('10', '20', 'done'):
+        event = make_event(message)
+        event.coalesce = message != 'done'
+        queue.put_nowait(('user:session', event.as_sse_frame()))
+    broadcast = make_event('30')
+    broadcast.coalesce = True
+    queue.put_nowait(('broadcast:all', broadcast.as_sse_frame()))
+
+    frames = await SSEEventBus._next_frames(queue)
+
+    assert [(channel, frame) for channel, frame, _ in frames] == [
+        ('user:session', ': coalesce\nevent: message\ndata: ' + make_event('20').data.model_dump_json() + '\n\n'),
+        ('user:session', make_event('done').as_sse_frame()),
+        ('broadcast:all', broadcast.as_sse_frame()),
+    ]
+
+
+def test_parse_sse_frame() -> None:
+    event = make_event('hello')
+    event.id = '100-0'
+    event.coalesce = True
+
+    assert parse_sse_frame(event.as_sse_frame()) == ('100-0', 'message', True)
+    assert parse_sse_frame(make_event('data: event: fake').as_sse_frame()) == (None, 'message', False)
+
+
+@pytest.fixture
+def memory_event_bus() -> SSEEventBus:
+    return SSEEventBus(MemoryEventBackend(), LocalConnectionRegistry(), shutdown_grace=0)
+
+
+async def collect(bus: SSEEventBus, session_id: str) -> list[str]:
+    connection_id = await bus.add_connection(session_id)
+    try:
+        return [frame async for frame in bus.listen(session_id)]
+    finally:
+        await bus.remove_connection(connection_id)
+
+
+@pytest.mark.asyncio
+async def test_listen_replays_history_and_forwards_events(memory_event_bus: SSEEventBus) -> None:
+    await memory_event_bus.post('session', make_event('before'))
+    listener = asyncio.create_task(collect(memory_event_bus, 'session'))
+    await asyncio.sleep(0.01)
+
+    await memory_event_bus.post('session', make_event('after'))
+    await memory_event_bus.broadcast(make_event('everyone'))
+    await memory_event_bus.post('other', make_event('not mine'))
+    await memory_event_bus.shutdown('session')
+    frames = await asyncio.wait_for(listener, 1)
+
+    assert [parse_sse_frame(frame).name for frame in frames] == ['message', 'message', 'message', '__exit__']
+    assert 'before' in frames[0] and 'after' in frames[1]
+    assert '"broadcast":true' in frames[2]
+    assert frames[3].startswith('retry: ')
+
+
+@pytest.mark.asyncio
+async def test_close_local_connections_notifies_local_listeners(memory_event_bus: SSEEventBus) -> None:
+    listeners = [asyncio.create_task(collect(memory_event_bus, session_id)) for session_id in ('a', 'a', 'b')]
+    await asyncio.sleep(0.01)
+    assert len(memory_event_bus.registry.local_connections) == 3
+
+    await memory_event_bus.close_local_connections()
+
+    for frames in await asyncio.wait_for(asyncio.gather(*listeners), 1):
+        header = parse_sse_frame(frames[-1])
+        assert header.name == '__exit__'
+        retry = int(frames[-1].partition('retry: ')[2].partition('\n')[0])
+        assert memory_event_bus.retry_ms <= retry <= memory_event_bus.retry_ms + memory_event_bus.retry_jitter_ms
+    assert memory_event_bus.registry.local_connections == {}
+
+
+@pytest.mark.asyncio
+async def test_close_local_connections_returns_once_listeners_exit() -> None:
+    bus = SSEEventBus(MemoryEventBackend(), LocalConnectionRegistry(), shutdown_grace=5)
+    listener = asyncio.create_task(collect(bus, 'session'))
+    await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(bus.close_local_connections(), 1)
+
+    assert parse_sse_frame((await listener)[-1]).name == '__exit__'
+
+
+@pytest.mark.asyncio
+async def test_slow_listener_keeps_coalesced_broadcasts_of_every_session() -> None:
+    queue = asyncio.Queue()
+    for session_id, progress in (('a', '10'), ('b', '20'), ('a', '30')):
+        event = Event(name='upload_progress', data=EventData(id=session_id, message=progress), coalesce=True)
+        queue.put_nowait(('broadcast:all', event.as_sse_frame()))
+
+    frames = await SSEEventBus._next_frames(queue)
+
+    assert [coalesce_key((channel, frame)) for channel, frame, _ in frames] == [
+        ('broadcast:all', 'b', 'upload_progress'),
+        ('broadcast:all', 'a', 'upload_progress'),
+    ]
+    assert '"message":"30"' in frames[-1][1]
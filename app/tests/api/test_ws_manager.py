@@ -0,0 +1,263 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.api.ws_manager import WS_CLOSE_TRY_AGAIN_LATER
+from app.api.ws_manager import WSConnectionManager
+from app.api.ws_manager import encode
+from app.services.connection_registry import ConnectionRegistry
+from app.services.listener_queue import QueuePolicy
+from app.services.pubsub import PubSubMultiplexer
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_broadcast() -> None:
+    manager = WSConnectionManager(queue_size=2, queue_policy=QueuePolicy.DISCONNECT)
+    fast, slow = AsyncMock(), AsyncMock()
+    slow_send = asyncio.Event()
+
+    async def stalled_send(text: str) -> None:
+        await slow_send.wait()
+
+    slow.send_text.side_effect = stalled_send
+
+    await manager.connect(fast, 'fast')
+    await manager.connect(slow, 'slow')
+    for i in range(4):
+        await manager.broadcast({'i': i})
+        await asyncio.sleep(0.01)
+
+    assert [call.args[0] for call in fast.send_text.await_args_list] == [f'{{"i":{i}}}' for i in range(4)]
+    assert manager._queues['slow'].closed
+    assert manager.queue_metrics.disconnected == 1
+
+    slow_send.set()
+    await asyncio.sleep(0.01)
+    slow.close.assert_awaited_once_with(code=WS_CLOSE_TRY_AGAIN_LATER)
+    assert 'slow' not in manager.active_connections
+    # The broadcasts the slow socket lost count as done, so the slow fan-outs are measured too
+    stats = manager.fanout_metrics.stats()
+    assert stats['completed'] == 4
+    assert stats['partial'] == stats['missed'] == 3
+
+    await manager.disconnect('fast', fast)
+    await manager.disconnect('slow', slow)
+
+
+@pytest.mark.asyncio
+async def test_send_timeout_closes_socket() -> None:
+    manager = WSConnectionManager(send_timeout=0.01)
+    fast, stalled = AsyncMock(), AsyncMock()
+
+    async def stalled_send(text: str) -> None:
+        await asyncio.Event().wait()
+
+    stalled.send_text.side_effect = stalled_send
+
+    await manager.connect(fast, 'fast')
+    await manager.connect(stalled, 'stalled')
+    await manager.broadcast({'i': 0})
+    await asyncio.sleep(0.05)
+
+    fast.send_text.assert_awaited_once_with('{"i":0}')
+    stalled.close.assert_awaited_once_with(code=WS_CLOSE_TRY_AGAIN_LATER)
+    assert 'stalled' not in manager.active_connections
+    stats = manager.fanout_metrics.stats()
+    assert stats['broadcasts'] == 1
+    assert (stats['completed'], stats['partial'], stats['missed']) == (1, 1, 1)
+    assert stats['send_timeouts'] == 1
+
+    await manager.broadcast({'i': 1})
+    await asyncio.sleep(0.01)
+    assert manager.fanout_metrics.stats()['completed'] == 2
+
+    await manager.disconnect('fast', fast)
+    await manager.disconnect('stalled', stalled)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_evicted_by_drop_oldest_counts_as_missed() -> None:
+    manager = WSConnectionManager(queue_size=1)
+    websocket = AsyncMock()
+    sending = asyncio.Event()
+
+    async def stalled_send(text: str) -> None:
+        await sending.wait()
+
+    websocket.send_text.side_effect = stalled_send
+    await manager.connect(websocket, 'session')
+    await manager.broadcast({'i': 0})
+    await asyncio.sleep(0.01)
+    # The first broadcast is being sent, the second one is evicted from the queue by the third one
+    await manager.broadcast({'i': 1})
+    await manager.broadcast({'i': 2})
+
+    sending.set()
+    await asyncio.sleep(0.01)
+
+    stats = manager.fanout_metrics.stats()
+    assert (stats['completed'], stats['missed']) == (3, 1)
+
+    await manager.disconnect('session', websocket)
+
+
+@pytest.mark.asyncio
+async def test_replaced_socket_does_not_disconnect_successor() -> None:
+    manager = WSConnectionManager()
+    old, new = AsyncMock(), AsyncMock()
+
+    await manager.connect(old, 'session')
+    await manager.connect(new, 'session')
+    old.close.assert_awaited_once()
+
+    await manager.disconnect('session', old)
+    assert manager.active_connections['session'] is new
+    assert manager.send('session', {'status': 'queued'})
+    await asyncio.sleep(0.01)
+    new.send_json.assert_awaited_once_with({'status': 'queued'})
+
+    await manager.disconnect('session', new)
+
+
+@pytest.mark.asyncio
+async def test_state_is_sent_as_snapshot_then_deltas() -> None:
+    manager = WSConnectionManager()
+    websocket = AsyncMock()
+    await manager.connect(websocket, 'session')
+
+    assert manager.send_state('session', {'status': 'queued', 'progress': 0, 'position': 3})
+    assert manager.send_state('session', {'status': 'queued', 'progress': 0, 'position': 3})
+    assert manager.send_state('session', {'status': 'queued', 'progress': 0, 'position': 2})
+    assert manager.send_state('session', {'status': 'in_progress', 'progress': 10, 'position': None})
+    assert manager.resync('session')
+    await asyncio.sleep(0.01)
+
+    assert [call.args[0] for call in websocket.send_json.await_args_list] == [
+        {'type': 'snapshot', 'seq': 1, 'data': {'status': 'queued', 'progress': 0, 'position': 3}},
+        {'type': 'delta', 'seq': 2, 'data': {'position': 2}},
+        {'type': 'delta', 'seq': 3, 'data': {'status': 'in_progress', 'progress': 10, 'position': None}},
+        {'type': 'snapshot', 'seq': 4, 'data': {'status': 'in_progress', 'progress': 10, 'position': None}},
+    ]
+
+    await manager.disconnect('session', websocket)
+    assert not manager.send_state('session', {'status': 'completed'})
+    assert not manager.resync('session')
+
+
+@pytest.mark.asyncio
+async def test_new_socket_starts_with_snapshot() -> None:
+    manager = WSConnectionManager()
+    old, new = AsyncMock(), AsyncMock()
+    await manager.connect(old, 'session')
+    manager.send_state('session', {'status': 'queued'})
+
+    await manager.connect(new, 'session')
+    manager.send_state('session', {'status': 'queued'})
+    await asyncio.sleep(0.01)
+
+    new.send_json.assert_awaited_once_with({'type': 'snapshot', 'seq': 1, 'data': {'status': 'queued'}})
+    await manager.disconnect('session', new)
+
+
+@pytest.fixture
+def registry() -> MagicMock:
+    registry = MagicMock(spec=ConnectionRegistry)
+    registry.node_id = 'node-a'
+    registry.add.side_effect = ['node-a|1', 'node-a|2']
+    registry.claim_session.return_value = None
+    registry.session_connection.return_value = None
+    return registry
+
+
+@pytest.fixture
+def pubsub() -> MagicMock:
+    pubsub = MagicMock(spec=PubSubMultiplexer)
+    pubsub.redis = MagicMock()
+    pubsub.redis.publish = AsyncMock()
+    return pubsub
+
+
+@pytest.mark.asyncio
+async def test_message_is_routed_to_the_node_of_the_session(registry: MagicMock, pubsub: MagicMock) -> None:
+    manager = WSConnectionManager(registry=registry, pubsub=pubsub)
+    websocket = AsyncMock()
+    await manager.connect(websocket, 'local')
+    pubsub.subscribe.assert_awaited_once()
+    assert pubsub.subscribe.await_args.args[1:] == ('ws:node:node-a', 'ws:broadcast')
+
+    registry.session_connection.return_value = 'node-b|7'
+    assert await manager.route('remote', {'status': 'queued'})
+    pubsub.redis.publish.assert_awaited_once_with(
+        'ws:node:node-b',
+        encode({'type': 'send', 'client_id': 'remote', 'message': {'status': 'queued'}}),
+    )
+
+    # Messages routed to this node are delivered to the local socket, invalid ones do not stop the routing
+    routes = pubsub.subscribe.await_args.args[0]
+    routes.put_nowait(('ws:node:node-a', 'not json'))
+    routes.put_nowait(('ws:node:node-a', json.dumps({'client_id': 'local'})))
+    routes.put_nowait(('ws:node:node-a', json.dumps({'type': 'send', 'client_id': 'local', 'message': {'a': 1}})))
+    routes.put_nowait(('ws:broadcast', json.dumps({'b': 2})))
+    await asyncio.sleep(0.01)
+    websocket.send_json.assert_awaited_once_with({'a': 1})
+    # Broadcasts are forwarded as published, without decoding
+    websocket.send_text.assert_awaited_once_with(json.dumps({'b': 2}))
+
+    await manager.disconnect('local', websocket)
+    registry.remove.assert_called_once_with('node-a|1')
+    registry.release_session.assert_awaited_once_with('local', 'node-a|1')
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_session_connected_elsewhere_is_evicted(registry: MagicMock, pubsub: MagicMock) -> None:
+    manager = WSConnectionManager(registry=registry, pubsub=pubsub)
+    websocket = AsyncMock()
+    registry.claim_session.return_value = 'node-b|3'
+
+    await manager.connect(websocket, 'session')
+
+    pubsub.redis.publish.assert_awaited_once_with(
+        'ws:node:node-b',
+        encode({'type': 'evict', 'client_id': 'session', 'connection_id': 'node-b|3'}),
+    )
+
+    # The same eviction received from another node closes the local socket
+    routes = pubsub.subscribe.await_args.args[0]
+    routes.put_nowait(('ws:node:node-a', json.dumps({'type': 'evict', 'client_id': 'session', 'connection_id': 'x'})))
+    await asyncio.sleep(0.01)
+    assert manager.active_connections['session'] is websocket
+
+    routes.put_nowait(
+        ('ws:node:node-a', json.dumps({'type': 'evict', 'client_id': 'session', 'connection_id': 'node-a|1'})),
+    )
+    await asyncio.sleep(0.01)
+    assert 'session' not in manager.active_connections
+    websocket.close.assert_awaited_once()
+    registry.remove.assert_called_once_with('node-a|1')
+    registry.release_session.assert_not_awaited()
+
+    await manager.disconnect('session', websocket)
+    registry.release_session.assert_not_awaited()
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_restarted_routing_unsubscribes_old_queue(registry: MagicMock, pubsub: MagicMock) -> None:
+    manager = WSConnectionManager(registry=registry, pubsub=pubsub)
+    first, second = AsyncMock(), AsyncMock()
+    await manager.connect(first, 'first')
+    old_routes = pubsub.subscribe.await_args.args[0]
+    manager._router.cancel()
+    await asyncio.sleep(0)
+
+    await manager.connect(second, 'second')
+
+    pubsub.unsubscribe.assert_awaited_once_with(old_routes, 'ws:node:node-a', 'ws:broadcast')
+    assert pubsub.subscribe.await_args.args[0] is not old_routes
+    await manager.disconnect('first', first)
+    await manager.disconnect('second', second)
+    await manager.close()
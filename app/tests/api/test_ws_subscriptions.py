@@ -0,0 +1,92 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.api.ws_manager import WSConnectionManager
+from app.api.ws_subscriptions import SessionSubscriptions
+from app.services.redis_service import APIRedis
+from app.services.redis_service import session_channel
+from app.services.status_watcher import SessionStatusWatcher
+
+FIELDS = ['status', 'progress']
+
+
+@pytest.fixture
+def pubsub() -> MagicMock:
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.unsubscribe = AsyncMock()
+    return pubsub
+
+
+@pytest.fixture
+def watcher(pubsub: MagicMock) -> SessionStatusWatcher:
+    service = MagicMock(spec=APIRedis)
+
+    async def read(session_id: str, fields: list[str]) -> dict:
+        return {'status': f'queued {session_id}', 'progress': 0}
+
+    service.get_session_data_multiple = AsyncMock(side_effect=read)
+    return SessionStatusWatcher(service, pubsub, resync_interval=60)
+
+
+def sent(websocket: AsyncMock) -> list[dict]:
+    return [call.args[0] for call in websocket.send_json.await_args_list]
+
+
+@pytest.mark.asyncio
+async def test_one_socket_follows_several_sessions(pubsub: MagicMock, watcher: SessionStatusWatcher) -> None:
+    manager = WSConnectionManager()
+    websocket = AsyncMock()
+    await manager.connect(websocket, 'dashboard')
+    subscriptions = SessionSubscriptions(manager, watcher, 'dashboard', FIELDS, limit=2)
+
+    assert subscriptions.handle({'type': 'subscribe', 'session_ids': ['a', 'b', 'a', 'c']})
+    await asyncio.sleep(0.01)
+    assert sent(websocket)[:2] == [
+        {'type': 'subscribed', 'session_ids': ['a', 'b']},
+        {'type': 'error', 'error': 'At most 2 subscriptions', 'session_ids': ['c']},
+    ]
+    assert sorted(sent(websocket)[2:], key=lambda frame: frame['session_id']) == [
+        {'type': 'snapshot', 'seq': 1, 'session_id': 'a', 'data': {'status': 'queued a', 'progress': 0}},
+        {'type': 'snapshot', 'seq': 1, 'session_id': 'b', 'data': {'status': 'queued b', 'progress': 0}},
+    ]
+
+    # Changes of a session are pushed as deltas tagged with its session id
+    queues = {call.args[1]: call.args[0] for call in pubsub.subscribe.await_args_list}
+    queues[session_channel('b')].put_nowait((session_channel('b'), json.dumps({'progress': 50})))
+    await asyncio.sleep(0.01)
+    assert sent(websocket)[-1] == {'type': 'delta', 'seq': 2, 'session_id': 'b', 'data': {'progress': 50}}
+    assert manager.resync('dashboard', 'b')
+
+    assert subscriptions.handle({'type': 'unsubscribe', 'session_ids': ['b', 'c']})
+    await asyncio.sleep(0.01)
+    assert sent(websocket)[-2:] == [
+        {'type': 'snapshot', 'seq': 3, 'session_id': 'b', 'data': {'status': 'queued b', 'progress': 50}},
+        {'type': 'unsubscribed', 'session_ids': ['b']},
+    ]
+    assert len(subscriptions) == 1
+    assert pubsub.unsubscribe.await_args.args[1:] == (session_channel('b'),)
+
+    await subscriptions.close()
+    assert len(subscriptions) == 0
+    await manager.disconnect('dashboard', websocket)
+
+
+@pytest.mark.asyncio
+async def test_invalid_subscription_request(watcher: SessionStatusWatcher) -> None:
+    manager = WSConnectionManager()
+    websocket = AsyncMock()
+    await manager.connect(websocket, 'dashboard')
+    subscriptions = SessionSubscriptions(manager, watcher, 'dashboard', FIELDS)
+
+    assert not subscriptions.handle({'type': 'ping'})
+    assert subscriptions.handle({'type': 'subscribe', 'session_ids': 'a'})
+    await asyncio.sleep(0.01)
+
+    assert sent(websocket) == [{'type': 'error', 'error': 'session_ids must be a list of strings'}]
+    assert len(subscriptions) == 0
+    await manager.disconnect('dashboard', websocket)
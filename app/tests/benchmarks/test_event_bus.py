@@ -0,0 +1,46 @@
+import pytest
+
+from app.benchmarks.event_bus import BenchmarkConfig
+from app.benchmarks.event_bus import parse_args
+from app.benchmarks.event_bus import percentile
+from app.benchmarks.event_bus import run_benchmark
+from app.schemas.events import EventBackendType
+
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1.0], 95) == 1
+    assert percentile([], 50) == 0
+
+
+def test_parse_args() -> None:
+    config, args = parse_args(['--listeners', '5', '--backend', 'memory', '--transport', 'asgi', '--json'])
+
+    assert config.listeners == 5
+    assert config.backend == EventBackendType.MEMORY
+    assert config.transport == 'asgi'
+    assert args.json
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('transport', ['bus', 'asgi'])
+async def test_memory_benchmark_delivers_every_event(transport: str) -> None:
+    config = BenchmarkConfig(
+        listeners=6,
+        sessions=3,
+        post_rate=20,
+        broadcast_rate=20,
+        duration=0.2,
+        transport=transport,
+    )
+
+    result = await run_benchmark(config)
+
+    assert result.published > 0
+    assert result.received == result.expected
+    assert result.latency_ms['p50'] <= result.latency_ms['p99']
+    assert result.memory_per_listener_bytes > 0
+    assert result.redis_commands_per_event is None
@@ -1,3 +1,6 @@
+import pytest
+from pydantic import ValidationError
+
 from app.core.config import Settings
 
 
@@ -36,3 +39,8 @@ def test_settings():
     assert settings.RABBITMQ_PASSWORD == 'password'
     assert settings.REDIS_HOST == 'localhost'
     assert settings.REDIS_PORT == 6379
+
+
+def test_ws_queue_policy_cannot_coalesce():
+    with pytest.raises(ValidationError):
+        Settings(WS_QUEUE_POLICY='coalesce')
@@ -0,0 +1,122 @@
+import json
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.connection_registry import ConnectionRegistry
+from app.services.expiry import ExpiryEngine
+from app.services.redis_service import BaseRedis
+
+
+@pytest.fixture
+def mock_pipeline() -> AsyncMock:
+    pipeline = AsyncMock()
+    pipeline.execute.return_value = []
+    return pipeline
+
+
+@pytest.fixture
+def registry(mock_pipeline: AsyncMock) -> ConnectionRegistry:
+    base_redis = BaseRedis()
+    base_redis.redis = MagicMock()
+    base_redis.redis.pipeline.return_value.__aenter__.return_value = mock_pipeline
+    base_redis.redis.register_script.return_value = AsyncMock(return_value=0)
+    return ConnectionRegistry(base_redis, MagicMock(spec=ExpiryEngine), connection_ttl=45, batch_size=2)
+
+
+@pytest.mark.asyncio
+async def test_add_registers_connection(registry: ConnectionRegistry, mock_pipeline: AsyncMock) -> None:
+    connection_id = await registry.add('session', {'client_host': '127.0.0.1'})
+
+    assert connection_id.startswith(f'{registry.node_id}|')
+    mock_pipeline.zadd.assert_awaited_once()
+    assert connection_id in mock_pipeline.zadd.await_args.args[1]
+    key, field, info = mock_pipeline.hset.await_args.args
+    assert (key, field) == ('sse:connection_info', connection_id)
+    assert json.loads(info)['session_id'] == 'session'
+    assert json.loads(info)['client_host'] == '127.0.0.1'
+    assert registry.local_connections[connection_id]['node_id'] == registry.node_id
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_remove_is_batched_by_expiry_engine(registry: ConnectionRegistry) -> None:
+    registry.local_connections['node|1'] = {'session_id': 'session'}
+
+    registry.remove('node|1')
+
+    assert 'node|1' not in registry.local_connections
+    registry.expiry.schedule.assert_any_call(0, 'zrem', 'sse:connections', 'node|1')
+    registry.expiry.schedule.assert_any_call(0, 'hdel', 'sse:connection_info', 'node|1')
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_refreshes_local_connections_and_sweeps(
+    registry: ConnectionRegistry,
+    mock_pipeline: AsyncMock,
+) -> None:
+    registry.local_connections = {connection_id: {'session_id': 's'} for connection_id in ['a', 'b', 'c']}
+    registry.sweep_script.return_value = 2
+
+    assert await registry.heartbeat() == 2
+
+    node_call, *connection_calls = mock_pipeline.zadd.await_args_list
+    assert node_call.args[0] == 'sse:nodes'
+    # Connections swept by another node while this one missed heartbeats are registered again
+    assert [list(call.args[1]) for call in connection_calls] == [['a', 'b'], ['c']]
+    assert all(not call.kwargs for call in connection_calls)
+    assert [list(call.kwargs['mapping']) for call in mock_pipeline.hset.await_args_list] == [['a', 'b'], ['c']]
+    assert json.loads(mock_pipeline.hset.await_args.kwargs['mapping']['c']) == {'session_id': 's'}
+    keys = registry.sweep_script.await_args.kwargs['keys']
+    assert keys == ['sse:connections', 'sse:connection_info', 'sse:nodes', 'sse:sessions']
+    deadline, limit = registry.sweep_script.await_args.kwargs['args']
+    assert deadline == pytest.approx(node_call.args[1][registry.node_id] - 45)
+    assert limit == 2
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_restores_claimed_session(registry: ConnectionRegistry, mock_pipeline: AsyncMock) -> None:
+    registry.local_connections['node|1'] = {'session_id': 'session'}
+    mock_pipeline.execute.return_value = [None, True]
+    await registry.claim_session('session', 'node|1')
+
+    await registry.heartbeat()
+
+    mock_pipeline.hsetnx.assert_awaited_once_with('sse:sessions', 'session', 'node|1')
+
+    await registry.release_session('session', 'node|1')
+    mock_pipeline.hsetnx.reset_mock()
+    await registry.heartbeat()
+
+    mock_pipeline.hsetnx.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_page(registry: ConnectionRegistry) -> None:
+    registry.redis.zscan = AsyncMock(return_value=(7, [('a', 1.0), ('b', 2.0)]))
+    registry.redis.hmget = AsyncMock(return_value=[json.dumps({'session_id': 's1'}), None])
+
+    page = await registry.page(0, 2)
+
+    registry.redis.hmget.assert_awaited_once_with('sse:connection_info', ['a', 'b'])
+    assert page == {
+        'cursor': 7,
+        'connections': [
+            {'session_id': 's1', 'connection_id': 'a', 'heartbeat': 1.0},
+            {'connection_id': 'b', 'heartbeat': 2.0},
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_close_deregisters_node(registry: ConnectionRegistry, mock_pipeline: AsyncMock) -> None:
+    registry.local_connections = dict.fromkeys(['a', 'b', 'c'], {})
+
+    await registry.close()
+
+    mock_pipeline.zrem.assert_any_await('sse:nodes', registry.node_id)
+    mock_pipeline.zrem.assert_any_await('sse:connections', 'a', 'b')
+    mock_pipeline.hdel.assert_any_await('sse:connection_info', 'c')
+    assert registry.local_connections == {}
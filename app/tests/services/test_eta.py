@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from app.schemas.session import SessionRecord
+from app.services.eta import ALL_SIZES
+from app.services.eta import EtaSnapshot
+from app.services.eta import ProcessingTimes
+from app.services.eta import size_bucket
+
+GAMMA = 1.1
+
+
+def times(*durations: float) -> ProcessingTimes:
+    bins: dict[int, int] = {}
+    for duration in durations:
+        index = math.ceil(math.log(duration, GAMMA))
+        bins[index] = bins.get(index, 0) + 1
+    return ProcessingTimes(GAMMA, ewma=sum(durations) / len(durations), count=len(durations), bins=bins)
+
+
+def test_size_bucket() -> None:
+    assert size_bucket(None) is None
+    assert size_bucket(1000) == '1mb'
+    assert size_bucket(5 * 1024 * 1024) == '8mb'
+    assert size_bucket(8 * 1024 * 1024) == '8mb'
+
+
+def test_quantiles_within_relative_error() -> None:
+    durations = times(*range(1, 101))
+
+    assert durations.quantile(0.5) == pytest.approx(50, rel=(GAMMA - 1) / 2)
+    assert durations.quantile(0.9) == pytest.approx(90, rel=(GAMMA - 1) / 2)
+    assert ProcessingTimes(GAMMA).quantile(0.5) is None
+
+
+def test_estimate_shares_queue_between_workers() -> None:
+    eta = EtaSnapshot(
+        {ALL_SIZES: times(10, 20, 30), '8mb': times(100, 100, 100)},
+        workers=2,
+        default=60,
+        min_samples=3,
+    )
+
+    in_progress = SessionRecord(status='in progress', input_size=5 * 1024 * 1024)
+    assert eta.estimate(in_progress) == pytest.approx(100, rel=0.05)
+    # Only the part not covered by the progress is left
+    in_progress.progress = 90
+    assert eta.estimate(in_progress) == pytest.approx(10, rel=0.1)
+    # Four tasks ahead shared by two workers take twice the average, then the task itself
+    queued = SessionRecord(status='queued', position=4, input_size=1000)
+    assert eta.estimate(queued) == 2 * 20 + 20
+    assert eta.estimate(SessionRecord(status='completed')) is None
+    assert eta.estimate(SessionRecord(status='unknown')) is None
+    assert eta.estimate(SessionRecord()) is None
+    assert EtaSnapshot({}, workers=0, default=60, min_samples=3).estimate(queued) == 4 * 60 + 60
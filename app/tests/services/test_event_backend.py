@@ -0,0 +1,175 @@
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.schemas.events import Event
+from app.schemas.events import EventData
+from app.schemas.events import EventEncoding
+from app.schemas.events import EventStorage
+from app.schemas.events import NotificationType
+from app.services.event_backend import MemoryEventBackend
+from app.services.event_backend import RedisEventBackend
+from app.services.event_backend import as_frame
+from app.services.event_backend import encode_event
+from app.services.event_backend import parse_stream_id
+from app.services.expiry import ExpiryEngine
+from app.services.pubsub import PubSubMultiplexer
+from app.services.redis_service import BaseRedis
+
+
+@pytest.fixture
+def stream_backend() -> RedisEventBackend:
+    base_redis = BaseRedis()
+    base_redis.redis = MagicMock()
+    base_redis.redis.pipeline.return_value.__aenter__.return_value = AsyncMock()
+    base_redis.redis.register_script.return_value = AsyncMock()
+    return RedisEventBackend(
+        base_redis,
+        PubSubMultiplexer(base_redis),
+        ExpiryEngine(base_redis),
+        max_events_per_user=10,
+        message_lifetime=60,
+        storage=EventStorage.STREAM,
+    )
+
+
+def make_frame(message: str) -> str:
+    return Event(name='message', data=EventData(id='session', message=message)).as_sse_frame()
+
+
+def test_parse_stream_id() -> None:
+    assert parse_stream_id('1729106781695-3') == (1729106781695, 3)
+    assert parse_stream_id('garbage') is None
+    assert parse_stream_id(None) is None
+
+
+@pytest.mark.asyncio
+async def test_stream_append(stream_backend: RedisEventBackend) -> None:
+    await stream_backend.append('session', make_frame('hello'))
+
+    stream_backend.stream_post_script.assert_awaited_once_with(
+        keys=['event_stream:session', 'event_stream_id'],
+        args=[make_frame('hello'), 'user:session', 10, 60],
+    )
+
+
+def test_compact_event_round_trip() -> None:
+    events = [
+        Event(name='message', data=EventData(id='session', message='hello')),
+        Event(
+            name='progress',
+            data=EventData(id='other', message='50', notification_type=NotificationType.INFO, info={'progress': 50}),
+            coalesce=True,
+            retry=1000,
+        ),
+    ]
+
+    for event in events:
+        frame = event.as_sse_frame()
+        stored = encode_event(frame, 'session')
+        assert len(stored) < len(frame)
+        assert as_frame(stored, session_id='session') == frame
+    assert encode_event(make_frame('hello'), 'session') == '~1["message","hello"]'
+    # Frames and JSON events stored by older workers are still read
+    assert as_frame(make_frame('hello'), session_id='session') == make_frame('hello')
+    assert as_frame(events[0].model_dump_json()) == make_frame('hello')
+
+
+@pytest.mark.asyncio
+async def test_stream_append_compact(stream_backend: RedisEventBackend) -> None:
+    stream_backend.encoding = EventEncoding.COMPACT
+
+    await stream_backend.append('session', make_frame('hello'))
+
+    stream_backend.stream_post_script.assert_awaited_once_with(
+        keys=['event_stream:session', 'event_stream_id'],
+        args=[make_frame('hello'), 'user:session', 10, 60, '~1["message","hello"]'],
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_history_resumes_after_last_event_id(stream_backend: RedisEventBackend) -> None:
+    pipeline = stream_backend.redis.pipeline.return_value.__aenter__.return_value
+    legacy = Event(name='message', data=EventData(id='session', message='legacy'))
+    pipeline.execute.return_value = [
+        [('100-1', {'frame': make_frame('second')})],
+        [('100-0', {'event': legacy.model_dump_json()})],
+    ]
+
+    frames = await stream_backend.history('session', '99-0')
+
+    pipeline.xrange.assert_any_await('event_stream:session', min='(99-0')
+    pipeline.xrange.assert_any_await('broadcast:stream', min='(99-0')
+    assert [entry_id for entry_id, _ in frames] == ['100-0', '100-1']
+    assert frames[0][1].startswith('id: 100-0\nevent: message\ndata: ')
+    assert '"info":{"broadcast":true}' in frames[0][1]
+    assert frames[1][1] == 'id: 100-1\n' + make_frame('second')
+
+
+@pytest.mark.asyncio
+async def test_stream_posts_share_one_id_counter(stream_backend: RedisEventBackend) -> None:
+    await stream_backend.append('session', make_frame('hello'))
+    await stream_backend.append(None, make_frame('everyone'))
+
+    keys = [call.kwargs['keys'] for call in stream_backend.stream_post_script.await_args_list]
+    assert keys == [['event_stream:session', 'event_stream_id'], ['broadcast:stream', 'event_stream_id']]
+
+
+@pytest.mark.asyncio
+async def test_stream_history_resumes_broadcast_posted_in_same_millisecond(stream_backend: RedisEventBackend) -> None:
+    pipeline = stream_backend.redis.pipeline.return_value.__aenter__.return_value
+    # The session event and the broadcast were posted in the same millisecond, the counter told them apart
+    pipeline.execute.return_value = [[], [('100-1', {'frame': make_frame('everyone')})]]
+
+    frames = await stream_backend.history('session', '100-0')
+
+    pipeline.xrange.assert_any_await('broadcast:stream', min='(100-0')
+    assert [entry_id for entry_id, _ in frames] == ['100-1']
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_fan_out() -> None:
+    backend = MemoryEventBackend()
+    first, second = asyncio.Queue(), asyncio.Queue()
+    await backend.subscribe(first, 'user:1', 'broadcast:all')
+    await backend.subscribe(second, 'user:2', 'broadcast:all')
+
+    await backend.append('1', 'personal')
+    await backend.append(None, 'everyone')
+    await backend.publish([('2', 'notice')])
+
+    first_messages = [first.get_nowait() for _ in range(first.qsize())]
+    second_messages = [second.get_nowait() for _ in range(second.qsize())]
+    assert [channel for channel, _ in first_messages] == ['user:1', 'broadcast:all']
+    assert first_messages[0][1].startswith('id: ') and first_messages[0][1].endswith('\npersonal')
+    assert [frame for _, frame in second_messages][1] == 'notice'
+
+    await backend.unsubscribe(first, 'user:1', 'broadcast:all')
+    await backend.unsubscribe(second, 'user:2', 'broadcast:all')
+    assert backend.stats()['channels'] == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_history() -> None:
+    backend = MemoryEventBackend(max_events_per_user=2, message_lifetime=60)
+    for message in ('1', '2', '3'):
+        await backend.append('session', message)
+    await backend.append(None, 'everyone')
+
+    frames = await backend.history('session')
+    assert [frame.rpartition('\n')[2] for _, frame in frames] == ['2', '3']
+
+    resumed = await backend.history('session', frames[0][0])
+    assert [frame.rpartition('\n')[2] for _, frame in resumed] == ['3', 'everyone']
+    assert parse_stream_id(resumed[0][0]) < parse_stream_id(resumed[1][0])
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_history_expires() -> None:
+    backend = MemoryEventBackend(message_lifetime=0)
+    await backend.append('session', 'gone')
+
+    assert await backend.history('session') == []
+    assert backend.stats()['histories'] == 0
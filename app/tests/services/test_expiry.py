@@ -0,0 +1,80 @@
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.expiry import ExpiryEngine
+from app.services.redis_service import BaseRedis
+
+
+@pytest.fixture
+def mock_pipeline() -> AsyncMock:
+    pipeline = AsyncMock()
+    pipeline.execute.return_value = []
+    return pipeline
+
+
+@pytest.fixture
+def expiry_engine(mock_pipeline: AsyncMock) -> ExpiryEngine:
+    base_redis = BaseRedis()
+    base_redis.redis = MagicMock()
+    base_redis.redis.pipeline.return_value.__aenter__.return_value = mock_pipeline
+    return ExpiryEngine(base_redis, resolution=0.01)
+
+
+@pytest.mark.asyncio
+async def test_due_commands_are_batched(expiry_engine: ExpiryEngine, mock_pipeline: AsyncMock) -> None:
+    mock_pipeline.execute.return_value = [1, 1, 1]
+
+    expiry_engine.schedule(0.05, 'lrem', 'event:1', 1, 'a')
+    expiry_engine.schedule(0.055, 'lrem', 'event:2', 1, 'b')
+    expiry_engine.schedule(0, 'hdel', 'sse:active_connections', '1')
+    expiry_engine.schedule(60, 'lrem', 'event:3', 1, 'c')
+    assert expiry_engine.stats()['pending'] == 4
+
+    await asyncio.sleep(0.01)
+    mock_pipeline.hdel.assert_awaited_once_with('sse:active_connections', '1')
+    mock_pipeline.lrem.assert_not_awaited()
+
+    await asyncio.sleep(0.1)
+    assert mock_pipeline.lrem.await_count == 2
+    mock_pipeline.execute.assert_awaited_with(raise_on_error=False)
+
+    stats = expiry_engine.stats()
+    assert stats['pending'] == 1
+    assert stats['scheduled'] == 4
+    assert stats['batches'] == 2
+
+    await expiry_engine.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_commands_are_counted(expiry_engine: ExpiryEngine, mock_pipeline: AsyncMock) -> None:
+    mock_pipeline.execute.return_value = [1, Exception('WRONGTYPE')]
+
+    expiry_engine.schedule(0, 'lrem', 'event:1', 1, 'a')
+    expiry_engine.schedule(0, 'lrem', 'event:2', 1, 'b')
+    await asyncio.sleep(0.01)
+
+    assert expiry_engine.stats()['expired'] == 1
+    assert expiry_engine.stats()['failed'] == 1
+
+    await expiry_engine.close()
+
+
+@pytest.mark.asyncio
+async def test_close_runs_due_commands(expiry_engine: ExpiryEngine, mock_pipeline: AsyncMock) -> None:
+    expiry_engine.batch_size = 1
+    mock_pipeline.execute.return_value = [1]
+
+    expiry_engine.schedule(0, 'zrem', 'sse:connections', '1')
+    expiry_engine.schedule(0, 'hdel', 'sse:connection_info', '1')
+    expiry_engine.schedule(60, 'lrem', 'event:1', 1, 'a')
+    await expiry_engine.close()
+
+    mock_pipeline.zrem.assert_awaited_once_with('sse:connections', '1')
+    mock_pipeline.hdel.assert_awaited_once_with('sse:connection_info', '1')
+    mock_pipeline.lrem.assert_not_awaited()
+    stats = expiry_engine.stats()
+    assert (stats['expired'], stats['batches'], stats['pending']) == (2, 2, 1)
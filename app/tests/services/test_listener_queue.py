@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.services.listener_queue import ListenerQueue
+from app.services.listener_queue import QueueMetrics
+from app.services.listener_queue import QueuePolicy
+from app.services.listener_queue import SlowConsumerError
+
+
+def drain(queue: ListenerQueue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_drop_oldest() -> None:
+    metrics = QueueMetrics()
+    queue = ListenerQueue(3, QueuePolicy.DROP_OLDEST, metrics=metrics)
+    for i in range(5):
+        queue.put_nowait(i)
+
+    assert metrics.stats() == {'queues': 1, 'depth': 3, 'max_depth': 3, 'dropped': 2, 'disconnected': 0}
+    assert drain(queue) == [2, 3, 4]
+
+
+def test_on_drop_gets_every_lost_message() -> None:
+    lost = []
+    queue = ListenerQueue(2, QueuePolicy.DROP_OLDEST, on_drop=lost.append)
+    for i in range(4):
+        queue.put_nowait(i)
+
+    queue.close()
+
+    assert lost == [0, 1, 2, 3]
+
+
+def test_coalesce_replaces_message_with_same_key() -> None:
+    queue = ListenerQueue(3, QueuePolicy.COALESCE, key=lambda item: item[0] if item[0] != 'msg' else None)
+    for item in [('msg', 1), ('progress', 10), ('msg', 2), ('progress', 20), ('msg', 3)]:
+        queue.put_nowait(item)
+
+    # ('progress', 20) replaced ('progress', 10), then ('msg', 3) has no key and dropped the oldest message
+    assert drain(queue) == [('msg', 2), ('progress', 20), ('msg', 3)]
+    assert queue.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_disconnect_closes_queue() -> None:
+    metrics = QueueMetrics()
+    queue = ListenerQueue(2, QueuePolicy.DISCONNECT, metrics=metrics)
+    for i in range(3):
+        queue.put_nowait(i)
+
+    assert queue.closed
+    assert metrics.disconnected == 1
+    with pytest.raises(SlowConsumerError):
+        await queue.get()
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_message() -> None:
+    queue = ListenerQueue(2)
+    getter = asyncio.create_task(queue.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+
+    queue.put_nowait('hello')
+    assert await asyncio.wait_for(getter, timeout=1) == 'hello'
@@ -0,0 +1,53 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.services.progress_writer import ProgressWriter
+
+
+@pytest.mark.asyncio
+async def test_writes_are_throttled_and_batched() -> None:
+    write = AsyncMock()
+    writer = ProgressWriter(write, min_delta=10, min_interval=60, tick=0.01)
+
+    writer.update('a', 0)
+    writer.update('b', 0)
+    await asyncio.sleep(0.03)
+    write.assert_awaited_once_with({'a': 0, 'b': 0})
+
+    # Small steps are held back until they add up to min_delta
+    for progress in range(1, 10):
+        writer.update('a', progress)
+        await asyncio.sleep(0.02)
+    assert write.await_count == 1
+    writer.update('a', 12)
+    writer.update('b', 30)
+    await asyncio.sleep(0.03)
+    assert write.await_args.args == ({'a': 12, 'b': 30},)
+
+    # The final value is written right away, whatever it changed
+    writer.update('a', 13)
+    await writer.flush('a')
+    assert write.await_args.args == ({'a': 13},)
+    assert writer.stats()['sessions'] == 1
+
+    await writer.close()
+    assert write.await_count == 3
+    assert writer.stats()['writes'] == 5
+
+
+@pytest.mark.asyncio
+async def test_unchanged_progress_is_rewritten_after_min_interval() -> None:
+    write = AsyncMock()
+    writer = ProgressWriter(write, min_delta=50, min_interval=0.2, tick=0.01)
+
+    writer.update('a', 1)
+    await asyncio.sleep(0.03)
+    writer.update('a', 2)
+    await asyncio.sleep(0.03)
+    assert write.await_count == 1
+    await asyncio.sleep(0.2)
+
+    assert write.await_args_list[-1].args == ({'a': 2},)
+    await writer.close()
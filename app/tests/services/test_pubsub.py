@@ -0,0 +1,78 @@
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.pubsub import PubSubMultiplexer
+from app.services.redis_service import BaseRedis
+
+
+@pytest.fixture
+def mock_pubsub() -> AsyncMock:
+    pubsub = AsyncMock()
+    pubsub.get_message.return_value = None
+    return pubsub
+
+
+@pytest.fixture
+def pubsub_mux(mock_pubsub: AsyncMock) -> PubSubMultiplexer:
+    base_redis = BaseRedis()
+    base_redis.redis = MagicMock()
+    base_redis.redis.pubsub.return_value = mock_pubsub
+    return PubSubMultiplexer(base_redis, read_timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_is_reference_counted(pubsub_mux: PubSubMultiplexer, mock_pubsub: AsyncMock) -> None:
+    first, second = asyncio.Queue(), asyncio.Queue()
+
+    await pubsub_mux.subscribe(first, 'user:1', 'broadcast:all')
+    await pubsub_mux.subscribe(second, 'user:2', 'broadcast:all')
+
+    assert mock_pubsub.subscribe.await_args_list[0].args == ('user:1', 'broadcast:all')
+    assert mock_pubsub.subscribe.await_args_list[1].args == ('user:2',)
+    assert pubsub_mux.redis.pubsub.call_count == 1
+
+    await pubsub_mux.unsubscribe(first, 'user:1', 'broadcast:all')
+    mock_pubsub.unsubscribe.assert_awaited_once_with('user:1')
+
+    await pubsub_mux.unsubscribe(second, 'user:2', 'broadcast:all')
+    assert mock_pubsub.unsubscribe.await_args.args == ('user:2', 'broadcast:all')
+    assert pubsub_mux.stats() == {'channels': 0, 'listeners': 0}
+
+    await pubsub_mux.close()
+
+
+@pytest.mark.asyncio
+async def test_messages_are_demultiplexed(pubsub_mux: PubSubMultiplexer, mock_pubsub: AsyncMock) -> None:
+    first, second = asyncio.Queue(), asyncio.Queue()
+    await pubsub_mux.subscribe(first, 'user:1', 'broadcast:all')
+    await pubsub_mux.subscribe(second, 'user:2', 'broadcast:all')
+
+    pubsub_mux._dispatch('user:1', 'personal')
+    pubsub_mux._dispatch('broadcast:all', 'everyone')
+
+    assert first.get_nowait() == ('user:1', 'personal')
+    assert first.get_nowait() == ('broadcast:all', 'everyone')
+    assert second.get_nowait() == ('broadcast:all', 'everyone')
+    assert second.empty()
+
+    await pubsub_mux.close()
+
+
+@pytest.mark.asyncio
+async def test_reader_dispatches_messages(pubsub_mux: PubSubMultiplexer, mock_pubsub: AsyncMock) -> None:
+    messages = [{'type': 'message', 'channel': 'user:1', 'data': 'hello'}]
+
+    async def get_message(**kwargs) -> dict | None:
+        await asyncio.sleep(kwargs['timeout'])
+        return messages.pop() if messages else None
+
+    mock_pubsub.get_message.side_effect = get_message
+    queue = asyncio.Queue()
+    await pubsub_mux.subscribe(queue, 'user:1')
+
+    assert await asyncio.wait_for(queue.get(), timeout=1) == ('user:1', 'hello')
+
+    await pubsub_mux.close()
@@ -1,14 +1,23 @@
+import json
 from collections.abc import AsyncGenerator
 from datetime import datetime
 from typing import Any
+from unittest.mock import ANY
 from unittest.mock import AsyncMock
 from unittest.mock import patch
 
 import pytest
 
+from app.core.config import settings
+from app.schemas.session import SessionRecord
 from app.schemas.task import TaskStatus
+from app.services.redis_service import QUEUE_KEY
+from app.services.redis_service import SESSION_CHANGED_CHANNEL
 from app.services.redis_service import APIRedis
 from app.services.redis_service import BaseRedis
+from app.services.redis_service import TaskAlreadyQueuedError
+from app.services.redis_service import decode_session
+from app.services.redis_service import encode_session
 
 
 @pytest.fixture
@@ -68,13 +77,13 @@ async def test_get_status(redis_service: APIRedis) -> None:
     expected_status = TaskStatus.QUEUED.value  # Используем .value, так как Redis хранит строковые значения
 
     pipeline_mock = AsyncMock()
-    pipeline_mock.execute.return_value = [expected_status]
+    pipeline_mock.execute.return_value = [[expected_status, None]]
     redis_service.redis.pipeline.return_value.__aenter__.return_value = pipeline_mock
 
     # result = await redis_service.get_session_data(session_id=session_id, status=True)
     result = await redis_service.get_session_data_single(session_id=session_id, field='status')
 
-    pipeline_mock.hget.assert_awaited_once_with(f'session:{session_id}', 'status')
+    pipeline_mock.hmget.assert_awaited_once_with(f'session:{session_id}', ['status', 'v'])
     pipeline_mock.execute.assert_awaited_once()
 
     assert result == expected_status
@@ -93,7 +102,7 @@ async def test_get_position(redis_service: APIRedis) -> None:
     # position = await redis_service.get_session_data(session_id=session_id, position=True)
     position = await redis_service.get_session_data_single(session_id=session_id, field='position')
 
-    pipeline_mock.lpos.assert_awaited_once_with('processing_queue', session_id)
+    pipeline_mock.zrank.assert_awaited_once_with(QUEUE_KEY, session_id)
     pipeline_mock.execute.assert_awaited_once()
     # redis_service.redis.lpos.assert_awaited_once_with('processing_queue', session_id)
     assert position == expected_position
@@ -105,14 +114,14 @@ async def test_get_completed_timestamp(redis_service: APIRedis) -> None:
     expected_timestamp = datetime.now().timestamp()
 
     pipeline_mock = AsyncMock()
-    pipeline_mock.execute.return_value = [expected_timestamp]
+    pipeline_mock.execute.return_value = [[str(expected_timestamp), None]]
     redis_service.redis.pipeline.return_value.__aenter__.return_value = pipeline_mock
 
     # timestamp = await redis_service.get_completed_timestamp(session_id)
     # timestamp = await redis_service.get_session_data(session_id=session_id, completed_timestamp=True)
     timestamp = await redis_service.get_session_data_single(session_id=session_id, field='completed_timestamp')
 
-    pipeline_mock.hget.assert_awaited_once_with(f'session:{session_id}', 'completed_timestamp')
+    pipeline_mock.hmget.assert_awaited_once_with(f'session:{session_id}', ['completed_timestamp', 'v'])
     pipeline_mock.execute.assert_awaited_once()
     assert timestamp == expected_timestamp
 
@@ -163,3 +172,175 @@ async def test_check_redis_connection_error(redis_base_service: BaseRedis) -> No
         mock_logger.error.assert_called_once_with(
             'Error connecting to Redis server. Please check the connection settings.',
         )
+
+
+@pytest.mark.asyncio
+async def test_set_progress_publishes_change(redis_service: APIRedis, mock_redis: AsyncMock) -> None:
+    pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+    redis_service.progress_script = AsyncMock()
+
+    await redis_service.set_progress('test_session', 42)
+
+    kwargs = redis_service.progress_script.await_args.kwargs
+    assert kwargs['client'] is pipe
+    session_id, changes, session_channel, changed_channel, _, _, fields, *ttls = kwargs['args']
+    assert (session_id, changes) == ('test_session', '{"progress": 42}')
+    assert (session_channel, changed_channel) == ('session_status:test_session', SESSION_CHANGED_CHANNEL)
+    assert json.loads(fields) == {'v': '1', 'progress': '42'}
+    # Only written while the task is running, with the TTL of its current status
+    assert ttls == [
+        TaskStatus.UPLOADING.value,
+        redis_service.ttls[TaskStatus.UPLOADING],
+        'u',
+        redis_service.ttls[TaskStatus.UPLOADING],
+        TaskStatus.IN_PROGRESS.value,
+        redis_service.ttls[TaskStatus.IN_PROGRESS],
+        'p',
+        redis_service.ttls[TaskStatus.IN_PROGRESS],
+    ]
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_create_task_enqueues_if_absent(redis_service: APIRedis) -> None:
+    redis_service.enqueue_script = AsyncMock(return_value=[1, 4])
+
+    assert await redis_service.create_task('test_session', 'track') == 4
+
+    kwargs = redis_service.enqueue_script.await_args.kwargs
+    assert kwargs['keys'] == ['session:test_session', QUEUE_KEY]
+    session_id, changes, session_channel, changed_channel, _, ttl, _, fields = kwargs['args']
+    assert session_id == 'test_session'
+    assert ttl == redis_service.ttls[TaskStatus.QUEUED]
+    assert (session_channel, changed_channel) == ('session_status:test_session', SESSION_CHANGED_CHANNEL)
+    assert json.loads(changes)['status'] == TaskStatus.QUEUED.value
+    # Default values are deleted from the hash
+    assert json.loads(fields) == {
+        'v': '1',
+        'track_id': 'track',
+        'progress': None,
+        'status': 'q',
+        'timestamp': ANY,
+        'download_url': None,
+    }
+
+    redis_service.enqueue_script.return_value = [0, 4]
+    with pytest.raises(TaskAlreadyQueuedError):
+        await redis_service.create_task('test_session', 'track')
+
+
+@pytest.mark.asyncio
+async def test_transition_passes_allowed_statuses(redis_service: APIRedis) -> None:
+    redis_service.transition_script = AsyncMock(return_value=[0, 'q'])
+
+    applied, previous = await redis_service.transition(
+        'test_session',
+        TaskStatus.UPLOADING,
+        allowed_from=[TaskStatus.WAITING, TaskStatus.FAILED],
+        unqueued=True,
+    )
+
+    assert (applied, previous) == (False, TaskStatus.QUEUED.value)
+    assert redis_service.transition_script.await_args.kwargs['args'][5:] == [
+        redis_service.ttls[TaskStatus.UPLOADING], 1, 'u', 'waiting', 'w', 'failed', 'f',
+    ]
+
+
+def test_session_ttl_depends_on_state(redis_service: APIRedis) -> None:
+    assert redis_service.session_ttl(TaskStatus.WAITING) == settings.SESSION_IDLE_EXPIRE_SEC
+    assert redis_service.session_ttl('queued') == settings.QUEUE_EXPIRE_SEC
+    assert redis_service.session_ttl(TaskStatus.COMPLETED) == settings.SESSION_EXPIRE_MINUTES * 60
+    assert redis_service.session_ttl(None) == redis_service.session_ttl('unknown') == settings.SESSION_IDLE_EXPIRE_SEC
+
+
+@pytest.mark.asyncio
+async def test_set_status_refreshes_ttl(redis_service: APIRedis, mock_redis: AsyncMock) -> None:
+    pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+
+    await redis_service.set_status('test_session', TaskStatus.FAILED)
+
+    pipe.expire.assert_awaited_once_with('session:test_session', redis_service.ttls[TaskStatus.FAILED])
+
+
+@pytest.mark.asyncio
+async def test_read_session_decodes_fields(redis_service: APIRedis, mock_redis: AsyncMock) -> None:
+    pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+    pipe.execute.return_value = [['queued', '5', '1729106781.5', None, '', None], 3]
+
+    record = await redis_service.read_session(
+        'test_session',
+        ['status', 'progress', 'completed_timestamp', 'track_id', 'download_url', 'position'],
+    )
+
+    mock_redis.pipeline.assert_called_with(transaction=False)
+    pipe.hmget.assert_awaited_once_with(
+        'session:test_session',
+        ['status', 'progress', 'completed_timestamp', 'track_id', 'download_url', 'v'],
+    )
+    pipe.zrank.assert_awaited_once_with(QUEUE_KEY, 'test_session')
+    assert record == SessionRecord(
+        status='queued',
+        progress=5,
+        completed_timestamp=1729106781.5,
+        download_url='',
+        position=3,
+    )
+
+    with pytest.raises(ValueError):
+        await redis_service.read_session('test_session', ['unknown'])
+
+
+@pytest.mark.asyncio
+async def test_read_sessions_uses_one_pipeline(redis_service: APIRedis, mock_redis: AsyncMock) -> None:
+    pipe = mock_redis.pipeline.return_value.__aenter__.return_value
+    pipe.execute.return_value = [['queued', None], 2, [None, None], None]
+
+    records = await redis_service.read_sessions(['a', 'b', 'a'], ['status', 'position'])
+
+    mock_redis.pipeline.assert_called_once_with(transaction=False)
+    assert [call.args for call in pipe.hmget.await_args_list] == [
+        ('session:a', ['status', 'v']),
+        ('session:b', ['status', 'v']),
+    ]
+    assert records == {'a': SessionRecord(status='queued', position=2), 'b': SessionRecord()}
+
+
+def test_compact_encoding_round_trip() -> None:
+    mapping = {'status': 'in progress', 'progress': 0, 'completed_timestamp': 1729106781.695, 'download_url': ''}
+    fields = ['status', 'progress', 'completed_timestamp', 'download_url']
+
+    encoded = encode_session(mapping, version=1)
+    assert encoded == {
+        'v': '1',
+        'status': 'p',
+        'progress': None,
+        'completed_timestamp': '1729106781695',
+        'download_url': None,
+    }
+    values = [encoded[field] for field in fields]
+    assert decode_session('test_session', fields, values, encoded['v']) == mapping
+
+    # Plain values of version 0, also found in hashes that were partly rewritten by version 1
+    legacy = encode_session(mapping, version=0)
+    assert legacy == {
+        'status': 'in progress',
+        'progress': '0',
+        'completed_timestamp': '1729106781.695',
+        'download_url': '',
+    }
+    assert decode_session('test_session', fields, [legacy[field] for field in fields]) == mapping
+
+
+def test_timestamp_decoding_follows_the_version() -> None:
+    fields = ['timestamp', 'completed_timestamp']
+
+    # Integral float seconds of version 0, with and without the e notation
+    assert decode_session('test_session', fields, ['1729106781', '1.729106781e9']) == {
+        'timestamp': 1729106781,
+        'completed_timestamp': 1729106781,
+    }
+    # Float seconds left in a version 1 hash by a version 0 write
+    assert decode_session('test_session', fields, ['1729106781695', '1729106781.5'], '1') == {
+        'timestamp': 1729106781.695,
+        'completed_timestamp': 1729106781.5,
+    }
@@ -0,0 +1,81 @@
+import asyncio
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.session_cache import SessionCache
+
+RECORD = {'status': 'queued', 'progress': 0, 'position': 3}
+
+
+async def started_cache() -> SessionCache:
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.unsubscribe = AsyncMock()
+    cache = SessionCache('sessions:changed', 'processing_queue:changed', maxsize=2, ttl=60)
+    await cache.start(pubsub)
+    pubsub.subscribe.assert_awaited_once_with(cache, 'sessions:changed', 'processing_queue:changed')
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_read_through_and_invalidation() -> None:
+    cache = await started_cache()
+    load = AsyncMock(return_value=RECORD)
+
+    assert await cache.read('a', ['status'], load) == RECORD
+    assert await cache.read('a', ['status', 'position'], load) == RECORD
+    assert load.await_count == 1
+
+    # A change of another session's queue entry only invalidates the cached positions
+    cache.put_nowait(('processing_queue:changed', 'b'))
+    await cache.read('a', ['status'], load)
+    assert load.await_count == 1
+    await cache.read('a', ['position'], load)
+    assert load.await_count == 2
+
+    cache.put_nowait(('sessions:changed', 'a'))
+    await cache.read('a', ['status'], load)
+    assert load.await_count == 3
+    assert cache.stats() == {
+        'active': True,
+        'size': 1,
+        'hits': 2,
+        'misses': 3,
+        'hit_ratio': 0.4,
+        'invalidations': 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_is_evicted() -> None:
+    cache = await started_cache()
+    load = AsyncMock(return_value=RECORD)
+    for session_id in ('a', 'b', 'a', 'c'):
+        await cache.read(session_id, ['status'], load)
+
+    assert load.await_count == 3
+
+    # 'b' was the least recently used one when 'c' was added
+    await cache.read('a', ['status'], load)
+    await cache.read('b', ['status'], load)
+    assert load.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_record_changed_while_loading_is_not_cached() -> None:
+    cache = await started_cache()
+    loaded = asyncio.Event()
+
+    async def load() -> dict:
+        await loaded.wait()
+        return RECORD
+
+    reader = asyncio.create_task(cache.read('a', ['status'], load))
+    await asyncio.sleep(0)
+    cache.invalidate('a')
+    loaded.set()
+    assert await reader == RECORD
+
+    assert cache.stats()['size'] == 0
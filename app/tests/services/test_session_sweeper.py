@@ -0,0 +1,40 @@
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.redis_service import QUEUE_KEY
+from app.services.redis_service import APIRedis
+from app.services.session_sweeper import SessionSweeper
+
+
+@pytest.fixture
+def service() -> MagicMock:
+    service = MagicMock(spec=APIRedis)
+    service.redis = MagicMock()
+    service.redis.pipeline.return_value.__aenter__.return_value = AsyncMock()
+    service.session_ttl.side_effect = lambda status: {'completed': 1000}.get(status, 10)
+    return service
+
+
+@pytest.mark.asyncio
+async def test_sweep_walks_keys_in_batches(service: MagicMock) -> None:
+    redis = service.redis
+    pipe = redis.pipeline.return_value.__aenter__.return_value
+    redis.zscan = AsyncMock(side_effect=[(7, [('a', 1.0), ('b', 2.0)]), (0, [('c', 3.0)])])
+    service.remove_orphans = AsyncMock(side_effect=[1, 0])
+    redis.scan = AsyncMock(side_effect=[(5, ['session:a', 'session:d']), (0, [])])
+    # TTL and status of session:a and session:d
+    pipe.execute.side_effect = [[-1, 'completed', 60, 'queued'], [True]]
+    sweeper = SessionSweeper(service, batch_size=2, pause=0)
+
+    result = await sweeper.sweep()
+
+    assert (result['orphans_removed'], result['expirations_set']) == (1, 1)
+    assert [call.args for call in service.remove_orphans.await_args_list] == [(['a', 'b'],), (['c'],)]
+    assert [call.kwargs['cursor'] for call in redis.zscan.await_args_list] == [0, 7]
+    assert redis.zscan.await_args.args == (QUEUE_KEY,)
+    assert [call.kwargs['cursor'] for call in redis.scan.await_args_list] == [0, 5]
+    pipe.expire.assert_awaited_once_with('session:a', 1000)
+    assert sweeper.stats()['scanned'] == 5
+    assert sweeper.stats()['passes'] == 1
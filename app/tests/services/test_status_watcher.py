@@ -0,0 +1,99 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.services.listener_queue import ListenerQueue
+from app.services.redis_service import QUEUE_CHANNEL
+from app.services.redis_service import APIRedis
+from app.services.status_watcher import SessionStatusWatcher
+
+FIELDS = ['status', 'progress', 'position']
+
+
+@pytest.fixture
+def service() -> MagicMock:
+    service = MagicMock(spec=APIRedis)
+    service.get_session_data_multiple = AsyncMock(return_value={'status': 'queued', 'progress': 0, 'position': 3})
+    service.get_session_data_single = AsyncMock(return_value=2)
+    return service
+
+
+@pytest.fixture
+def pubsub() -> MagicMock:
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.unsubscribe = AsyncMock()
+    return pubsub
+
+
+def subscribed_queue(pubsub: MagicMock) -> ListenerQueue:
+    return pubsub.subscribe.await_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_changes_are_pushed_without_polling(service: MagicMock, pubsub: MagicMock) -> None:
+    watcher = SessionStatusWatcher(service, pubsub, resync_interval=60)
+    stream = watcher.watch('1', FIELDS)
+
+    assert await stream.__anext__() == {'status': 'queued', 'progress': 0, 'position': 3}
+    assert pubsub.subscribe.await_args.args[1:] == ('session_status:1', QUEUE_CHANNEL)
+
+    queue = subscribed_queue(pubsub)
+    queue.put_nowait(('session_status:1', json.dumps({'progress': 10})))
+    queue.put_nowait(('session_status:1', json.dumps({'progress': 20, 'track_id': 'x'})))
+    assert await stream.__anext__() == {'status': 'queued', 'progress': 20, 'position': 3}
+
+    queue.put_nowait((QUEUE_CHANNEL, '2'))
+    assert await stream.__anext__() == {'status': 'queued', 'progress': 20, 'position': 2}
+    service.get_session_data_single.assert_awaited_once_with('1', 'position')
+    service.get_session_data_multiple.assert_awaited_once()
+
+    await stream.aclose()
+    pubsub.unsubscribe.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_unchanged_state_is_not_sent(service: MagicMock, pubsub: MagicMock) -> None:
+    watcher = SessionStatusWatcher(service, pubsub, resync_interval=60)
+    stream = watcher.watch('1', FIELDS)
+    await stream.__anext__()
+
+    queue = subscribed_queue(pubsub)
+    queue.put_nowait(('session_status:1', json.dumps({'progress': 0})))
+    queue.put_nowait(('session_status:1', json.dumps({'status': 'in_progress'})))
+
+    # The position is re-read on a status change
+    assert await stream.__anext__() == {'status': 'in_progress', 'progress': 0, 'position': 2}
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_queue_changes_are_ignored_out_of_the_queue(service: MagicMock, pubsub: MagicMock) -> None:
+    service.get_session_data_multiple.return_value = {'status': 'completed', 'progress': 100, 'position': None}
+    watcher = SessionStatusWatcher(service, pubsub, resync_interval=60)
+    stream = watcher.watch('1', FIELDS)
+    await stream.__anext__()
+
+    queue = subscribed_queue(pubsub)
+    queue.put_nowait((QUEUE_CHANNEL, '2'))
+    queue.put_nowait((QUEUE_CHANNEL, '3'))
+    queue.put_nowait(('session_status:1', json.dumps({'progress': 0})))
+
+    assert await stream.__anext__() == {'status': 'completed', 'progress': 0, 'position': None}
+    service.get_session_data_single.assert_not_awaited()
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_periodic_resync(service: MagicMock, pubsub: MagicMock) -> None:
+    watcher = SessionStatusWatcher(service, pubsub, resync_interval=0.01)
+    stream = watcher.watch('1', ['status'])
+    await stream.__anext__()
+    assert pubsub.subscribe.await_args.args[1:] == ('session_status:1',)
+
+    service.get_session_data_multiple.return_value = {'status': 'completed'}
+    assert await asyncio.wait_for(stream.__anext__(), 1) == {'status': 'completed'}
+    await stream.aclose()
@@ -0,0 +1,45 @@
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.redis_memory_report import ReportConfig
+from app.redis_memory_report import key_group
+from app.redis_memory_report import parse_args
+from app.redis_memory_report import scan_keyspace
+
+
+def test_key_group() -> None:
+    assert key_group('session:abc') == 'session'
+    assert key_group('session_sweeper:lock') == 'session_sweeper'
+    assert key_group('processing_queue:zset') == 'processing_queue'
+    assert key_group('event_stream:abc') == 'event_stream'
+    assert key_group('sse:connections') == 'sse'
+    assert key_group('unknown') == 'other'
+
+
+def test_parse_args() -> None:
+    config, args = parse_args(['--sample-rate', '0.5', '--max-keys', '100', '--json'])
+
+    assert config.sample_rate == 0.5
+    assert config.max_keys == 100
+    assert args.json
+
+
+@pytest.mark.asyncio
+async def test_scan_keyspace_samples_keys_in_batches() -> None:
+    redis = MagicMock()
+    pipe = redis.pipeline.return_value.__aenter__.return_value = AsyncMock()
+    redis.scan = AsyncMock(side_effect=[(3, ['session:a', 'session:b']), (0, ['event:a', 'session:c'])])
+    # MEMORY USAGE and TTL of every sampled key, session:c is gone by the time it is measured
+    pipe.execute.side_effect = [[100, -1, 300, 60], [50, 5, None, -2]]
+    config = ReportConfig(sample_rate=1, pause=0, top=1)
+
+    groups = await scan_keyspace(redis, config)
+
+    assert [call.kwargs['cursor'] for call in redis.scan.await_args_list] == [0, 3]
+    sessions = groups['session'].summary()
+    assert (sessions['keys'], sessions['sampled'], sessions['estimated_bytes']) == (3, 2, 600)
+    assert sessions['ttl_coverage'] == 0.5
+    assert sessions['largest'] == [{'key': 'session:b', 'bytes': 300}]
+    assert groups['event'].summary()['memory_bytes']['max'] == 50